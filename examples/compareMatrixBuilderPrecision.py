@@ -0,0 +1,61 @@
+import argparse
+import time
+
+import numpy
+
+import lsst.geom
+import lsst.afw.geom.ellipses
+import lsst.shapelet
+
+
+def makePsf(order, rng):
+    ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.5, 1.2, 0.3))
+    psf = lsst.shapelet.ShapeletFunction(order, lsst.shapelet.HERMITE, ellipse)
+    size = psf.getCoefficients().size
+    psf.getCoefficients()[:] = rng.randn(size) / numpy.arange(1, size + 1)
+    return psf
+
+
+def timeBuilder(builder, ellipse, nCalls):
+    output = builder.allocateOutput()
+    t1 = time.perf_counter()
+    for n in range(nCalls):
+        builder(output, ellipse)
+    t2 = time.perf_counter()
+    return (t2 - t1) / nCalls
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the accuracy and speed of single- and double-precision convolved MatrixBuilders"
+    )
+    parser.add_argument("--max-order", help="Maximum model order to test", default=8, type=int)
+    parser.add_argument("--max-psf-order", help="Maximum PSF order to test", default=8, type=int)
+    parser.add_argument("-n", "--data-size", help="Number of data points", default=4000, type=int)
+    parser.add_argument("--calls", help="Number of calls to time for each configuration", default=20,
+                        type=int)
+    args = parser.parse_args()
+    rng = numpy.random.RandomState(5)
+    xD = 4.0*rng.randn(args.data_size)
+    yD = 4.0*rng.randn(args.data_size)
+    xF = xD.astype(numpy.float32)
+    yF = yD.astype(numpy.float32)
+    ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(2.1, 1.4, 0.6),
+                                             lsst.geom.Point2D(-0.5, 0.2))
+    print("%9s  %5s  %14s  %12s  %12s" % ("psf order", "order", "max rel. error", "float s/call",
+                                          "double s/call"))
+    for psfOrder in range(0, args.max_psf_order + 1, 2):
+        psf = makePsf(psfOrder, rng)
+        for order in range(0, args.max_order + 1, 2):
+            builderF = lsst.shapelet.MatrixBuilderF(xF, yF, order, psf)
+            builderD = lsst.shapelet.MatrixBuilderD(xD, yD, order, psf)
+            matrixF = builderF(ellipse)
+            matrixD = builderD(ellipse)
+            error = numpy.abs(matrixF - matrixD).max() / numpy.abs(matrixD).max()
+            print("%9d  %5d  %14.3g  %12.4g  %12.4g" % (psfOrder, order, error,
+                                                        timeBuilder(builderF, ellipse, args.calls),
+                                                        timeBuilder(builderD, ellipse, args.calls)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import time
+
+import numpy
+
+import lsst.shapelet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HermiteTransformMatrix.compute")
+    parser.add_argument("--min-order", help="Minimum order to test", default=0, type=int)
+    parser.add_argument("--max-order", help="Maximum order to test", default=12, type=int)
+    parser.add_argument("-t", "--time", help="Approximate time to spend on each order (seconds)",
+                        default=1.0, type=float)
+    args = parser.parse_args()
+    transform = numpy.array([[1.2, 0.3], [-0.4, 0.9]])
+    print("%5s  %12s" % ("order", "seconds/call"))
+    for order in range(args.min_order, args.max_order + 1):
+        htm = lsst.shapelet.HermiteTransformMatrix(order)
+        # calibrate the number of calls so each order takes roughly the requested time
+        nCalls = 1
+        while True:
+            t1 = time.perf_counter()
+            for n in range(nCalls):
+                htm.compute(transform)
+            t2 = time.perf_counter()
+            if t2 - t1 > 0.2*args.time or nCalls > 10**7:
+                break
+            nCalls *= 2
+        nCalls = max(1, int(nCalls * args.time / max(t2 - t1, 1E-9)))
+        t1 = time.perf_counter()
+        for n in range(nCalls):
+            htm.compute(transform)
+        t2 = time.perf_counter()
+        print("%5d  %12.4g" % (order, (t2 - t1) / nCalls))
+
+
+if __name__ == "__main__":
+    main()
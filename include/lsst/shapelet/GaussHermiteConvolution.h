@@ -28,6 +28,7 @@
 #include "lsst/afw/geom/ellipses.h"
 #include "lsst/shapelet/HermiteTransformMatrix.h"
 
+#include <cstddef>
 #include <memory>
 
 namespace lsst { namespace shapelet {
@@ -38,6 +39,11 @@ class ShapeletFunction;
  *  @brief A parametrized matrix that performs a convolution in shapelet space.
  *
  *  GaussHermiteConvolution is defined only for the HERMITE basis type.
+ *
+ *  evaluate() writes to storage owned by the object (and updates its cache, if enabled), so a single
+ *  GaussHermiteConvolution must not be used from multiple threads at once; distinct objects may be
+ *  used concurrently, as the tables they share are guarded internally.  The Python bindings release
+ *  the GIL in evaluate().
  */
 class GaussHermiteConvolution {
 public:
@@ -61,6 +67,57 @@ public:
     /// @brief Return the order of the post-convolution shapelet basis.
     int getRowOrder() const;
 
+    /**
+     *  @brief Enable caching of evaluate() results, keyed on the input ellipse core.
+     *
+     *  The convolution matrix depends only on the ellipse core (not its center), so when the same
+     *  core is evaluated repeatedly (e.g. when only the centroid of a model changes), the cached
+     *  matrix can be returned instead of recomputing it.  The least-recently-used entry is discarded
+     *  when the cache is full.
+     *
+     *  @param[in] capacity   Maximum number of matrices to hold in the cache (must be positive).
+     *  @param[in] quantum    If zero, cores must match exactly (bit-for-bit) to be considered the same.
+     *                        If positive, the quadrupole moments of the input core are rounded to the
+     *                        nearest multiple of quantum before comparing them, and a cached matrix may
+     *                        be returned for a core that differs slightly from the one it was computed
+     *                        with.
+     *
+     *  Enabling the cache discards any previously-cached matrices and resets the hit/miss counters.
+     */
+    void enableCache(int capacity, double quantum=0.0);
+
+    /// @brief Disable caching of evaluate() results, and discard any cached matrices.
+    void disableCache();
+
+    /// @brief Return the maximum number of matrices held in the cache (0 if caching is disabled).
+    int getCacheCapacity() const;
+
+    /// @brief Return the number of calls to evaluate() that were satisfied by the cache.
+    long getCacheHitCount() const;
+
+    /// @brief Return the number of calls to evaluate() that had to compute a new matrix while caching.
+    long getCacheMissCount() const;
+
+    /**
+     *  @brief Return the approximate memory (in bytes) held by the process-wide cache of convolution tables.
+     *
+     *  The triple product integrals and Hermite transform matrices used to compute convolution matrices
+     *  depend only on the orders of the PSF and the bases, so they are computed once per set of orders
+     *  and shared (in a thread-safe way) by all GaussHermiteConvolution objects in the process.
+     */
+    static std::size_t getTableCacheBytes();
+
+    /// @brief Return the number of tables held by the process-wide cache of convolution tables.
+    static int getTableCacheCount();
+
+    /**
+     *  @brief Remove all tables from the process-wide cache of convolution tables.
+     *
+     *  Existing GaussHermiteConvolution objects keep the tables they are already using; tables will be
+     *  recomputed as needed when new objects are constructed.
+     */
+    static void clearTableCache();
+
     /// @brief Construct a matrix that convolves a basis of the given order with the given shapelet function.
     GaussHermiteConvolution(int colOrder, ShapeletFunction const & psf);
 
@@ -72,6 +72,29 @@ public:
         return compute(transform.getMatrix(), order);
     }
 
+    /**
+     *  @brief Compute the matrix for a new linear transform at the given order (must be <= getOrder())
+     *         into existing storage.
+     *
+     *  When called repeatedly with the same result and workspace objects and the same order, this
+     *  does not allocate any memory.
+     *
+     *  @param[in]     transform  Linear transform to compute the matrix for.
+     *  @param[in]     order      Order of the matrix; must be <= getOrder().
+     *  @param[out]    result     Matrix to fill; resized to computeSize(order) square if necessary.
+     *  @param[in,out] workspace  Scratch space; resized if it has fewer than computeWorkspace(order)
+     *                            elements.
+     */
+    void compute(
+        Eigen::Matrix2d const & transform,
+        int order,
+        Eigen::MatrixXd & result,
+        Eigen::VectorXd & workspace
+    ) const;
+
+    /// @brief Return the size of the workspace vector used by compute() at the given order.
+    static int computeWorkspace(int order);
+
     /**
      *  @brief Return the matrix that maps (1-d) regular polynomials to the alternate Hermite polynomials.
      *
@@ -23,7 +23,14 @@
 #ifndef LSST_SHAPELET_MatrixBuilder_h_INCLUDED
 #define LSST_SHAPELET_MatrixBuilder_h_INCLUDED
 
+#include <memory>
+#include <mutex>
+#include <set>
+#include <utility>
+#include <vector>
+
 #include "ndarray.h"
+#include "lsst/geom.h"
 
 #include "lsst/shapelet/constants.h"
 #include "lsst/shapelet/ShapeletFunction.h"
@@ -39,6 +46,15 @@ class MatrixBuilderFactory;
 template <typename T>
 class MatrixBuilderWorkspace;
 
+template <typename T>
+class MatrixBuilderPool;
+
+namespace detail {
+
+class ThreadTeam;
+
+} // namespace detail
+
 /**
  *  @brief Class that evaluates a (multi-)shapelet basis at predefined points
  *
@@ -50,6 +66,13 @@ class MatrixBuilderWorkspace;
  *  or via a MatrixBuilderFactory.  Using the latter allows the workspace arrays used
  *  by the MatrixBuilder to be shared between instances.  See MatrixBuilderFactory
  *  and MatrixBuilderWorkspace for more information.
+ *
+ *  A MatrixBuilder mutates its workspace whenever it is called, so a single builder (or builders
+ *  sharing a workspace) must not be called from multiple threads at once; distinct builders with
+ *  distinct workspaces may be used concurrently, and MatrixBuilderPool provides them on demand.
+ *  The Python bindings release the GIL while a builder is evaluated, so this contract applies to
+ *  Python threads as well; the arrays passed to a call must not be modified by another thread
+ *  until it returns.
  */
 template <typename T>
 class MatrixBuilder {
@@ -118,6 +141,25 @@ public:
         MultiShapeletFunction const & psf
     );
 
+    /**
+     *  Create a MatrixBuilder that evaluates a MultiShapeletBasis object convolved with a different
+     *  MultiShapeletFunction for each of several bands, stacking the matrices for the bands along the
+     *  rows.
+     *
+     *  See the corresponding MatrixBuilderFactory constructor for more information.
+     *
+     *  @param[in] x          column positions at which the basis should be evaluated.
+     *  @param[in] y          row positions at which the basis should be evaluated (same size as x).
+     *  @param[in] basis      basis object defining the functions the matrix evaluates
+     *  @param[in] psfs       functions to convolve the basis with, one for each band
+     */
+    MatrixBuilder(
+        ndarray::Array<T const,1,1> const & x,
+        ndarray::Array<T const,1,1> const & y,
+        MultiShapeletBasis const & basis,
+        std::vector<MultiShapeletFunction> const & psfs
+    );
+
     /// Return the number of data points
     int getDataSize() const;
 
@@ -127,6 +169,16 @@ public:
     /// Return a matrix appropriate for use as an output for operator().
     ndarray::Array<T,2,-2> allocateOutput() const;
 
+    /**
+     *  @brief Return a zeroed array appropriate for use as an output for the batched operator().
+     *
+     *  The returned array has dimensions (n, getBasisSize(), getDataSize()), so output[i].transpose()
+     *  has the same shape and memory layout as the matrix returned by allocateOutput().
+     *
+     *  @param[in]   n        Number of models (rows of the parameter array) the output will hold.
+     */
+    ndarray::Array<T,3,3> allocateOutput(int n) const;
+
     /**
      *  @brief Fill an array with the model matrix.
      *
@@ -152,9 +204,159 @@ public:
         return output;
     }
 
+    /**
+     *  @brief Fill an array with the model matrices for many ellipses at once.
+     *
+     *  This is equivalent to calling the single-ellipse operator() once for each row of the
+     *  parameter array, but avoids per-call overhead (particularly from Python) and reuses the
+     *  same workspace for every evaluation.
+     *
+     *  @param[out]  output       Array to fill, with dimensions (n, getBasisSize(), getDataSize());
+     *                            output[i].transpose() is the model matrix for parameters[i].
+     *                            Will be zeroed before filling.
+     *  @param[in]   parameters   Ellipse parameters, with dimensions (n, 5); each row holds the
+     *                            three core parameters followed by the center (x, y), relative to
+     *                            the x and y arrays passed at construction.
+     *  @param[in]   ellipseType  Name of the ellipse core parametrization of the parameters, as
+     *                            passed to afw::geom::ellipses::BaseCore::make.
+     */
+    void operator()(
+        ndarray::Array<T,3,3> const & output,
+        ndarray::Array<double const,2,1> const & parameters,
+        std::string const & ellipseType
+    ) const;
+
+    /**
+     *  @brief Return a newly-allocated array of model matrices for many ellipses at once.
+     *
+     *  @param[in]   parameters   Ellipse parameters, with dimensions (n, 5); see the overload
+     *                            that takes an output argument.
+     *  @param[in]   ellipseType  Name of the ellipse core parametrization of the parameters.
+     */
+    ndarray::Array<T,3,3> operator()(
+        ndarray::Array<double const,2,1> const & parameters,
+        std::string const & ellipseType
+    ) const {
+        ndarray::Array<T,3,3> output = allocateOutput(parameters.template getSize<0>());
+        (*this)(output, parameters, ellipseType);
+        return output;
+    }
+
+    /**
+     *  @brief Fill arrays with the model matrix and its derivatives with respect to the ellipse parameters.
+     *
+     *  The derivatives reuse the Gaussian and Hermite polynomial terms computed for the model matrix, so
+     *  this is considerably cheaper than computing them by finite differences.  The only part not
+     *  computed analytically is the dependence of a PSF convolution matrix on the ellipse core, which is
+     *  computed by central finite differences; this involves only the (small) convolution matrix, not
+     *  the data points.  Multi-component builders always compute derivatives in a single thread.
+     *
+     *  @param[out]  output       Matrix to fill, with dimensions (getDataSize(), getBasisSize()).
+     *                            Will be zeroed before filling.
+     *  @param[out]  derivatives  Array to fill, with dimensions (5, getBasisSize(), getDataSize()), as
+     *                            returned by allocateOutput(5); derivatives[i].transpose() is the
+     *                            derivative of the model matrix with respect to ellipse parameter i (the
+     *                            three core parameters, in the ellipse's own parametrization, followed by
+     *                            the center x and y).  Will be zeroed before filling.
+     *  @param[in]   ellipse      Ellipse parameters of the model, with center relative to the x and y
+     *                            arrays passed at construction.
+     */
+    void computeDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const;
+
+    /**
+     *  @brief Fill an array with the model evaluated at the data points for the given coefficients.
+     *
+     *  This is equivalent to multiplying the model matrix by the coefficients, but the matrix is never
+     *  formed: the coefficients are first multiplied by the (small) remap and convolution matrices, and
+     *  the resulting weighted sum of basis functions is evaluated directly at each data point.  This is
+     *  much faster when only the model itself is needed (e.g. to evaluate a likelihood).
+     *
+     *  @param[out]  output        Vector to fill, with size getDataSize().  Will be zeroed before
+     *                             filling.
+     *  @param[in]   coefficients  Coefficients of the basis functions, with size getBasisSize().
+     *  @param[in]   ellipse       Ellipse parameters of the model, with center relative to the x and y
+     *                             arrays passed at construction.
+     */
+    void computeModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const;
+
+    /**
+     *  @brief Return a newly-allocated model vector for the given coefficients.
+     *
+     *  @param[in]   coefficients  Coefficients of the basis functions, with size getBasisSize().
+     *  @param[in]   ellipse       Ellipse parameters of the model, with center relative to the x and y
+     *                             arrays passed at construction.
+     */
+    ndarray::Array<T,1,1> computeModel(
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const {
+        ndarray::Array<T,1,1> output = ndarray::allocate(getDataSize());
+        computeModel(output, coefficients, ellipse);
+        return output;
+    }
+
+    /**
+     *  @brief Compute the normal equations of a weighted linear least-squares fit of the basis to data.
+     *
+     *  With M the matrix that operator() would compute, W the diagonal matrix of weights, and d the data
+     *  vector, this computes the Gram matrix M^T W M and the projected data M^T W d without forming M:
+     *  the matrix is evaluated for one tile of data points at a time (see
+     *  MatrixBuilderFactory::setTileSize; 256 points are used if the tile size is zero), and each tile is
+     *  added to the normal equations while it is still in cache, reusing the same workspace.  Normal
+     *  equations are always computed in a single thread.  Multi-band builders use tiles of points from
+     *  a single band.  Multi-component, multi-band, and mixture-of-Gaussians builders with a cutoff cannot
+     *  evaluate all components on the same tile, and instead evaluate the full matrix internally.
+     *
+     *  @param[out]  gram          Matrix to fill with M^T W M, with dimensions (getBasisSize(),
+     *                             getBasisSize()).  Will be zeroed before filling.
+     *  @param[out]  projection    Vector to fill with M^T W d, with size getBasisSize().  Will be zeroed
+     *                             before filling.
+     *  @param[in]   weights       Nonnegative weight of each data point (e.g. its inverse variance), with
+     *                             size getDataSize().
+     *  @param[in]   data          Data vector, with size getDataSize().
+     *  @param[in]   ellipse       Ellipse parameters of the model, with center relative to the x and y
+     *                             arrays passed at construction.
+     */
+    void computeNormalEquations(
+        ndarray::Array<T,2,2> const & gram,
+        ndarray::Array<T,1,1> const & projection,
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const;
+
+    /**
+     *  @brief Return newly-allocated normal equations (the Gram matrix and the projected data, in that
+     *         order) for a weighted linear least-squares fit of the basis to data.
+     *
+     *  @param[in]   weights       Nonnegative weight of each data point, with size getDataSize().
+     *  @param[in]   data          Data vector, with size getDataSize().
+     *  @param[in]   ellipse       Ellipse parameters of the model, with center relative to the x and y
+     *                             arrays passed at construction.
+     */
+    std::pair< ndarray::Array<T,2,2>, ndarray::Array<T,1,1> > computeNormalEquations(
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const {
+        ndarray::Array<T,2,2> gram = ndarray::allocate(getBasisSize(), getBasisSize());
+        ndarray::Array<T,1,1> projection = ndarray::allocate(getBasisSize());
+        computeNormalEquations(gram, projection, weights, data, ellipse);
+        return std::make_pair(gram, projection);
+    }
+
 private:
 
     template <typename U> friend class MatrixBuilderFactory;
+    template <typename U> friend class MatrixBuilderPool;
 
     explicit MatrixBuilder(PTR(Impl) impl);
 
@@ -302,6 +504,9 @@ public:
     /**
      *  Create a MatrixBuilder that evaluates a MultiShapeletBasis object.
      *
+     *  If every component of the basis has order zero (i.e. the basis is a mixture of Gaussians), a
+     *  specialized implementation that evaluates the Gaussians directly is used.
+     *
      *  @param[in] x          column positions at which the basis should be evaluated.
      *  @param[in] y          row positions at which the basis should be evaluated (same size as x).
      *  @param[in] basis      basis object defining the functions the matrix evaluates
@@ -316,6 +521,9 @@ public:
      *  Create a MatrixBuilder that evaluates a MultiShapeletBasis object after convolving it with
      *  a MultiShapeletFunction.
      *
+     *  If every component of both the basis and the PSF has order zero, a specialized implementation
+     *  that evaluates the convolved Gaussians directly is used.
+     *
      *  @param[in] x          column positions at which the basis should be evaluated.
      *  @param[in] y          row positions at which the basis should be evaluated (same size as x).
      *  @param[in] basis      basis object defining the functions the matrix evaluates
@@ -328,6 +536,35 @@ public:
         MultiShapeletFunction const & psf
     );
 
+    /**
+     *  Create a MatrixBuilder that evaluates a MultiShapeletBasis object convolved with a different
+     *  MultiShapeletFunction for each of several bands, stacking the matrices for the bands along the
+     *  rows.
+     *
+     *  The data size of the builder is the number of data points times the number of bands, and rows
+     *  [b*N, (b+1)*N) of its matrix (where N is the size of x and y) are the matrix for band b, i.e. what
+     *  a builder created with the same basis and psfs[b] would compute.  The same is true of the model
+     *  vector and the data and weights for the normal equations.
+     *
+     *  Evaluating all bands in one builder lets them share work: the Gaussian and Hermite polynomial
+     *  terms for a basis component convolved with a PSF component are evaluated only once per ellipse
+     *  for all PSF components (in any band) that have the same ellipse, which is the case when the PSF
+     *  approximations for different bands share their shapes and differ only in their coefficients.
+     *  PSF components with different ellipses always yield different convolved ellipses, and are
+     *  evaluated separately.  Multi-band builders always run in a single thread.
+     *
+     *  @param[in] x          column positions at which the basis should be evaluated.
+     *  @param[in] y          row positions at which the basis should be evaluated (same size as x).
+     *  @param[in] basis      basis object defining the functions the matrix evaluates
+     *  @param[in] psfs       functions to convolve the basis with, one for each band
+     */
+    MatrixBuilderFactory(
+        ndarray::Array<T const,1,1> const & x,
+        ndarray::Array<T const,1,1> const & y,
+        MultiShapeletBasis const & basis,
+        std::vector<MultiShapeletFunction> const & psfs
+    );
+
     /// Return the number of data points
     int getDataSize() const;
 
@@ -337,6 +574,107 @@ public:
     /// Return the size of the workspace needed for this MatrixBuilder, in elements of T
     int computeWorkspace() const;
 
+    /// Return the number of threads used by MatrixBuilders subsequently created by this factory.
+    int getThreadCount() const;
+
+    /**
+     *  @brief Set the number of threads used by MatrixBuilders subsequently created by this factory.
+     *
+     *  Builders are parallelized in one of two ways:
+     *   - Compound builders (those created from a MultiShapeletBasis and/or MultiShapeletFunction
+     *     with more than one component, and at least one component of order greater than zero)
+     *     split their components into at most threadCount contiguous partitions, which are evaluated
+     *     concurrently and summed in a fixed order.  Each partition needs its own workspace, and all
+     *     partitions but the first also need a partial output matrix, so computeWorkspace() grows
+     *     with the thread count, and results may differ from the single-threaded ones at the level
+     *     of floating-point round-off (but do not depend on thread scheduling).
+     *   - Mixture-of-Gaussians builders (those whose basis and PSF components all have order zero)
+     *     split the data points into at most threadCount contiguous ranges, each of which is filled
+     *     by one thread.  Each data point is still computed by a single thread in the same way, so
+     *     the workspace does not grow and the results are the same as the single-threaded ones.
+     *     Only the matrix and the model are evaluated this way; derivatives, normal equations, and
+     *     all evaluations with a cutoff run in a single thread.
+     *  Other builders always run in a single thread.  The threads are started once when a builder is
+     *  created and are reused by every call to it until it is destroyed.  The default is 1 (no
+     *  threads are started).
+     *
+     *  The thread count is shared by copies of this factory.
+     */
+    void setThreadCount(int threadCount);
+
+    /**
+     *  @brief Enable caching of PSF convolution matrices in MatrixBuilders subsequently created by
+     *         this factory.
+     *
+     *  Each convolved component of a builder holds a GaussHermiteConvolution; with the cache enabled,
+     *  calls with an ellipse whose core has already been seen (e.g. when only the center changes)
+     *  skip recomputing the convolution matrix.  See GaussHermiteConvolution::enableCache for the
+     *  meaning of the arguments; a capacity of zero (the default) disables caching.  Has no effect
+     *  on builders without a PSF.
+     *
+     *  The cache settings are shared by copies of this factory.
+     */
+    void setConvolutionCache(int capacity, double quantum=0.0);
+
+    /// Return the cutoff radius used by MatrixBuilders subsequently created by this factory.
+    double getCutoff() const;
+
+    /**
+     *  @brief Skip data points far from the ellipse of each shapelet component in MatrixBuilders
+     *         subsequently created by this factory.
+     *
+     *  With a nonzero cutoff, each shapelet component is only evaluated at the data points that lie
+     *  within its ellipse scaled by the cutoff (i.e. at a radius of at most cutoff in the coordinate
+     *  system in which the ellipse is the unit circle), and its matrix elements are zero at all other
+     *  points.  For convolved builders, the cutoff applies to the convolved ellipse of each component.
+     *  Setting a cutoff builds a spatial index of the data points (bands of roughly equal numbers of
+     *  points in y, each sorted by x; for data on a pixel grid these are runs of whole rows), so each
+     *  builder only has to visit the points within the bounding box of each ellipse, and evaluates and
+     *  transforms the basis only at the points it keeps.  This makes builders much faster for bases
+     *  with many components that are small compared to the footprint.
+     *
+     *  Shapelet functions of order n extend to a radius of roughly sqrt(2n + 1), so the cutoff should
+     *  be several units larger than that; for a single Gaussian, the largest neglected value relative
+     *  to the peak is exp(-cutoff^2/2) (about 1.5E-8 for a cutoff of 6).  A cutoff of zero (the
+     *  default) disables culling.
+     *
+     *  The cutoff is shared by copies of this factory.
+     */
+    void setCutoff(double cutoff);
+
+    /// Return the number of data points per tile used by MatrixBuilders subsequently created by this factory.
+    int getTileSize() const;
+
+    /**
+     *  @brief Set the number of data points MatrixBuilders subsequently created by this factory
+     *         evaluate at a time.
+     *
+     *  With a nonzero tile size, builders compute all of the basis functions for one tile of data points
+     *  (and, for convolved and remapped bases, multiply them into the output) before moving on to the
+     *  next, instead of making a pass over all data points for each basis function.  This keeps the
+     *  intermediate arrays in cache for large numbers of data points; the results are the same to
+     *  round-off error.  A tile size of zero disables tiling.
+     *
+     *  The tile size is shared by copies of this factory.
+     */
+    void setTileSize(int tileSize);
+
+    /// Return whether MatrixBuilders subsequently created by this factory reserve memory for derivatives.
+    bool getDerivativesEnabled() const;
+
+    /**
+     *  @brief Set whether MatrixBuilders subsequently created by this factory reserve workspace for
+     *         computing derivatives with respect to the ellipse.
+     *
+     *  Builders only need some of their temporary arrays when computing derivatives.  With derivatives
+     *  enabled, these are included in computeWorkspace(), so they are part of any shared workspace;
+     *  otherwise (the default) the workspace is smaller, and a builder allocates them separately the first
+     *  time it is asked for derivatives.  Either way, the results are the same.
+     *
+     *  The setting is shared by copies of this factory.
+     */
+    void setDerivativesEnabled(bool enabled);
+
     /// Return a new MatrixBuilder with internal, unshared workspace
     MatrixBuilder<T> operator()() const;
 
@@ -347,6 +685,257 @@ private:
     PTR(Impl) _impl;
 };
 
+/**
+ *  @brief A thread-safe pool of MatrixBuilders created from a single MatrixBuilderFactory.
+ *
+ *  A MatrixBuilder mutates its workspace arrays whenever it is called, so a single builder cannot
+ *  be used by multiple threads at once.  A MatrixBuilderPool hands out builders that share the
+ *  immutable state of a factory (the coordinate arrays, basis and PSF), with each builder having its
+ *  own workspace.  A thread acquires a builder, uses it for as long as it likes, and then releases it
+ *  back to the pool so it can be reused by another task without any new allocations:
+ *  @code
+ *  MatrixBuilderPool<T> pool(factory);
+ *  // in each task:
+ *  MatrixBuilder<T> builder = pool.acquire();
+ *  builder(output, ellipse);
+ *  pool.release(builder);
+ *  @endcode
+ *  New builders are created on demand when no idle builder is available, so the number of builders
+ *  never exceeds the maximum number that were in use at the same time.
+ *
+ *  The factory is copied at construction; copies share their implementation, so later calls to
+ *  MatrixBuilderFactory::setThreadCount on the original also affect builders created afterwards by
+ *  the pool.
+ */
+template <typename T>
+class MatrixBuilderPool {
+public:
+
+    typedef MatrixBuilderFactory<T> Factory; ///< Associated factory class
+    typedef MatrixBuilder<T> Builder; ///< Associated builder class
+
+    /**
+     *  Construct a pool from a factory.
+     *
+     *  @param[in] factory    factory used to create new builders.
+     *  @param[in] size       number of builders to create immediately.
+     */
+    explicit MatrixBuilderPool(Factory const & factory, int size=0);
+
+    /// Return an idle builder from the pool, creating a new one if none are available.
+    Builder acquire();
+
+    /**
+     *  @brief Return a builder to the pool, making it available to other threads.
+     *
+     *  Throws InvalidParameterError if the builder was not acquired from this pool, or has
+     *  already been released.
+     */
+    void release(Builder const & builder);
+
+    /// Return the total number of builders created by the pool.
+    int getSize() const;
+
+    /// Return the number of idle builders in the pool.
+    int getAvailable() const;
+
+    /// Return the factory used to create new builders.
+    Factory const & getFactory() const { return _factory; }
+
+private:
+
+    MatrixBuilderPool(MatrixBuilderPool const & other); // disabled
+
+    void operator=(MatrixBuilderPool const & other); // disabled
+
+    typedef typename Builder::Impl BuilderImpl;
+
+    Factory _factory;
+    mutable std::mutex _mutex;
+    int _size;
+    std::vector<PTR(BuilderImpl)> _available;
+    std::set<BuilderImpl const *> _acquired;
+};
+
+/**
+ *  @brief Evaluates a single model on several exposures of the same object ("epochs"), each with its own
+ *         data points, PSF, and pixel coordinate system.
+ *
+ *  A MultiEpochMatrixBuilder holds one MatrixBuilder per epoch, created from a MatrixBuilderFactory
+ *  with that epoch's x and y arrays and PSF, along with an affine transform that maps the reference
+ *  coordinate system in which the model ellipse is defined to that epoch's coordinate system (e.g.
+ *  the local linearization of the composition of the reference and epoch WCSs).  Given an ellipse in
+ *  the reference coordinate system, it transforms the ellipse to each epoch and fills a single stacked
+ *  matrix, with the data points of all epochs along the rows (in the order the epochs were given) and
+ *  the basis elements along the columns:
+ *  @code
+ *  MultiEpochMatrixBuilder<T> builder(factories, transforms);
+ *  ndarray::Array<T,2,-2> matrix = builder(ellipse);
+ *  // matrix[ndarray::view(builder.getDataOffset(n), builder.getDataOffset(n + 1))()]
+ *  // is the matrix for epoch n
+ *  @endcode
+ *  All factories must have the same basis size; they are usually created from the same
+ *  MultiShapeletBasis, whose matrices are then shared rather than copied.
+ *
+ *  Epochs may be evaluated in parallel (see setThreadCount); each epoch's builder has its own
+ *  workspace and is only used by one thread at a time.  As with MatrixBuilder, a single
+ *  MultiEpochMatrixBuilder (or set of copies, which share their builders and threads) must not be called
+ *  from multiple threads at once.
+ */
+template <typename T>
+class MultiEpochMatrixBuilder {
+public:
+
+    typedef MatrixBuilderFactory<T> Factory; ///< Factory type used to create the per-epoch builders
+    typedef MatrixBuilder<T> Builder; ///< Per-epoch builder type
+
+    /**
+     *  Construct from per-epoch factories and transforms.
+     *
+     *  @param[in] factories     factories for the builder of each epoch; all must have the same basis
+     *                           size.
+     *  @param[in] transforms    transforms from the reference coordinate system to the coordinate system
+     *                           of each epoch's x and y arrays (same size as factories).
+     */
+    MultiEpochMatrixBuilder(
+        std::vector<Factory> const & factories,
+        std::vector<geom::AffineTransform> const & transforms
+    );
+
+    /// Return the number of epochs
+    int getEpochCount() const { return _builders.size(); }
+
+    /// Return the total number of data points in all epochs
+    int getDataSize() const { return _offsets.back(); }
+
+    /**
+     *  @brief Return the first row of the stacked output that corresponds to the given epoch.
+     *
+     *  getDataOffset(getEpochCount()) is equal to getDataSize().
+     */
+    int getDataOffset(int epoch) const;
+
+    /// Return the number of basis elements
+    int getBasisSize() const { return _builders.front().getBasisSize(); }
+
+    /// Return the builder for the given epoch
+    Builder const & getBuilder(int epoch) const;
+
+    /// Return the transform from the reference coordinate system to the given epoch
+    geom::AffineTransform const & getTransform(int epoch) const;
+
+    /// Return the maximum number of threads used to evaluate epochs in parallel (1 by default).
+    int getThreadCount() const { return _threadCount; }
+
+    /**
+     *  @brief Set the maximum number of threads used to evaluate epochs in parallel.
+     *
+     *  Epochs are assigned to threads in round-robin order, and each thread uses its epochs' own
+     *  builders.  The threads are started here and wait for work between calls, so calls do not pay for
+     *  starting them.  This is independent of the thread counts of the factories, which control how each
+     *  epoch's builder splits its own work; it is usually best to parallelize at only one level.
+     */
+    void setThreadCount(int threadCount);
+
+    /// Return a matrix appropriate for use as an output for operator().
+    ndarray::Array<T,2,-2> allocateOutput() const;
+
+    /**
+     *  @brief Return a zeroed array appropriate for use as the derivatives output of computeDerivatives.
+     *
+     *  The returned array has dimensions (n, getBasisSize(), getDataSize()).
+     */
+    ndarray::Array<T,3,3> allocateOutput(int n) const;
+
+    /**
+     *  @brief Fill an array with the stacked model matrix for all epochs.
+     *
+     *  @param[out]  output   Matrix to fill, with dimensions (getDataSize(), getBasisSize()).
+     *                        Will be zeroed before filling.
+     *  @param[in]   ellipse  Ellipse parameters of the model in the reference coordinate system.
+     */
+    void operator()(
+        ndarray::Array<T,2,-1> const & output,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const;
+
+    /**
+     *  @brief Return a newly-allocated stacked model matrix for all epochs.
+     *
+     *  @param[in]   ellipse  Ellipse parameters of the model in the reference coordinate system.
+     */
+    ndarray::Array<T,2,-2> operator()(afw::geom::ellipses::Ellipse const & ellipse) const {
+        ndarray::Array<T,2,-2> output = allocateOutput();
+        (*this)(output, ellipse);
+        return output;
+    }
+
+    /**
+     *  @brief Fill arrays with the stacked model matrix and its derivatives with respect to the parameters
+     *         of the reference ellipse.
+     *
+     *  The derivatives of each epoch's matrix with respect to its transformed ellipse (see
+     *  MatrixBuilder::computeDerivatives) are combined with the derivatives of the transformed ellipse
+     *  with respect to the reference ellipse.
+     *
+     *  @param[out]  output       Matrix to fill, with dimensions (getDataSize(), getBasisSize()).
+     *                            Will be zeroed before filling.
+     *  @param[out]  derivatives  Array to fill, with dimensions (5, getBasisSize(), getDataSize()), as
+     *                            returned by allocateOutput(5); derivatives[i].transpose() is the
+     *                            derivative of the stacked matrix with respect to reference ellipse
+     *                            parameter i.  Will be zeroed before filling.
+     *  @param[in]   ellipse      Ellipse parameters of the model in the reference coordinate system.
+     */
+    void computeDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const;
+
+    /**
+     *  @brief Fill an array with the stacked model for all epochs for the given coefficients.
+     *
+     *  @param[out]  output        Vector to fill, with size getDataSize().  Will be zeroed before
+     *                             filling.
+     *  @param[in]   coefficients  Coefficients of the basis functions, with size getBasisSize().
+     *  @param[in]   ellipse       Ellipse parameters of the model in the reference coordinate system.
+     */
+    void computeModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const;
+
+    /**
+     *  @brief Return the newly-allocated stacked model for all epochs for the given coefficients.
+     *
+     *  @param[in]   coefficients  Coefficients of the basis functions, with size getBasisSize().
+     *  @param[in]   ellipse       Ellipse parameters of the model in the reference coordinate system.
+     */
+    ndarray::Array<T,1,1> computeModel(
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) const {
+        ndarray::Array<T,1,1> output = ndarray::allocate(getDataSize());
+        computeModel(output, coefficients, ellipse);
+        return output;
+    }
+
+private:
+
+    template <typename Function>
+    void forEachEpoch(Function function) const;
+
+    std::vector<Builder> _builders;
+    std::vector<geom::AffineTransform> _transforms;
+    std::vector<int> _offsets;
+    int _threadCount;
+    std::shared_ptr<detail::ThreadTeam> _team;  // null if epochs are evaluated in a single thread
+    // Per-epoch derivatives, allocated at construction if the epoch's factory has derivatives enabled
+    // (see MatrixBuilderFactory::setDerivativesEnabled) and on first use otherwise.
+    mutable std::vector< ndarray::Array<T,3,3> > _derivatives;
+};
+
 }} // namespace lsst::shapelet
 
 #endif // !LSST_SHAPELET_MatrixBuilder_h_INCLUDED
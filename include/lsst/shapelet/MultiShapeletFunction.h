@@ -89,6 +89,10 @@ private:
  *
  *  A MultiShapeletFunctionEvaluator is invalidated whenever the MultiShapeletFunction it
  *  was constructed from is modified.
+ *
+ *  As with ShapeletFunctionEvaluator, a single evaluator must not be used from multiple threads
+ *  at once, but distinct evaluators may be; the Python bindings release the GIL while evaluating
+ *  arrays and adding to images.
  */
 class MultiShapeletFunctionEvaluator {
 public:
@@ -113,15 +117,36 @@ public:
         ndarray::Array<double const,1> const & y
     ) const;
 
-    /// @brief Add the function to the given image-like array.
+    /**
+     *  @brief Evaluate at the given single-precision points, returning a newly-allocated
+     *         single-precision array.
+     *
+     *  Computations are done in double precision; only the inputs and outputs are single-precision.
+     */
+    ndarray::Array<float,1,1> operator()(
+        ndarray::Array<float const,1> const & x,
+        ndarray::Array<float const,1> const & y
+    ) const;
+
+    /**
+     *  @brief Add the function to the given image-like array.
+     *
+     *  @param[in,out] array       Array to add to, with rows corresponding to y.
+     *  @param[in]     xy0         Position of the first pixel of the array.
+     *  @param[in]     truncation  If positive, only evaluate each component within the bounding box
+     *                             of its ellipse scaled by this factor (i.e. a number of "sigma"),
+     *                             leaving pixels outside it untouched.  If zero (the default), every
+     *                             pixel in the array is evaluated.
+     */
     void addToImage(
         ndarray::Array<double,2,1> const & array,
-        geom::Point2I const & xy0 = geom::Point2I()
+        geom::Point2I const & xy0 = geom::Point2I(),
+        double truncation = 0.0
     ) const;
 
-    /// @brief Evaluate the function on the given image.
-    void addToImage(afw::image::Image<double> & image) const {
-        addToImage(image.getArray(), image.getXY0());
+    /// @brief Evaluate the function on the given image; see the array overload for truncation.
+    void addToImage(afw::image::Image<double> & image, double truncation = 0.0) const {
+        addToImage(image.getArray(), image.getXY0(), truncation);
     }
 
     /// @brief Compute the definite integral or integral moments.
@@ -173,6 +173,10 @@ private:
  *
  *  A ShapeletFunctionEvaluator is invalidated whenever the ShapeletFunction it
  *  was constructed from is modified.
+ *
+ *  Because evaluation reuses the evaluator's workspace, a single evaluator must not be used from
+ *  multiple threads at once; distinct evaluators may be used concurrently.  The Python bindings
+ *  release the GIL while evaluating arrays and adding to images.
  */
 class ShapeletFunctionEvaluator {
 public:
@@ -201,15 +205,36 @@ public:
         ndarray::Array<double const,1> const & y
     ) const;
 
-    /// @brief Add the function to the given image-like array.
+    /**
+     *  @brief Evaluate at the given single-precision points, returning a newly-allocated
+     *         single-precision array.
+     *
+     *  Computations are done in double precision; only the inputs and outputs are single-precision.
+     */
+    ndarray::Array<float,1,1> operator()(
+        ndarray::Array<float const,1> const & x,
+        ndarray::Array<float const,1> const & y
+    ) const;
+
+    /**
+     *  @brief Add the function to the given image-like array.
+     *
+     *  @param[in,out] array       Array to add to, with rows corresponding to y.
+     *  @param[in]     xy0         Position of the first pixel of the array.
+     *  @param[in]     truncation  If positive, only evaluate the function within the bounding box of
+     *                             its ellipse scaled by this factor (i.e. a number of "sigma"),
+     *                             leaving pixels outside it untouched.  If zero (the default), every
+     *                             pixel in the array is evaluated.
+     */
     void addToImage(
         ndarray::Array<double,2,1> const & array,
-        geom::Point2I const & xy0 = geom::Point2I()
+        geom::Point2I const & xy0 = geom::Point2I(),
+        double truncation = 0.0
     ) const;
 
-    /// @brief Evaluate the function on the given image.
-    void addToImage(afw::image::Image<double> & image) const {
-        addToImage(image.getArray(), image.getXY0());
+    /// @brief Evaluate the function on the given image; see the array overload for truncation.
+    void addToImage(afw::image::Image<double> & image, double truncation = 0.0) const {
+        addToImage(image.getArray(), image.getXY0(), truncation);
     }
 
     /// @brief Compute the definite integral or integral moments.
@@ -232,6 +257,15 @@ private:
 
     void _computeRawMoments(double & q0, Eigen::Vector2d & q1, Eigen::Matrix2d & q2) const;
 
+    // Add the function evaluated at the given points to output (explicitly instantiated for float
+    // and double coordinates).
+    template <typename T>
+    void _addToArray(
+        ndarray::Array<double,1,1> const & output,
+        ndarray::Array<T const,1> const & x,
+        ndarray::Array<T const,1> const & y
+    ) const;
+
     double _normalization;
     ndarray::Array<double const,1,1> _coefficients;
     geom::AffineTransform _transform;
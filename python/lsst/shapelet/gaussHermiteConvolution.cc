@@ -39,9 +39,19 @@ PYBIND11_MODULE(gaussHermiteConvolution, mod) {
     clsGaussHermiteConvolution.def(py::init<int, ShapeletFunction const &>(), "colOrder"_a, "psf"_a);
 
     clsGaussHermiteConvolution.def("computeRowOrder", &GaussHermiteConvolution::computeRowOrder);
-    clsGaussHermiteConvolution.def("evaluate", &GaussHermiteConvolution::evaluate);
+    clsGaussHermiteConvolution.def("evaluate", &GaussHermiteConvolution::evaluate,
+                                   py::call_guard<py::gil_scoped_release>());
     clsGaussHermiteConvolution.def("getColOrder", &GaussHermiteConvolution::getColOrder);
     clsGaussHermiteConvolution.def("getRowOrder", &GaussHermiteConvolution::getRowOrder);
+    clsGaussHermiteConvolution.def("enableCache", &GaussHermiteConvolution::enableCache, "capacity"_a,
+                                   "quantum"_a = 0.0);
+    clsGaussHermiteConvolution.def("disableCache", &GaussHermiteConvolution::disableCache);
+    clsGaussHermiteConvolution.def("getCacheCapacity", &GaussHermiteConvolution::getCacheCapacity);
+    clsGaussHermiteConvolution.def("getCacheHitCount", &GaussHermiteConvolution::getCacheHitCount);
+    clsGaussHermiteConvolution.def("getCacheMissCount", &GaussHermiteConvolution::getCacheMissCount);
+    clsGaussHermiteConvolution.def_static("getTableCacheBytes", &GaussHermiteConvolution::getTableCacheBytes);
+    clsGaussHermiteConvolution.def_static("getTableCacheCount", &GaussHermiteConvolution::getTableCacheCount);
+    clsGaussHermiteConvolution.def_static("clearTableCache", &GaussHermiteConvolution::clearTableCache);
 }
 
 }  // shapelet
@@ -20,6 +20,7 @@
  * see <https://www.lsstcorp.org/LegalNotices/>.
  */
 #include "pybind11/pybind11.h"
+#include "pybind11/stl.h"
 
 #include "ndarray/pybind11.h"
 
@@ -52,16 +53,57 @@ py::class_<MatrixBuilder<T>, std::shared_ptr<MatrixBuilder<T>>> declareMatrixBui
     cls.def(py::init<ndarray::Array<T const, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
                      MultiShapeletBasis const &, MultiShapeletFunction const &>(),
             "x"_a, "y"_a, "basis"_a, "psf"_a);
+    cls.def(py::init<ndarray::Array<T const, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
+                     MultiShapeletBasis const &, std::vector<MultiShapeletFunction> const &>(),
+            "x"_a, "y"_a, "basis"_a, "psfs"_a);
 
     cls.def("getDataSize", &Class::getDataSize);
     cls.def("getBasisSize", &Class::getBasisSize);
-    cls.def("allocateOutput", &Class::allocateOutput);
+    cls.def("allocateOutput", (ndarray::Array<T, 2, -2> (Class::*)() const) & Class::allocateOutput);
+    cls.def("allocateOutput", (ndarray::Array<T, 3, 3> (Class::*)(int) const) & Class::allocateOutput, "n"_a);
 
     cls.def("__call__",
             (void (Class::*)(ndarray::Array<T, 2, -1> const &, afw::geom::ellipses::Ellipse const &) const) &
-                    Class::operator());
+                    Class::operator(),
+            py::call_guard<py::gil_scoped_release>());
     cls.def("__call__", (ndarray::Array<T, 2, -2> (Class::*)(afw::geom::ellipses::Ellipse const &) const) &
-                                Class::operator());
+                                Class::operator(),
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("__call__",
+            (void (Class::*)(ndarray::Array<T, 3, 3> const &, ndarray::Array<double const, 2, 1> const &,
+                             std::string const &) const) &
+                    Class::operator(),
+            "output"_a, "parameters"_a, "ellipseType"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("__call__",
+            (ndarray::Array<T, 3, 3> (Class::*)(ndarray::Array<double const, 2, 1> const &, std::string const &)
+                     const) &
+                    Class::operator(),
+            "parameters"_a, "ellipseType"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("computeDerivatives", &Class::computeDerivatives, "output"_a, "derivatives"_a, "ellipse"_a,
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("computeModel",
+            (void (Class::*)(ndarray::Array<T, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
+                             afw::geom::ellipses::Ellipse const &) const) &
+                    Class::computeModel,
+            "output"_a, "coefficients"_a, "ellipse"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("computeModel",
+            (ndarray::Array<T, 1, 1> (Class::*)(ndarray::Array<T const, 1, 1> const &,
+                                                afw::geom::ellipses::Ellipse const &) const) &
+                    Class::computeModel,
+            "coefficients"_a, "ellipse"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("computeNormalEquations",
+            (void (Class::*)(ndarray::Array<T, 2, 2> const &, ndarray::Array<T, 1, 1> const &,
+                             ndarray::Array<T const, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
+                             afw::geom::ellipses::Ellipse const &) const) &
+                    Class::computeNormalEquations,
+            "gram"_a, "projection"_a, "weights"_a, "data"_a, "ellipse"_a,
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("computeNormalEquations",
+            (std::pair<ndarray::Array<T, 2, 2>, ndarray::Array<T, 1, 1>> (Class::*)(
+                    ndarray::Array<T const, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
+                    afw::geom::ellipses::Ellipse const &) const) &
+                    Class::computeNormalEquations,
+            "weights"_a, "data"_a, "ellipse"_a, py::call_guard<py::gil_scoped_release>());
 
     return cls;
 }
@@ -99,6 +141,9 @@ py::class_<MatrixBuilderFactory<T>, std::shared_ptr<MatrixBuilderFactory<T>>> de
     cls.def(py::init<ndarray::Array<T const, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
                      MultiShapeletBasis const &, MultiShapeletFunction const &>(),
             "x"_a, "y"_a, "basis"_a, "psf"_a);
+    cls.def(py::init<ndarray::Array<T const, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
+                     MultiShapeletBasis const &, std::vector<MultiShapeletFunction> const &>(),
+            "x"_a, "y"_a, "basis"_a, "psfs"_a);
 
     cls.def("__call__", (MatrixBuilder<T> (Class::*)() const) & Class::operator());
     cls.def("__call__", (MatrixBuilder<T> (Class::*)(typename Class::Workspace &) const) & Class::operator(),
@@ -107,6 +152,78 @@ py::class_<MatrixBuilderFactory<T>, std::shared_ptr<MatrixBuilderFactory<T>>> de
     cls.def("getDataSize", &Class::getDataSize);
     cls.def("getBasisSize", &Class::getBasisSize);
     cls.def("computeWorkspace", &Class::computeWorkspace);
+    cls.def("getThreadCount", &Class::getThreadCount);
+    cls.def("setThreadCount", &Class::setThreadCount, "threadCount"_a);
+    cls.def("setConvolutionCache", &Class::setConvolutionCache, "capacity"_a, "quantum"_a = 0.0);
+    cls.def("getCutoff", &Class::getCutoff);
+    cls.def("setCutoff", &Class::setCutoff, "cutoff"_a);
+    cls.def("getTileSize", &Class::getTileSize);
+    cls.def("setTileSize", &Class::setTileSize, "tileSize"_a);
+    cls.def("getDerivativesEnabled", &Class::getDerivativesEnabled);
+    cls.def("setDerivativesEnabled", &Class::setDerivativesEnabled, "enabled"_a);
+
+    return cls;
+}
+
+template <typename T>
+py::class_<MatrixBuilderPool<T>, std::shared_ptr<MatrixBuilderPool<T>>> declareMatrixBuilderPool(
+        py::module &mod, std::string const &suffix) {
+    using Class = MatrixBuilderPool<T>;
+
+    py::class_<Class, std::shared_ptr<Class>> cls(mod, ("MatrixBuilderPool" + suffix).c_str());
+
+    cls.def(py::init<typename Class::Factory const &, int>(), "factory"_a, "size"_a = 0);
+
+    cls.def("acquire", &Class::acquire);
+    cls.def("release", &Class::release, "builder"_a);
+    cls.def("getSize", &Class::getSize);
+    cls.def("getAvailable", &Class::getAvailable);
+    cls.def("getFactory", &Class::getFactory, py::return_value_policy::copy);
+
+    return cls;
+}
+
+template <typename T>
+py::class_<MultiEpochMatrixBuilder<T>, std::shared_ptr<MultiEpochMatrixBuilder<T>>>
+declareMultiEpochMatrixBuilder(py::module &mod, std::string const &suffix) {
+    using Class = MultiEpochMatrixBuilder<T>;
+
+    py::class_<Class, std::shared_ptr<Class>> cls(mod, ("MultiEpochMatrixBuilder" + suffix).c_str());
+
+    cls.def(py::init<std::vector<typename Class::Factory> const &,
+                     std::vector<geom::AffineTransform> const &>(),
+            "factories"_a, "transforms"_a);
+
+    cls.def("getEpochCount", &Class::getEpochCount);
+    cls.def("getDataSize", &Class::getDataSize);
+    cls.def("getDataOffset", &Class::getDataOffset, "epoch"_a);
+    cls.def("getBasisSize", &Class::getBasisSize);
+    cls.def("getBuilder", &Class::getBuilder, "epoch"_a, py::return_value_policy::copy);
+    cls.def("getTransform", &Class::getTransform, "epoch"_a, py::return_value_policy::copy);
+    cls.def("getThreadCount", &Class::getThreadCount);
+    cls.def("setThreadCount", &Class::setThreadCount, "threadCount"_a);
+    cls.def("allocateOutput", (ndarray::Array<T, 2, -2> (Class::*)() const) & Class::allocateOutput);
+    cls.def("allocateOutput", (ndarray::Array<T, 3, 3> (Class::*)(int) const) & Class::allocateOutput, "n"_a);
+
+    cls.def("__call__",
+            (void (Class::*)(ndarray::Array<T, 2, -1> const &, afw::geom::ellipses::Ellipse const &) const) &
+                    Class::operator(),
+            "output"_a, "ellipse"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("__call__", (ndarray::Array<T, 2, -2> (Class::*)(afw::geom::ellipses::Ellipse const &) const) &
+                                Class::operator(),
+            "ellipse"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("computeDerivatives", &Class::computeDerivatives, "output"_a, "derivatives"_a, "ellipse"_a,
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("computeModel",
+            (void (Class::*)(ndarray::Array<T, 1, 1> const &, ndarray::Array<T const, 1, 1> const &,
+                             afw::geom::ellipses::Ellipse const &) const) &
+                    Class::computeModel,
+            "output"_a, "coefficients"_a, "ellipse"_a, py::call_guard<py::gil_scoped_release>());
+    cls.def("computeModel",
+            (ndarray::Array<T, 1, 1> (Class::*)(ndarray::Array<T const, 1, 1> const &,
+                                                afw::geom::ellipses::Ellipse const &) const) &
+                    Class::computeModel,
+            "coefficients"_a, "ellipse"_a, py::call_guard<py::gil_scoped_release>());
 
     return cls;
 }
@@ -116,17 +233,29 @@ void declareMatrixBuilderTemplates(py::module &mod, std::string const &suffix) {
     auto clsMatrixBuilder = declareMatrixBuilder<T>(mod, suffix);
     auto clsMatrixBuilderWorkspace = declareMatrixBuilderWorkspace<T>(mod, suffix);
     auto clsMatrixBuilderFactory = declareMatrixBuilderFactory<T>(mod, suffix);
+    auto clsMatrixBuilderPool = declareMatrixBuilderPool<T>(mod, suffix);
+    auto clsMultiEpochMatrixBuilder = declareMultiEpochMatrixBuilder<T>(mod, suffix);
 
     clsMatrixBuilder.attr("Workspace") = clsMatrixBuilderWorkspace;
     clsMatrixBuilder.attr("Factory") = clsMatrixBuilderFactory;
+    clsMatrixBuilder.attr("Pool") = clsMatrixBuilderPool;
+    clsMatrixBuilder.attr("MultiEpoch") = clsMultiEpochMatrixBuilder;
 
     clsMatrixBuilderFactory.attr("Workspace") = clsMatrixBuilderWorkspace;
     clsMatrixBuilderFactory.attr("Builder") = clsMatrixBuilder;
+    clsMatrixBuilderFactory.attr("Pool") = clsMatrixBuilderPool;
+
+    clsMatrixBuilderPool.attr("Factory") = clsMatrixBuilderFactory;
+    clsMatrixBuilderPool.attr("Builder") = clsMatrixBuilder;
+
+    clsMultiEpochMatrixBuilder.attr("Factory") = clsMatrixBuilderFactory;
+    clsMultiEpochMatrixBuilder.attr("Builder") = clsMatrixBuilder;
 }
 
 }  // <anonymous>
 
 PYBIND11_MODULE(matrixBuilder, mod) {
+    py::module::import("lsst.geom");
     py::module::import("lsst.afw.geom");
         declareMatrixBuilderTemplates<float>(mod, "F");
     declareMatrixBuilderTemplates<double>(mod, "D");
@@ -75,14 +75,21 @@ void declareMultiShapeletFunctionEvaluatorMembers(PyClass &cls) {
     cls.def("__call__",
             (ndarray::Array<double, 1, 1> (Class::*)(ndarray::Array<double const, 1> const &,
                                                      ndarray::Array<double const, 1> const &) const) &
-                    Class::operator());
+                    Class::operator(),
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("__call__",
+            (ndarray::Array<float, 1, 1> (Class::*)(ndarray::Array<float const, 1> const &,
+                                                    ndarray::Array<float const, 1> const &) const) &
+                    Class::operator(),
+            py::call_guard<py::gil_scoped_release>());
 
     cls.def("addToImage",
-            (void (Class::*)(ndarray::Array<double, 2, 1> const &, geom::Point2I const &) const) &
+            (void (Class::*)(ndarray::Array<double, 2, 1> const &, geom::Point2I const &, double) const) &
                     Class::addToImage,
-            "array"_a, "xy0"_a = geom::Point2I());
-    cls.def("addToImage", (void (Class::*)(afw::image::Image<double> &) const) & Class::addToImage,
-            "image"_a);
+            "array"_a, "xy0"_a = geom::Point2I(), "truncation"_a = 0.0,
+            py::call_guard<py::gil_scoped_release>());
+    cls.def("addToImage", (void (Class::*)(afw::image::Image<double> &, double) const) & Class::addToImage,
+            "image"_a, "truncation"_a = 0.0, py::call_guard<py::gil_scoped_release>());
 
     cls.def("integrate", &Class::integrate);
     cls.def("computeMoments", &Class::computeMoments);
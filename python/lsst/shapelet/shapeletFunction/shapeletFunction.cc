@@ -88,17 +88,24 @@ PYBIND11_MODULE(shapeletFunction, mod) {
     clsShapeletFunctionEvaluator.def("__call__", (ndarray::Array<double, 1, 1> (ShapeletFunctionEvaluator::*)(
                                                          ndarray::Array<double const, 1> const &,
                                                          ndarray::Array<double const, 1> const &) const) &
-                                                         ShapeletFunctionEvaluator::operator());
+                                                         ShapeletFunctionEvaluator::operator(),
+                                     py::call_guard<py::gil_scoped_release>());
+    clsShapeletFunctionEvaluator.def("__call__", (ndarray::Array<float, 1, 1> (ShapeletFunctionEvaluator::*)(
+                                                         ndarray::Array<float const, 1> const &,
+                                                         ndarray::Array<float const, 1> const &) const) &
+                                                         ShapeletFunctionEvaluator::operator(),
+                                     py::call_guard<py::gil_scoped_release>());
 
     clsShapeletFunctionEvaluator.def(
             "addToImage", (void (ShapeletFunctionEvaluator::*)(ndarray::Array<double, 2, 1> const &,
-                                                               geom::Point2I const &) const) &
+                                                               geom::Point2I const &, double) const) &
                                   ShapeletFunctionEvaluator::addToImage,
-            "array"_a, "xy0"_a = geom::Point2D());
+            "array"_a, "xy0"_a = geom::Point2D(), "truncation"_a = 0.0,
+            py::call_guard<py::gil_scoped_release>());
     clsShapeletFunctionEvaluator.def(
-            "addToImage", (void (ShapeletFunctionEvaluator::*)(afw::image::Image<double> &) const) &
+            "addToImage", (void (ShapeletFunctionEvaluator::*)(afw::image::Image<double> &, double) const) &
                                   ShapeletFunctionEvaluator::addToImage,
-            "image"_a);
+            "image"_a, "truncation"_a = 0.0, py::call_guard<py::gil_scoped_release>());
     clsShapeletFunctionEvaluator.def("integrate", &ShapeletFunctionEvaluator::integrate);
     clsShapeletFunctionEvaluator.def("computeMoments", &ShapeletFunctionEvaluator::computeMoments);
     clsShapeletFunctionEvaluator.def("update", &ShapeletFunctionEvaluator::update);
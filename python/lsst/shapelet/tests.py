@@ -24,6 +24,11 @@
 Test utility code for shapelets library; here so it can be used
 in multiple test scripts and tests in downstream packages.
 """
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
 try:
     import scipy.ndimage
@@ -165,3 +170,48 @@ class ShapeletTestCase(lsst.utils.tests.TestCase):
         self.assertFloatsAlmostEqual(out.getArray(), ic1.getArray(), rtol=1E-4, atol=1E-5)
         self.assertFloatsAlmostEqual(out.getArray(), ic2.getArray(), rtol=1E-4, atol=1E-5)
         return fc1, fc2
+
+    def assertThreadSafe(self, function, args, maxWorkers=4):
+        """Assert that calling function(arg) for each element of args from several Python threads at once
+        gives exactly the same results as calling it serially.
+
+        function must return a sequence of arrays (or of anything else assertFloatsAlmostEqual accepts).
+        """
+        serial = [function(arg) for arg in args]
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            threaded = list(executor.map(function, args))
+        for results, checks in zip(threaded, serial):
+            self.assertEqual(len(results), len(checks))
+            for r, check in zip(results, checks):
+                self.assertFloatsAlmostEqual(r, check, rtol=0.0, atol=0.0)
+
+    def assertReleasesGil(self, function, *args, minTime=0.1):
+        """Assert that function(*args) releases the GIL, by checking that a pure-Python thread makes
+        progress while function is called repeatedly (for at least minTime seconds).
+
+        The interpreter's switch interval is raised while this runs, so the other thread can only run
+        when this one releases the GIL rather than whenever the interpreter forces a switch.
+        """
+        count = [0]
+        done = threading.Event()
+
+        def spin():
+            while not done.is_set():
+                count[0] += 1
+                time.sleep(1E-4)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1E3)
+        thread = threading.Thread(target=spin)
+        try:
+            thread.start()
+            before = count[0]
+            start = time.perf_counter()
+            while time.perf_counter() - start < minTime:
+                function(*args)
+            after = count[0]
+        finally:
+            done.set()
+            thread.join()
+            sys.setswitchinterval(interval)
+        self.assertGreater(after, before, msg="%s does not release the GIL" % function)
@@ -21,6 +21,17 @@
  * see <http://www.lsstcorp.org/LegalNotices/>.
  */
 
+#include <array>
+#include <cstdint>
+#include <cstring>
+#include <list>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <vector>
+
+#include "boost/format.hpp"
+
 #include "lsst/shapelet/ShapeletFunction.h"
 #include "lsst/shapelet/GaussHermiteConvolution.h"
 #include "lsst/geom/Angle.h"
@@ -32,47 +43,69 @@ namespace lsst { namespace shapelet {
 
 namespace {
 
+/*
+ *  The triple product integral of Hermite basis functions, b[l,m,n], where l indexes the PSF basis,
+ *  m the convolved (row) basis, and n the unconvolved (column) basis.
+ *
+ *  Most elements of the full 3-d tensor are zero (by parity and triangularity of both the 2-d blocks
+ *  and the 1-d factors within them), so we only store the nonzero elements, as a flat list ordered
+ *  by (m-block, n-block, l-block) and then (m, n, l) within each block.  This is the order in which
+ *  accumulate() adds them to each output element, so the result is the same as a dense contraction
+ *  that skips exact zeros.
+ */
 class TripleProductIntegral {
 public:
 
-    ndarray::Array<double,3,3> const asArray() const { return _array; }
-
     static ndarray::Array<double,3,3> make1d(int const order1, int const order2, int const order3);
 
     TripleProductIntegral(int order1, int order2, int order3);
 
     ndarray::Vector<int,3> const & getOrders() const { return _orders; }
 
+    /// Return the number of nonzero elements stored.
+    std::size_t getNonzeroCount() const { return _elements.size(); }
+
+    /// Return the approximate memory used by this object, in bytes.
+    std::size_t computeBytes() const {
+        return sizeof(TripleProductIntegral) + _elements.capacity() * sizeof(Element);
+    }
+
+    /**
+     *  Compute [out]_{m,n} += \sum_l i^{n-l-m} [kq]_l b[l,m,n], for all m, n.
+     *
+     *  The i^{n-l-m} factor is always real (it's zero unless n-l-m is even), and is already included
+     *  in the stored elements.
+     */
+    void accumulate(Eigen::VectorXd const & kq, Eigen::MatrixXd & out) const;
+
 private:
 
+    struct Element {
+        int index[3];  // flattened 2-d shapelet indices into the (PSF, row, column) bases
+        double value;  // b[l,m,n] times the i^{n-l-m} phase factor
+    };
+
     ndarray::Vector<int,3> _orders;
-    ndarray::Array<double,3,3> _array;
+    std::vector<Element> _elements;
 };
 
 TripleProductIntegral::TripleProductIntegral(int order1, int order2, int order3) :
-    _orders(ndarray::makeVector(order1, order2, order3)),
-    _array(
-        ndarray::allocate(
-            ndarray::makeVector(
-                computeOffset(order1+1),
-                computeOffset(order2+1),
-                computeOffset(order3+1)
-            )
-        )
-    )
+    _orders(ndarray::makeVector(order1, order2, order3))
 {
-    _array.deep() = 0.0;
     ndarray::Array<double,3,3> a1d = make1d(order1, order2, order3);
-    ndarray::Array<double,3,3>::Index o, i, x, y, n;
-    for (n[0] = o[0] = 0; n[0] <= _orders[0]; o[0] += ++n[0]) {
+    ndarray::Vector<int,3> n, o, x, y;
+    for (n[1] = o[1] = 0; n[1] <= _orders[1]; o[1] += ++n[1]) {
         for (n[2] = o[2] = 0; n[2] <= _orders[2]; o[2] += ++n[2]) {
-            int n0n2 = n[0] + n[2];
-            int max = (order2 < n0n2) ? _orders[1] : n0n2;
-            for (o[1] = n[1] = bool(n0n2 % 2); n[1] <= max; (o[1] += ++n[1]) += ++n[1]) {
-                for (i[0] = o[0], x[0] = 0, y[0] = n[0]; x[0] <= n[0]; ++x[0], --y[0], ++i[0]) {
-                    for (i[2] = o[2], x[2] = 0, y[2] = n[2]; x[2] <= n[2]; ++x[2], --y[2], ++i[2]) {
-                        for (i[1] = o[1], x[1] = 0, y[1] = n[1]; x[1] <= n[1]; ++x[1], --y[1], ++i[1]) {
-                            _array[i] = a1d[x] * a1d[y];
+            for (n[0] = o[0] = bool((n[1]+n[2])%2); n[0] <= _orders[0]; o[0] += ++n[0], o[0] += ++n[0]) {
+                if (n[0] + n[2] < n[1]) continue; // b is triangular
+                double factor = ((n[2] - n[0] - n[1]) % 4) ? -1.0 : 1.0;
+                for (x[1] = 0, y[1] = n[1]; x[1] <= n[1]; ++x[1], --y[1]) {
+                    for (x[2] = 0, y[2] = n[2]; x[2] <= n[2]; ++x[2], --y[2]) {
+                        for (x[0] = 0, y[0] = n[0]; x[0] <= n[0]; ++x[0], --y[0]) {
+                            double value = a1d[x] * a1d[y];
+                            if (value == 0.0) continue;
+                            Element element = { { o[0] + x[0], o[1] + x[1], o[2] + x[2] }, factor * value };
+                            _elements.push_back(element);
                         }
                     }
                 }
@@ -81,6 +114,12 @@ TripleProductIntegral::TripleProductIntegral(int order1, int order2, int order3)
     }
 }
 
+void TripleProductIntegral::accumulate(Eigen::VectorXd const & kq, Eigen::MatrixXd & out) const {
+    for (std::vector<Element>::const_iterator i = _elements.begin(); i != _elements.end(); ++i) {
+        out(i->index[1], i->index[2]) += kq[i->index[0]] * i->value;
+    }
+}
+
 ndarray::Array<double,3,3>
 TripleProductIntegral::make1d(int order1, int order2, int order3) {
     ndarray::Array<double,3,3> array = ndarray::allocate(ndarray::makeVector(order1+1, order2+1, order3+1));
@@ -179,6 +218,111 @@ TripleProductIntegral::make1d(int order1, int order2, int order3) {
 
 } // anonymous
 
+//================= Shared Tables ===========================================================================
+
+namespace {
+
+/*
+ *  A process-wide registry of the tables used by ImplN, which depend only on the orders of the PSF and
+ *  the bases, so they can be shared by all GaussHermiteConvolutions with the same orders.
+ *
+ *  Tables are immutable once constructed, so they can be used concurrently from multiple threads; the
+ *  registry itself is guarded by a mutex.  Tables are constructed without holding the lock, so if two
+ *  threads request the same new table at the same time, both may compute it, but only the first one
+ *  inserted is kept.  Tables stay in the registry until clear() is called.
+ */
+class TableRegistry {
+public:
+
+    typedef std::array<int,3> TripleProductKey;
+
+    static TableRegistry & get() {
+        static TableRegistry instance;
+        return instance;
+    }
+
+    std::shared_ptr<TripleProductIntegral const> getTripleProductIntegral(int order1, int order2, int order3);
+
+    std::shared_ptr<HermiteTransformMatrix const> getHermiteTransformMatrix(int order);
+
+    std::size_t getBytes() const;
+
+    int getCount() const;
+
+    void clear();
+
+private:
+
+    static std::size_t computeBytes(HermiteTransformMatrix const & htm) {
+        int const n = htm.getOrder() + 1;
+        return sizeof(HermiteTransformMatrix) + 2 * n * n * sizeof(double);
+    }
+
+    TableRegistry() : _bytes(0) {}
+
+    mutable std::mutex _mutex;
+    std::size_t _bytes;
+    std::map<TripleProductKey,std::shared_ptr<TripleProductIntegral const>> _tpi;
+    std::map<int,std::shared_ptr<HermiteTransformMatrix const>> _htm;
+};
+
+std::shared_ptr<TripleProductIntegral const> TableRegistry::getTripleProductIntegral(
+    int order1, int order2, int order3
+) {
+    TripleProductKey key = {{ order1, order2, order3 }};
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        auto i = _tpi.find(key);
+        if (i != _tpi.end()) {
+            return i->second;
+        }
+    }
+    std::shared_ptr<TripleProductIntegral const> table =
+        std::make_shared<TripleProductIntegral>(order1, order2, order3);
+    std::lock_guard<std::mutex> lock(_mutex);
+    auto result = _tpi.insert(std::make_pair(key, table));
+    if (result.second) {
+        _bytes += table->computeBytes();
+    }
+    return result.first->second;
+}
+
+std::shared_ptr<HermiteTransformMatrix const> TableRegistry::getHermiteTransformMatrix(int order) {
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        auto i = _htm.find(order);
+        if (i != _htm.end()) {
+            return i->second;
+        }
+    }
+    std::shared_ptr<HermiteTransformMatrix const> table = std::make_shared<HermiteTransformMatrix>(order);
+    std::lock_guard<std::mutex> lock(_mutex);
+    auto result = _htm.insert(std::make_pair(order, table));
+    if (result.second) {
+        _bytes += computeBytes(*table);
+    }
+    return result.first->second;
+}
+
+std::size_t TableRegistry::getBytes() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _bytes;
+}
+
+int TableRegistry::getCount() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _tpi.size() + _htm.size();
+}
+
+void TableRegistry::clear() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    _tpi.clear();
+    _htm.clear();
+    _bytes = 0;
+}
+
+} // anonymous
+
 //================= Impl Base Class =========================================================================
 
 class GaussHermiteConvolution::Impl {
@@ -188,26 +332,127 @@ public:
 
     virtual ndarray::Array<double const,2,2> evaluate(afw::geom::ellipses::Ellipse & ellipse) const = 0;
 
+    ndarray::Array<double const,2,2> evaluateCached(afw::geom::ellipses::Ellipse & ellipse) const;
+
     int getColOrder() const { return _colOrder; }
 
     int getRowOrder() const { return _rowOrder; }
 
+    void enableCache(int capacity, double quantum);
+
+    void disableCache();
+
+    int getCacheCapacity() const { return _cacheCapacity; }
+
+    long getCacheHitCount() const { return _cacheHitCount; }
+
+    long getCacheMissCount() const { return _cacheMissCount; }
+
     virtual ~Impl() {}
 
 protected:
     int _rowOrder;
     int _colOrder;
     ShapeletFunction _psf;
+    Eigen::Matrix2d _psfTransform; // inverse of the PSF ellipse's grid transform, which is fixed
     ndarray::Array<double,2,2> _result;
+
+private:
+
+    // The cache key is the three quadrupole moments of the input core, either as the bit patterns of
+    // the doubles (for exact matching) or rounded to integer multiples of the quantum.
+    typedef std::array<std::int64_t,3> CacheKey;
+    typedef std::pair< CacheKey, ndarray::Array<double const,2,2> > CacheEntry;
+    typedef std::list<CacheEntry> CacheList;
+    typedef std::map<CacheKey,CacheList::iterator> CacheMap;
+
+    CacheKey makeCacheKey(afw::geom::ellipses::Ellipse const & ellipse) const;
+
+    int _cacheCapacity;
+    double _cacheQuantum;
+    mutable long _cacheHitCount;
+    mutable long _cacheMissCount;
+    mutable CacheList _cacheList; // most-recently-used first
+    mutable CacheMap _cacheMap;
 };
 
 GaussHermiteConvolution::Impl::Impl(
     int colOrder, ShapeletFunction const & psf
 ) :
     _rowOrder(colOrder + psf.getOrder()), _colOrder(colOrder), _psf(psf),
-    _result(ndarray::allocate(computeSize(_rowOrder), computeSize(_colOrder)))
+    _result(ndarray::allocate(computeSize(_rowOrder), computeSize(_colOrder))),
+    _cacheCapacity(0), _cacheQuantum(0.0), _cacheHitCount(0), _cacheMissCount(0)
 {
     _psf.changeBasisType(HERMITE);
+    _psfTransform = _psf.getEllipse().getCore().getGridTransform().inverted().getMatrix();
+}
+
+GaussHermiteConvolution::Impl::CacheKey GaussHermiteConvolution::Impl::makeCacheKey(
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    afw::geom::ellipses::Quadrupole q(ellipse.getCore());
+    double const moments[3] = { q.getIxx(), q.getIyy(), q.getIxy() };
+    CacheKey key;
+    for (int i = 0; i < 3; ++i) {
+        if (_cacheQuantum > 0.0) {
+            key[i] = std::llround(moments[i] / _cacheQuantum);
+        } else {
+            std::memcpy(&key[i], &moments[i], sizeof(double));
+        }
+    }
+    return key;
+}
+
+ndarray::Array<double const,2,2> GaussHermiteConvolution::Impl::evaluateCached(
+    afw::geom::ellipses::Ellipse & ellipse
+) const {
+    if (_cacheCapacity <= 0) {
+        return evaluate(ellipse);
+    }
+    CacheKey key = makeCacheKey(ellipse);
+    CacheMap::iterator i = _cacheMap.find(key);
+    if (i != _cacheMap.end()) {
+        ++_cacheHitCount;
+        _cacheList.splice(_cacheList.begin(), _cacheList, i->second);
+        ellipse.convolve(_psf.getEllipse()).inPlace();
+        return i->second->second;
+    }
+    ++_cacheMissCount;
+    ndarray::Array<double const,2,2> result = ndarray::copy(evaluate(ellipse));
+    if (static_cast<int>(_cacheList.size()) >= _cacheCapacity) {
+        _cacheMap.erase(_cacheList.back().first);
+        _cacheList.pop_back();
+    }
+    _cacheList.push_front(CacheEntry(key, result));
+    _cacheMap[key] = _cacheList.begin();
+    return result;
+}
+
+void GaussHermiteConvolution::Impl::enableCache(int capacity, double quantum) {
+    if (capacity <= 0) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Cache capacity (%d) must be positive") % capacity).str()
+        );
+    }
+    if (!(quantum >= 0.0)) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Cache quantum (%g) must not be negative") % quantum).str()
+        );
+    }
+    disableCache();
+    _cacheCapacity = capacity;
+    _cacheQuantum = quantum;
+}
+
+void GaussHermiteConvolution::Impl::disableCache() {
+    _cacheCapacity = 0;
+    _cacheQuantum = 0.0;
+    _cacheHitCount = 0;
+    _cacheMissCount = 0;
+    _cacheList.clear();
+    _cacheMap.clear();
 }
 
 //================= ImplN: Arbitrary Order ==================================================================
@@ -222,88 +467,134 @@ public:
     virtual ndarray::Array<double const,2,2> evaluate(afw::geom::ellipses::Ellipse & ellipse) const;
 
 private:
-    TripleProductIntegral _tpi;
-    HermiteTransformMatrix _htm;
+
+    // A (transposed) block of the PSF transform matrix that contributes to kq:
+    // kq[rows] += psfMat[inner, rows]^T signedPsfCoefficients[inner]
+    struct KqBlock {
+        int rowOffset;
+        int rowSize;
+        int innerOffset;
+        int innerSize;
+    };
+
+    // A block of the final contraction:
+    // result[rows, cols] +/-= kqb[rows, inner] modelMat[cols, inner]^T
+    struct ResultBlock {
+        int rowOffset;
+        int rowSize;
+        int colOffset;
+        int colSize;
+        int innerOffset;
+        int innerSize;
+        bool negative;
+    };
+
+    std::shared_ptr<TripleProductIntegral const> _tpi;
+    std::shared_ptr<HermiteTransformMatrix const> _htm;
+    // Everything below depends only on the PSF and the orders, and is computed once at construction.
+    // The i^{n+m} factors in kq are separable into a per-n sign, folded into the PSF coefficients, and
+    // a per-m sign, folded (along with the 4\pi normalization) into the kq scale factors.
+    Eigen::VectorXd _signedPsfCoefficients;
+    Eigen::VectorXd _kqScales;
+    std::vector<KqBlock> _kqPlan;
+    std::vector<ResultBlock> _resultPlan;
+    // Scratch space for evaluate(), allocated once here so repeated evaluations don't allocate.
+    mutable Eigen::MatrixXd _psfMat;
+    mutable Eigen::MatrixXd _modelMat;
+    mutable Eigen::VectorXd _htmWorkspace;
+    mutable Eigen::VectorXd _kq;
+    mutable Eigen::MatrixXd _kqb;
 };
 
 ImplN::ImplN(
     int colOrder, ShapeletFunction const & psf
 ) :
     GaussHermiteConvolution::Impl(colOrder, psf),
-    _tpi(psf.getOrder(), _rowOrder, _colOrder),
-    _htm(_rowOrder)
-{}
+    _tpi(TableRegistry::get().getTripleProductIntegral(psf.getOrder(), _rowOrder, _colOrder)),
+    _htm(TableRegistry::get().getHermiteTransformMatrix(_rowOrder)),
+    _signedPsfCoefficients(computeSize(psf.getOrder())),
+    _kqScales(psf.getOrder() + 1),
+    _psfMat(computeSize(psf.getOrder()), computeSize(psf.getOrder())),
+    _modelMat(computeSize(_colOrder), computeSize(_colOrder)),
+    _htmWorkspace(HermiteTransformMatrix::computeWorkspace(std::max(psf.getOrder(), _colOrder))),
+    _kq(computeSize(psf.getOrder())),
+    _kqb(computeSize(_rowOrder), computeSize(_colOrder))
+{
+    int const psfOrder = _psf.getOrder();
+    auto psf_coeff = ndarray::asEigenMatrix(_psf.getCoefficients());
+    // For n and m with the same parity, i^{n+m} = s(n) t(m), with s(n) = +1 for n % 4 in {0, 1} and
+    // t(m) = +1 for m % 4 in {0, 3} (and -1 otherwise).  Both are exact sign flips, so folding them in
+    // doesn't change any rounding.
+    for (int n = 0, no = 0; n <= psfOrder; no += ++n) {
+        _signedPsfCoefficients.segment(no, n+1) = psf_coeff.segment(no, n+1);
+        if (n % 4 >= 2) {
+            _signedPsfCoefficients.segment(no, n+1) *= -1.0;
+        }
+        _kqScales[n] = (n % 4 == 0 || n % 4 == 3) ? 4.0 * geom::PI : -4.0 * geom::PI;
+    }
+    for (int m = 0, mo = 0; m <= psfOrder; mo += ++m) {
+        for (int n = m, no = mo; n <= psfOrder; no += ++n, no += ++n) {
+            KqBlock block = {mo, m+1, no, n+1};
+            _kqPlan.push_back(block);
+        }
+    }
+    for (int m = 0, mo = 0; m <= _rowOrder; mo += ++m) {
+        for (int n = 0, no = 0; n <= _colOrder; no += ++n) {
+            int jo = bool(n % 2);
+            for (int j = jo; j <= n; jo += ++j, jo += ++j) {
+                // (n - j) % 4 is always 0 or 2
+                ResultBlock block = {mo, m+1, no, n+1, jo, j+1, bool((n - j) % 4)};
+                _resultPlan.push_back(block);
+            }
+        }
+    }
+}
 
 ndarray::Array<double const,2,2> ImplN::evaluate(
     afw::geom::ellipses::Ellipse & ellipse
 ) const {
     auto result = ndarray::asEigenMatrix(_result);
-    auto psf_coeff = ndarray::asEigenMatrix(_psf.getCoefficients());
 
-    Eigen::Matrix2d psfT = _psf.getEllipse().getCore().getGridTransform().inverted().getMatrix();
     Eigen::Matrix2d modelT = ellipse.getCore().getGridTransform().inverted().getMatrix();
     ellipse.convolve(_psf.getEllipse()).inPlace();
     Eigen::Matrix2d convolvedTI = ellipse.getCore().getGridTransform().getMatrix() * std::sqrt(2.0);
-    Eigen::Matrix2d psfArg = (convolvedTI * psfT).transpose();
+    Eigen::Matrix2d psfArg = (convolvedTI * _psfTransform).transpose();
     Eigen::Matrix2d modelArg = (convolvedTI * modelT).transpose();
 
     int const psfOrder = _psf.getOrder();
 
-    Eigen::MatrixXd psfMat = _htm.compute(psfArg, psfOrder);
-    Eigen::MatrixXd modelMat = _htm.compute(modelArg, _colOrder);
+    _htm->compute(psfArg, psfOrder, _psfMat, _htmWorkspace);
+    _htm->compute(modelArg, _colOrder, _modelMat, _htmWorkspace);
+
+    // The products below are all evaluated with noalias(), as none of the operands overlap; without
+    // it, Eigen would allocate a temporary for each product.
 
     // [kq]_m = \sum_m i^{n+m} [psfMat]_{m,n} [psf]_n
     // kq is zero unless {n+m} is even
-    Eigen::VectorXd kq = Eigen::VectorXd::Zero(psfMat.size());
+    _kq.setZero();
+    for (std::vector<KqBlock>::const_iterator i = _kqPlan.begin(); i != _kqPlan.end(); ++i) {
+        _kq.segment(i->rowOffset, i->rowSize).noalias()
+            += _psfMat.block(i->innerOffset, i->rowOffset, i->innerSize, i->rowSize).adjoint()
+            * _signedPsfCoefficients.segment(i->innerOffset, i->innerSize);
+    }
     for (int m = 0, mo = 0; m <= psfOrder; mo += ++m) {
-        for (int n = m, no = mo; n <= psfOrder; no += ++n, no += ++n) {
-            if ((n + m) % 4) { // (n + m) % 4 is always 0 or 2
-                kq.segment(mo, m+1) -= psfMat.block(no, mo, n+1, m+1).adjoint() * psf_coeff.segment(no, n+1);
-            } else {
-                kq.segment(mo, m+1) += psfMat.block(no, mo, n+1, m+1).adjoint() * psf_coeff.segment(no, n+1);
-            }
-        }
+        _kq.segment(mo, m+1) *= _kqScales[m];
     }
-    kq *= 4.0 * geom::PI;
 
     // [kqb]_{m,n} = \sum_l i^{m-n-l} [kq]_l [tpi]_{l,m,n}
-    Eigen::MatrixXd kqb = Eigen::MatrixXd::Zero(result.rows(), result.cols());
-    {
-        ndarray::Array<double,3,3> b = _tpi.asArray();
-        ndarray::Vector<int,3> n, o, x;
-        x[0] = 0;
-        for (n[1] = o[1] = 0; n[1] <= _rowOrder; o[1] += ++n[1]) {
-            for (n[2] = o[2] = 0; n[2] <= _colOrder; o[2] += ++n[2]) {
-                for (n[0] = o[0] = bool((n[1]+n[2])%2); n[0] <= psfOrder; o[0] += ++n[0], o[0] += ++n[0]) {
-                    if (n[0] + n[2] < n[1]) continue; // b is triangular
-                    double factor = ((n[2] - n[0] - n[1]) % 4) ? -1.0 : 1.0;
-                    for (x[1] = 0; x[1] <= n[1]; ++x[1]) {
-                        for (x[2] = 0; x[2] <= n[2]; ++x[2]) {
-                            // TODO: optimize this inner loop - it's sparse
-                            double & out = kqb(o[1] + x[1], o[2] + x[2]);
-                            for (x[0] = 0; x[0] <= n[0]; ++x[0]) {
-                                out += factor * kq[o[0] + x[0]] * b[o + x];
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
+    _kqb.setZero();
+    _tpi->accumulate(_kq, _kqb);
 
     result.setZero();
-    for (int m = 0, mo = 0; m <= _rowOrder; mo += ++m) {
-        for (int n = 0, no = 0; n <= _colOrder; no += ++n) {
-            int jo = bool(n % 2);
-            for (int j = jo; j <= n; jo += ++j, jo += ++j) {
-                if ((n - j) % 4) { // (n - j) % 4 is always 0 or 2
-                    result.block(mo, no, m+1, n+1)
-                        -= kqb.block(mo, jo, m+1, j+1) * modelMat.block(no, jo, n+1, j+1).adjoint();
-                } else {
-                    result.block(mo, no, m+1, n+1)
-                        += kqb.block(mo, jo, m+1, j+1) * modelMat.block(no, jo, n+1, j+1).adjoint();
-                }
-            }
+    for (std::vector<ResultBlock>::const_iterator i = _resultPlan.begin(); i != _resultPlan.end(); ++i) {
+        if (i->negative) {
+            result.block(i->rowOffset, i->colOffset, i->rowSize, i->colSize).noalias()
+                -= _kqb.block(i->rowOffset, i->innerOffset, i->rowSize, i->innerSize)
+                * _modelMat.block(i->colOffset, i->innerOffset, i->colSize, i->innerSize).adjoint();
+        } else {
+            result.block(i->rowOffset, i->colOffset, i->rowSize, i->colSize).noalias()
+                += _kqb.block(i->rowOffset, i->innerOffset, i->rowSize, i->innerSize)
+                * _modelMat.block(i->colOffset, i->innerOffset, i->colSize, i->innerSize).adjoint();
         }
     }
 
@@ -345,10 +636,9 @@ ndarray::Array<double const,2,2> Impl0::evaluate(
 ) const {
     ndarray::Array<double const,1,1> psfCoeff(_psf.getCoefficients());
 
-    Eigen::Matrix2d psfT = _psf.getEllipse().getCore().getGridTransform().inverted().getMatrix();
     ellipse.convolve(_psf.getEllipse()).inPlace();
     Eigen::Matrix2d convolvedTI = ellipse.getCore().getGridTransform().getMatrix();
-    Eigen::Matrix2d psfArg = (convolvedTI * psfT).transpose();
+    Eigen::Matrix2d psfArg = (convolvedTI * _psfTransform).transpose();
 
     int const psfOrder = _psf.getOrder();
 
@@ -506,9 +796,27 @@ ndarray::Array<double const,2,2>
 GaussHermiteConvolution::evaluate(
     afw::geom::ellipses::Ellipse & ellipse
 ) const {
-    return _impl->evaluate(ellipse);
+    return _impl->evaluateCached(ellipse);
+}
+
+void GaussHermiteConvolution::enableCache(int capacity, double quantum) {
+    _impl->enableCache(capacity, quantum);
 }
 
+void GaussHermiteConvolution::disableCache() { _impl->disableCache(); }
+
+int GaussHermiteConvolution::getCacheCapacity() const { return _impl->getCacheCapacity(); }
+
+long GaussHermiteConvolution::getCacheHitCount() const { return _impl->getCacheHitCount(); }
+
+long GaussHermiteConvolution::getCacheMissCount() const { return _impl->getCacheMissCount(); }
+
+std::size_t GaussHermiteConvolution::getTableCacheBytes() { return TableRegistry::get().getBytes(); }
+
+int GaussHermiteConvolution::getTableCacheCount() { return TableRegistry::get().getCount(); }
+
+void GaussHermiteConvolution::clearTableCache() { TableRegistry::get().clear(); }
+
 GaussHermiteConvolution::GaussHermiteConvolution(
     int colOrder,
     ShapeletFunction const & psf
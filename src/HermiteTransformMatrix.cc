@@ -21,49 +21,67 @@
  * see <http://www.lsstcorp.org/LegalNotices/>.
  */
 
+#include <algorithm>
+
 #include "lsst/shapelet/HermiteTransformMatrix.h"
 
 namespace lsst { namespace shapelet {
 
 namespace {
 
-class Binomial {
+/*
+ *  A table of the terms of the binomial expansions (a + b)^n for all n <= nMax, i.e.
+ *  binomial(n, k) = C(n, k) a^{n-k} b^k.
+ *
+ *  The table is filled once per call to compute(), so the innermost loops there are just lookups.
+ *  Powers are accumulated by repeated multiplication (not std::pow) so each term is computed with
+ *  exactly the same floating-point operations as a direct per-n evaluation would use.
+ *
+ *  The table does not own its memory; it uses computeStorage(nMax) doubles starting at the given
+ *  pointer, so compute() can be called repeatedly without allocating.
+ */
+class BinomialTable {
 public:
 
-    Binomial(int const nMax);
+    BinomialTable(int const nMax, double a, double b, double * storage);
 
-    void reset(int const n, double a, double b);
+    double operator()(int const n, int const k) const { return _terms[n*_stride + k]; }
 
-    double const operator[](int const k) const { return _workspace[k] * _coefficients[k]; }
-
-    int const getOrder() const { return _coefficients.size()-1; }
+    static int computeStorage(int const nMax) { return (nMax + 1)*(nMax + 3); }
 
 private:
-    Eigen::VectorXd _coefficients;
-    Eigen::VectorXd _workspace;
+    int _stride;
+    double * _terms;
 };
 
-Binomial::Binomial(int const nMax) : _coefficients(nMax+1), _workspace(nMax+1) {}
-
-void Binomial::reset(int const n, double a, double b) {
-    assert(n < _coefficients.size());
-    _coefficients[0] = _coefficients[n] = 1.0;
-    int const mid = n/2;
-    for (int k = 1; k <= mid; ++k) {
-        _coefficients[k] = _coefficients[k-1] * (n - k + 1.0) / k;
-    }
-    for (int k = mid+1; k < n; ++k) {
-        _coefficients[k] = _coefficients[n-k];
-    }
-    double v = 1;
-    for (int k = 0; k <= n; ++k) {
-        _workspace[k] = v;
-        v *= b;
+BinomialTable::BinomialTable(int const nMax, double a, double b, double * storage) :
+    _stride(nMax + 1), _terms(storage)
+{
+    // The powers go after the (nMax+1)x(nMax+1) table, and the binomial coefficients for each n are
+    // computed in place in row n before being multiplied by the powers.
+    double * aPowers = _terms + _stride*_stride;
+    double * bPowers = aPowers + _stride;
+    double va = 1;
+    double vb = 1;
+    for (int k = 0; k <= nMax; ++k) {
+        aPowers[k] = va;
+        bPowers[k] = vb;
+        va *= a;
+        vb *= b;
     }
-    v = 1;
-    for (int nk = n; nk >= 0; --nk) {
-        _workspace[nk] *= v;
-        v *= a;
+    for (int n = 0; n <= nMax; ++n) {
+        double * coefficients = _terms + n*_stride;
+        coefficients[0] = coefficients[n] = 1.0;
+        int const mid = n/2;
+        for (int k = 1; k <= mid; ++k) {
+            coefficients[k] = coefficients[k-1] * (n - k + 1.0) / k;
+        }
+        for (int k = mid+1; k < n; ++k) {
+            coefficients[k] = coefficients[n-k];
+        }
+        for (int k = 0; k <= n; ++k) {
+            coefficients[k] = bPowers[k] * aPowers[n-k] * coefficients[k];
+        }
     }
 }
 
@@ -90,6 +108,22 @@ HermiteTransformMatrix::HermiteTransformMatrix(int order) :
 }
 
 Eigen::MatrixXd HermiteTransformMatrix::compute(Eigen::Matrix2d const & transform, int order) const {
+    Eigen::MatrixXd result;
+    Eigen::VectorXd workspace;
+    compute(transform, order, result, workspace);
+    return result;
+}
+
+int HermiteTransformMatrix::computeWorkspace(int order) {
+    return 2*BinomialTable::computeStorage(order);
+}
+
+void HermiteTransformMatrix::compute(
+    Eigen::Matrix2d const & transform,
+    int order,
+    Eigen::MatrixXd & result,
+    Eigen::VectorXd & workspace
+) const {
     if (order > _order) {
         throw LSST_EXCEPT(
             pex::exceptions::InvalidParameterError,
@@ -100,25 +134,40 @@ Eigen::MatrixXd HermiteTransformMatrix::compute(Eigen::Matrix2d const & transfor
         );
     }
     int const size = computeSize(order);
-    Eigen::MatrixXd result = Eigen::MatrixXd::Zero(size, size);
-    Binomial binomial_m(order);
-    Binomial binomial_n(order);
+    result.resize(size, size);
+    result.setZero();
+    if (workspace.size() < computeWorkspace(order)) {
+        workspace.resize(computeWorkspace(order));
+    }
+    BinomialTable const binomial_m(order, transform(0,0), transform(0,1), workspace.data());
+    BinomialTable const binomial_n(
+        order, transform(1,0), transform(1,1), workspace.data() + BinomialTable::computeStorage(order)
+    );
+    // The loops below only visit terms that are not identically zero, using the structure of the
+    // (lower-triangular, alternating-parity) coefficient matrices:
+    //  - _coeffFwd(k, m) is zero unless m <= k and m has the same parity as k;
+    //  - _coeffInv(i, j) is zero unless j <= i and j has the same parity as i.
+    // Because kn and jn have the same parity, the second condition on both _coeffInv factors reduces to
+    // p+q >= jy, m+n-p-q >= jx, and p+q having the same parity as jy.  The nonzero terms are still
+    // accumulated in the same order, and skipped terms are exact zeros, so the result is bit-for-bit
+    // identical to summing over all (m, p, n, q) (for finite transforms).
     for (int jn=0, joff=0; jn <= order; joff += (++jn)) {
         for (int kn=jn, koff=joff; kn <= order; koff += ++kn, koff += ++kn) {
             for (int jx=0,jy=jn; jx <= jn; ++jx,--jy) {
                 for (int kx=0,ky=kn; kx <= kn; ++kx,--ky) {
                     double & element = result(koff+kx, joff+jx);
-                    for (int m = 0; m <= order; ++m) {
+                    for (int m = kx % 2; m <= kx; m += 2) {
                         int const order_minus_m = order - m;
-                        binomial_m.reset(m, transform(0,0), transform(0,1));
+                        int const n_max = std::min(ky, order_minus_m);
                         for (int p = 0; p <= m; ++p) {
-                            double const tmp1 = binomial_m[p] * _coeffFwd(kx, m);
-                            for (int n = 0; n <= order_minus_m; ++n) {
-                                binomial_n.reset(n, transform(1,0), transform(1,1));
+                            double const tmp1 = binomial_m(m, p) * _coeffFwd(kx, m);
+                            int const q_min = (p < jy) ? (jy - p) : ((p - jy) % 2);
+                            for (int n = ky % 2; n <= n_max; n += 2) {
                                 double const tmp2 = _coeffFwd(ky, n) * tmp1;
-                                for (int q = 0; q <= n; ++q) {
+                                int const q_max = std::min(n, m + n - p - jx);
+                                for (int q = q_min; q <= q_max; q += 2) {
                                     element += tmp2 * _coeffInv(m+n-p-q, jx) * _coeffInv(p+q, jy)
-                                        * binomial_n[q];
+                                        * binomial_n(n, q);
                                 } // q
                             } // n
                         } // p
@@ -127,7 +176,6 @@ Eigen::MatrixXd HermiteTransformMatrix::compute(Eigen::Matrix2d const & transfor
             } // jx,jy
         } // kn
     } // jn
-    return result;
 }
 
 }} // namespace lsst::shapelet
@@ -21,8 +21,17 @@
  * see <http://www.lsstcorp.org/LegalNotices/>.
  */
 
+#include <algorithm>
 #include <cmath>
+#include <condition_variable>
+#include <exception>
+#include <functional>
 #include <memory>
+#include <mutex>
+#include <new>
+#include <numeric>
+#include <thread>
+#include "boost/format.hpp"
 #include "ndarray/eigen.h"
 
 #include "lsst/shapelet/MatrixBuilder.h"
@@ -53,6 +62,42 @@ namespace lsst { namespace shapelet {
  * MatrixBuilder constructor.
  */
 
+namespace {
+
+/*
+ *  Add the contribution of a block of rows of the model matrix M to the lower triangle of gram (M^T W M)
+ *  and to projection (M^T W d), where W is the diagonal matrix of (nonnegative) weights, d is the data
+ *  vector, and row r of the block holds the data point with index rows(r).  The block is overwritten
+ *  (each row is multiplied by the square root of its weight), and so are the first block.rows() rows of
+ *  scratch, which must have (at least) that many rows and two columns.
+ */
+template <typename T, typename BlockT, typename RowFunction>
+void accumulateNormalEquations(
+    ndarray::Array<T,2,2> const & gram,
+    ndarray::Array<T,1,1> const & projection,
+    ndarray::Array<T const,1,1> const & weights,
+    ndarray::Array<T const,1,1> const & data,
+    BlockT block,
+    typename MatrixBuilderWorkspace<T>::Matrix scratch,
+    RowFunction rows
+) {
+    int const size = block.rows();
+    typedef Eigen::Map< Eigen::Matrix<T,Eigen::Dynamic,1> > ScratchVector;
+    ScratchVector sqrtWeights(scratch.data(), size);
+    ScratchVector weightedData(scratch.data() + scratch.rows(), size);
+    for (int r = 0; r < size; ++r) {
+        int const i = rows(r);
+        sqrtWeights[r] = std::sqrt(weights[i]);
+        weightedData[r] = sqrtWeights[r] * data[i];
+    }
+    block = sqrtWeights.asDiagonal() * block;
+    auto gramMatrix = ndarray::asEigenMatrix(gram);
+    gramMatrix.template selfadjointView<Eigen::Lower>().rankUpdate(block.transpose());
+    ndarray::asEigenMatrix(projection).noalias() += block.transpose() * weightedData;
+}
+
+} // anonymous
+
 template <typename T>
 class MatrixBuilder<T>::Impl {
 public:
@@ -66,6 +111,44 @@ public:
         afw::geom::ellipses::Ellipse const & ellipse
     ) = 0;
 
+    // Like buildMatrix, but also accumulates the derivatives of the matrix with respect to the ellipse
+    // parameters into derivatives[i].transpose() for i in [0, 5).
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) = 0;
+
+    // Accumulate the product of the matrix buildMatrix would compute and the given coefficients into
+    // output, without forming the matrix.
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) = 0;
+
+    // Accumulate the lower triangle of M^T W M into gram and M^T W d into projection, where M is the
+    // matrix buildMatrix would compute.  This default implementation evaluates all of M at once;
+    // implementations that can evaluate it one tile of data points at a time override it.
+    virtual void buildNormalEquations(
+        ndarray::Array<T,2,2> const & gram,
+        ndarray::Array<T,1,1> const & projection,
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        ndarray::Array<T,2,2> matrixT = ndarray::allocate(getBasisSize(), getDataSize());
+        matrixT.deep() = 0.0;
+        ndarray::Array<T,2,-2> matrix = matrixT.transpose();
+        buildMatrix(matrix, ellipse);
+        Eigen::Array<T,Eigen::Dynamic,Eigen::Dynamic> scratch(getDataSize(), 2);
+        accumulateNormalEquations(
+            gram, projection, weights, data, ndarray::asEigenMatrix(matrix),
+            typename MatrixBuilderWorkspace<T>::Matrix(scratch.data(), scratch.rows(), scratch.cols()),
+            [](int r) { return r; }
+        );
+    }
+
     virtual ~Impl() {}
 
 };
@@ -77,6 +160,51 @@ public:
     typedef MatrixBuilderWorkspace<T> Workspace;
     typedef typename MatrixBuilder<T>::Impl BuilderImpl;
 
+    Impl() :
+        _threadCount(1), _convolutionCacheCapacity(0), _convolutionCacheQuantum(0.0), _cutoff(0.0),
+        _tileSize(0), _derivativesEnabled(false), _component(false)
+    {}
+
+    int getThreadCount() const { return _threadCount; }
+
+    void setThreadCount(int threadCount) { _threadCount = threadCount; }
+
+    int getConvolutionCacheCapacity() const { return _convolutionCacheCapacity; }
+
+    double getConvolutionCacheQuantum() const { return _convolutionCacheQuantum; }
+
+    virtual void setConvolutionCache(int capacity, double quantum) {
+        _convolutionCacheCapacity = capacity;
+        _convolutionCacheQuantum = quantum;
+    }
+
+    double getCutoff() const { return _cutoff; }
+
+    virtual void setCutoff(double cutoff) { _cutoff = cutoff; }
+
+    int getTileSize() const { return _tileSize; }
+
+    virtual void setTileSize(int tileSize) { _tileSize = tileSize; }
+
+    bool getDerivativesEnabled() const { return _derivativesEnabled; }
+
+    virtual void setDerivativesEnabled(bool enabled) { _derivativesEnabled = enabled; }
+
+    // Number of data points in each tile when computing normal equations, which (unlike the matrix itself)
+    // are always evaluated in tiles, so the full matrix never needs to be held in memory.  This is zero
+    // for components of compound and multi-band builders, which evaluate normal equations with a tile of
+    // their own instead.
+    int getNormalTileSize() const {
+        if (_component) {
+            return 0;
+        }
+        int const tileSize = (_tileSize > 0) ? _tileSize : int(DEFAULT_NORMAL_TILE_SIZE);
+        return std::min(tileSize, getDataSize());
+    }
+
+    // Mark this as the factory for a component of a compound or multi-band builder.
+    void setComponent(bool component) { _component = component; }
+
     virtual int getDataSize() const = 0;
 
     virtual int getBasisSize() const = 0;
@@ -92,6 +220,18 @@ public:
 
     virtual ~Impl() {}
 
+private:
+    // Tile size for normal equations when no tile size is set; small enough that a tile of the matrix
+    // stays in cache while it is multiplied by itself.
+    static constexpr int DEFAULT_NORMAL_TILE_SIZE = 256;
+
+    int _threadCount;
+    int _convolutionCacheCapacity;
+    double _convolutionCacheQuantum;
+    double _cutoff;
+    int _tileSize;
+    bool _derivativesEnabled;
+    bool _component;
 };
 
 //===========================================================================================================
@@ -104,10 +244,104 @@ public:
  * of the coordinate arrays in the coordinate system where the ellipse we're evaluating on is the unit
  * circle.  In other words, all the derived classes just have to worry about evaluating circular basis
  * functions, and the base class handles turning those into ellipses by giving them transformed inputs.
+ *
+ * When the factory has a cutoff, only the points within that radius in the transformed coordinate system
+ * are "active": the transformed coordinates of the active points are packed at the beginning of the
+ * temporary arrays, with their indices in the original arrays in _active, and the derived classes only
+ * evaluate (and then scatter into the output) those.  A PointIndex shared by all builders from the same
+ * factory lets us find the active points without transforming all of them, by only considering the
+ * points in the bounding box of the ellipse scaled by the cutoff.
  */
 
 namespace {
 
+/*
+ * A spatial index of the data points, used to find the points within a box without looking at all of
+ * them.  The points are sorted by y and split into bands with (nearly) the same number of points - about
+ * the square root of the total, so there are about as many bands as there are points in each - and the
+ * points within each band are sorted by x.  For data points on a pixel grid, each band is then just a
+ * row (or a few rows) of pixels.  Finding the points in a box takes a binary search over bands in y,
+ * and then a binary search in x within each band that overlaps the box, yielding one contiguous run of
+ * sorted positions per band.
+ */
+template <typename T>
+class PointIndex {
+public:
+
+    PointIndex(ndarray::Array<T const,1,1> const & x, ndarray::Array<T const,1,1> const & y) :
+        _indices(x.template getSize<0>()), _x(x.template getSize<0>()), _y(x.template getSize<0>())
+    {
+        int const n = _indices.size();
+        int const nBands = std::max(1, static_cast<int>(std::sqrt(n)));
+        std::iota(_indices.begin(), _indices.end(), 0);
+        std::stable_sort(
+            _indices.begin(), _indices.end(),
+            [&y](int a, int b) { return y[a] < y[b]; }
+        );
+        _bandBegin.reserve(nBands + 1);
+        _bandYMin.reserve(nBands);
+        _bandYMax.reserve(nBands);
+        for (int band = 0; band < nBands; ++band) {
+            int const begin = (band * n) / nBands;
+            int const end = ((band + 1) * n) / nBands;
+            _bandBegin.push_back(begin);
+            if (begin == end) {
+                // only possible if there are no points at all
+                _bandYMin.push_back(0.0);
+                _bandYMax.push_back(0.0);
+                continue;
+            }
+            _bandYMin.push_back(y[_indices[begin]]);
+            _bandYMax.push_back(y[_indices[end - 1]]);
+            std::stable_sort(
+                _indices.begin() + begin, _indices.begin() + end,
+                [&x](int a, int b) { return x[a] < x[b]; }
+            );
+        }
+        _bandBegin.push_back(n);
+        for (int k = 0; k < n; ++k) {
+            _x[k] = x[_indices[k]];
+            _y[k] = y[_indices[k]];
+        }
+    }
+
+    /*
+     *  Call function(begin, end) for a set of non-overlapping ranges [begin, end) of sorted positions
+     *  that together include all points with xMin <= x <= xMax and yMin <= y <= yMax (as well as some
+     *  points with y just outside that range).
+     */
+    template <typename Function>
+    void forEachRun(double xMin, double xMax, double yMin, double yMax, Function function) const {
+        // Both _bandYMin and _bandYMax are sorted, so the bands that overlap [yMin, yMax] are contiguous.
+        int band = std::lower_bound(_bandYMax.begin(), _bandYMax.end(), yMin) - _bandYMax.begin();
+        int const nBands = _bandYMin.size();
+        for (; band < nBands && _bandYMin[band] <= yMax; ++band) {
+            typename std::vector<T>::const_iterator const begin = _x.begin() + _bandBegin[band];
+            typename std::vector<T>::const_iterator const end = _x.begin() + _bandBegin[band + 1];
+            int const first = std::lower_bound(begin, end, xMin) - _x.begin();
+            int const last = std::upper_bound(begin, end, xMax) - _x.begin();
+            if (first < last) {
+                function(first, last);
+            }
+        }
+    }
+
+    T getX(int k) const { return _x[k]; }
+
+    T getY(int k) const { return _y[k]; }
+
+    // Return the index of the k-th sorted point in the original arrays.
+    int getIndex(int k) const { return _indices[k]; }
+
+private:
+    std::vector<int> _indices;
+    std::vector<T> _x;
+    std::vector<T> _y;
+    std::vector<int> _bandBegin;  // sorted position of the first point in each band, and then the size
+    std::vector<T> _bandYMin;
+    std::vector<T> _bandYMax;
+};
+
 template <typename T>
 class SimpleImpl : public MatrixBuilder<T>::Impl {
 public:
@@ -124,15 +358,30 @@ public:
 
         virtual int getDataSize() const { return _x.template getSize<0>(); }
 
-        virtual int computeWorkspace() const { return 2*_x.template getSize<0>(); }
+        virtual int computeWorkspace() const {
+            return 2*_x.template getSize<0>() + this->getNormalTileSize()*(this->getBasisSize() + 2);
+        }
+
+        virtual void setCutoff(double cutoff) {
+            setCutoff(cutoff, (cutoff > 0.0) ? std::make_shared< PointIndex<T> >(_x, _y) : nullptr);
+        }
+
+        // Set the cutoff and the index used to apply it, allowing the index to be shared.
+        void setCutoff(double cutoff, PTR(PointIndex<T> const) index) {
+            MatrixBuilderFactory<T>::Impl::setCutoff(cutoff);
+            _index = index;
+        }
 
         ndarray::Array<T const,1,1> getX() const { return _x; }
 
         ndarray::Array<T const,1,1> getY() const { return _y; }
 
+        PTR(PointIndex<T> const) getIndex() const { return _index; }
+
     private:
         ndarray::Array<T const,1,1> _x;
         ndarray::Array<T const,1,1> _y;
+        PTR(PointIndex<T> const) _index;
     };
 
     SimpleImpl(Factory const & factory, Workspace * workspace) :
@@ -140,11 +389,200 @@ public:
         _xt(workspace->makeVector(factory.getDataSize())),
         _yt(workspace->makeVector(factory.getDataSize())),
         _detFactor(1.0),
+        _index(factory.getIndex()),
+        _cutoff(factory.getCutoff()),
+        _activeSize(factory.getDataSize()),
+        _tileSize(factory.getTileSize()),
+        _active(_index ? factory.getDataSize() : 0),
+        _normalTile(workspace->makeMatrix(factory.getNormalTileSize(), factory.getBasisSize())),
+        _normalScratch(workspace->makeMatrix(factory.getNormalTileSize(), 2)),
         _manager(workspace->getManager())
     {}
 
     virtual int getDataSize() const { return _x.template getSize<0>(); }
 
+    void readEllipse(afw::geom::ellipses::Ellipse const & ellipse) {
+        setTransform(ellipse);
+        if (!_index) {
+            transformPoints(0, _activeSize);
+        }
+    }
+
+    /*
+     *  Prepare to evaluate the matrix for the given ellipse one tile at a time with buildTile().  Nothing
+     *  this sets up may live in workspace that is shared with other builders, as CompoundImpl calls this
+     *  for all of its components before building any of their tiles.
+     */
+    virtual void prepareTiles(afw::geom::ellipses::Ellipse const & ellipse) = 0;
+
+    // Add the rows of the matrix for active points [begin, begin + size) to rows [0, size) of tile.
+    virtual void buildTile(typename Workspace::Matrix & tile, int begin, int size) = 0;
+
+    virtual void buildNormalEquations(
+        ndarray::Array<T,2,2> const & gram,
+        ndarray::Array<T,1,1> const & projection,
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        prepareTiles(ellipse);
+        int const tileSize = std::max(static_cast<int>(_normalTile.rows()), 1);
+        for (int begin = 0; begin < _activeSize; begin += tileSize) {
+            int const size = std::min(tileSize, _activeSize - begin);
+            _normalTile.topRows(size).setZero();
+            buildTile(_normalTile, begin, size);
+            accumulateNormalEquations(
+                gram, projection, weights, data, _normalTile.topRows(size).matrix(), _normalScratch,
+                [this, begin](int r) { return getActive(begin + r); }
+            );
+        }
+    }
+
+protected:
+
+    /*
+     *  Set _transform and _detFactor from the given ellipse.  With a cutoff, this also selects and
+     *  transforms the active points; without one, the caller must call transformPoints() for all points.
+     */
+    void setTransform(afw::geom::ellipses::Ellipse const & ellipse) {
+        _transform = ellipse.getGridTransform();
+        _detFactor = _transform.getLinear().computeDeterminant();
+        if (_index) {
+            selectPoints(ellipse);
+        }
+    }
+
+    // Transform points [begin, begin + size) into _xt and _yt (only when there is no cutoff).
+    void transformPoints(int begin, int size) {
+        auto const x = ndarray::asEigenArray(_x).segment(begin, size);
+        auto const y = ndarray::asEigenArray(_y).segment(begin, size);
+        _xt.segment(begin, size) = x * _transform[geom::AffineTransform::XX]
+            + y * _transform[geom::AffineTransform::XY]
+            + _transform[geom::AffineTransform::X];
+        _yt.segment(begin, size) = x * _transform[geom::AffineTransform::YX]
+            + y * _transform[geom::AffineTransform::YY]
+            + _transform[geom::AffineTransform::Y];
+    }
+
+    /*
+     *  Call function(begin, size) for consecutive tiles of at most _tileSize active points, or for all of
+     *  them at once if there is no tile size.
+     */
+    template <typename Function>
+    void forEachTile(Function function) const {
+        forEachTile(0, _activeSize, function);
+    }
+
+    // Like forEachTile(function), but only for active points [begin, end).
+    template <typename Function>
+    void forEachTile(int begin, int end, Function function) const {
+        int const tileSize = (_tileSize > 0) ? _tileSize : std::max(end - begin, 1);
+        for (int tileBegin = begin; tileBegin < end; tileBegin += tileSize) {
+            function(tileBegin, std::min(tileSize, end - tileBegin));
+        }
+    }
+
+    // Return the index of the data point that is active point k.
+    int getActive(int k) const { return _index ? _active[k] : k; }
+
+    // Set the active points to those within _cutoff in the coordinates set by _transform.
+    void selectPoints(afw::geom::ellipses::Ellipse const & ellipse) {
+        typedef geom::AffineTransform AT;
+        // Only points within the bounding box of the ellipse scaled by the cutoff can be active.
+        afw::geom::ellipses::Quadrupole quadrupole(ellipse.getCore());
+        double const halfWidth = _cutoff * std::sqrt(quadrupole.getIxx());
+        double const halfHeight = _cutoff * std::sqrt(quadrupole.getIyy());
+        double const cutoffSquared = _cutoff * _cutoff;
+        _activeSize = 0;
+        _index->forEachRun(
+            ellipse.getCenter().getX() - halfWidth, ellipse.getCenter().getX() + halfWidth,
+            ellipse.getCenter().getY() - halfHeight, ellipse.getCenter().getY() + halfHeight,
+            [this, cutoffSquared](int begin, int end) {
+                for (int k = begin; k < end; ++k) {
+                    double const x = _index->getX(k);
+                    double const y = _index->getY(k);
+                    double const xt = _transform[AT::XX]*x + _transform[AT::XY]*y + _transform[AT::X];
+                    double const yt = _transform[AT::YX]*x + _transform[AT::YY]*y + _transform[AT::Y];
+                    if (xt*xt + yt*yt <= cutoffSquared) {
+                        _xt[_activeSize] = xt;
+                        _yt[_activeSize] = yt;
+                        _active[_activeSize] = _index->getIndex(k);
+                        ++_activeSize;
+                    }
+                }
+            }
+        );
+    }
+
+    /*
+     *  Add lhs * rhs to output for active points [begin, begin + size), when row k of lhs holds active
+     *  point k.  With a cutoff, the product goes through the same rows of compact (which must have as many
+     *  columns as output) before being added to the output rows of the active points.
+     */
+    template <typename LhsT, typename RhsT, typename CompactT>
+    void accumulateProduct(
+        ndarray::Array<T,2,-1> const & output,
+        LhsT const & lhs,
+        RhsT const & rhs,
+        CompactT & compact,
+        int begin,
+        int size
+    ) const {
+        auto outputMatrix = ndarray::asEigenMatrix(output);
+        if (!_index) {
+            outputMatrix.middleRows(begin, size).noalias() += lhs.middleRows(begin, size).matrix() * rhs;
+            return;
+        }
+        compact.middleRows(begin, size).matrix().noalias() = lhs.middleRows(begin, size).matrix() * rhs;
+        for (int k = begin; k < begin + size; ++k) {
+            outputMatrix.row(_active[k]) += compact.row(k).matrix();
+        }
+    }
+
+    ndarray::Array<T const,1,1> _x;
+    ndarray::Array<T const,1,1> _y;
+    Eigen::Map< Eigen::Array<T,Eigen::Dynamic,1> > _xt;
+    Eigen::Map< Eigen::Array<T,Eigen::Dynamic,1> > _yt;
+    T _detFactor;
+    geom::AffineTransform _transform;
+    PTR(PointIndex<T> const) _index; // null if there is no cutoff
+    double _cutoff;
+    int _activeSize;                 // always the full data size if there is no cutoff
+    int _tileSize;                   // zero to evaluate all points at once
+    std::vector<int> _active;        // only used if there is a cutoff
+    typename Workspace::Matrix _normalTile;  // only used by buildNormalEquations()
+    typename Workspace::Matrix _normalScratch;  // only used by buildNormalEquations()
+private:
+    ndarray::Manager::Ptr _manager;
+};
+
+/*
+ * The coordinates of the data points in the system where an ellipse is the unit circle, along with their
+ * squared radius, for use by several components that are all evaluated on scaled versions of that same
+ * ellipse.  Scaling an ellipse by r just divides its grid transform by r, so each component can derive
+ * its own coordinates (and Gaussian exponent) from these with a single multiplication per point, instead
+ * of transforming the original coordinates itself.
+ */
+template <typename T>
+class SharedGrid {
+public:
+
+    typedef MatrixBuilderWorkspace<T> Workspace;
+
+    static int computeWorkspace(int dataSize) { return 3*dataSize; }
+
+    SharedGrid(
+        ndarray::Array<T const,1,1> const & x,
+        ndarray::Array<T const,1,1> const & y,
+        Workspace * workspace
+    ) : _x(x), _y(y),
+        _xt(workspace->makeVector(x.template getSize<0>())),
+        _yt(workspace->makeVector(x.template getSize<0>())),
+        _rSquared(workspace->makeVector(x.template getSize<0>())),
+        _detFactor(1.0),
+        _manager(workspace->getManager())
+    {}
+
     void readEllipse(afw::geom::ellipses::Ellipse const & ellipse) {
         geom::AffineTransform transform = ellipse.getGridTransform();
         _xt = ndarray::asEigenArray(_x) * transform[geom::AffineTransform::XX]
@@ -153,17 +591,25 @@ public:
         _yt = ndarray::asEigenArray(_x) * transform[geom::AffineTransform::YX]
             + ndarray::asEigenArray(_y) * transform[geom::AffineTransform::YY]
             + transform[geom::AffineTransform::Y];
+        _rSquared = _xt.square() + _yt.square();
         _detFactor = transform.getLinear().computeDeterminant();
     }
 
+    typename Workspace::Vector const & getXt() const { return _xt; }
+
+    typename Workspace::Vector const & getYt() const { return _yt; }
+
+    typename Workspace::Vector const & getRSquared() const { return _rSquared; }
+
+    T getDetFactor() const { return _detFactor; }
+
 private:
     ndarray::Array<T const,1,1> _x;
     ndarray::Array<T const,1,1> _y;
-protected:
-    Eigen::Map< Eigen::Array<T,Eigen::Dynamic,1> > _xt;
-    Eigen::Map< Eigen::Array<T,Eigen::Dynamic,1> > _yt;
+    typename Workspace::Vector _xt;
+    typename Workspace::Vector _yt;
+    typename Workspace::Vector _rSquared;
     T _detFactor;
-private:
     ndarray::Manager::Ptr _manager;
 };
 
@@ -211,7 +657,8 @@ public:
         virtual int getBasisSize() const { return computeSize(_lhsOrder); }
 
         virtual int computeWorkspace() const {
-            return this->getDataSize()*(1 + 2*(_lhsOrder + 1))
+            int const nDerivatives = this->getDerivativesEnabled() ? 2 : 0;
+            return this->getDataSize()*(1 + 2*(_lhsOrder + 1) + nDerivatives + (this->getIndex() ? 1 : 0))
                 + SimpleImpl<T>::Factory::computeWorkspace();
         }
 
@@ -230,7 +677,10 @@ public:
         _lhsOrder(factory.getLhsOrder()),
         _gaussian(workspace->makeVector(factory.getDataSize())),
         _xHermite(workspace->makeMatrix(factory.getDataSize(), factory.getLhsOrder() + 1)),
-        _yHermite(workspace->makeMatrix(factory.getDataSize(), factory.getLhsOrder() + 1))
+        _yHermite(workspace->makeMatrix(factory.getDataSize(), factory.getLhsOrder() + 1)),
+        _du(workspace->makeVector(factory.getDerivativesEnabled() ? factory.getDataSize() : 0)),
+        _dv(workspace->makeVector(factory.getDerivativesEnabled() ? factory.getDataSize() : 0)),
+        _column(workspace->makeVector(factory.getIndex() ? factory.getDataSize() : 0))
     {}
 
     virtual int getBasisSize() const { return computeSize(_lhsOrder); }
@@ -242,47 +692,375 @@ public:
         buildMatrix(ndarray::asEigenArray(output), ellipse);
     }
 
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        buildMatrix(ndarray::asEigenArray(output), ellipse);
+        Eigen::Matrix<double,6,5> dTransform = ellipse.getGridTransform().d();
+        for (int n = 0; n < 5; ++n) {
+            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+            buildDerivative(ndarray::asEigenArray(derivative), dTransform.col(n));
+        }
+    }
+
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        buildModel(ndarray::asEigenArray(output), ndarray::asEigenArray(coefficients), ellipse);
+    }
+
+    virtual void prepareTiles(afw::geom::ellipses::Ellipse const & ellipse) { this->setTransform(ellipse); }
+
+    virtual void buildTile(typename Workspace::Matrix & tile, int begin, int size) {
+        fillTile(begin, size);
+        for (PackedIndex i; i.getOrder() <= _lhsOrder; ++i) {
+            tile.col(i.getIndex()).head(size) += this->_detFactor * _gaussian.segment(begin, size)
+                * _xHermite.col(i.getX()).segment(begin, size) * _yHermite.col(i.getY()).segment(begin, size);
+        }
+    }
+
+    template <typename EigenArrayT>
+    void buildMatrix(
+        EigenArrayT output,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        this->setTransform(ellipse);
+        this->forEachTile(
+            [this, &output](int begin, int size) {
+                fillTile(begin, size);
+                accumulateBasis(output, begin, size);
+            }
+        );
+    }
+
+    /*
+     *  Like buildMatrix(output, ellipse), but for an ellipse that is scaled by the given radius relative
+     *  to the one last passed to grid.readEllipse().  This does not set _xt, _yt, or _transform, so it
+     *  cannot be followed by buildDerivative(), and it ignores the cutoff (all points are active).
+     */
     template <typename EigenArrayT>
     void buildMatrix(
         EigenArrayT output,
+        SharedGrid<T> const & grid,
+        double radius
+    ) {
+        T const scale = 1.0 / radius;
+        this->_detFactor = grid.getDetFactor() * scale * scale;
+        this->forEachTile(
+            [this, &output, &grid, scale](int begin, int size) {
+                fillTile(grid, scale, begin, size);
+                accumulateBasis(output, begin, size);
+            }
+        );
+    }
+
+    /*
+     *  Add the basis functions for the given ellipse, weighted by the given coefficients (one for each
+     *  basis function of the lhs order), to the output vector.
+     */
+    template <typename EigenArrayT, typename CoefficientArrayT>
+    void buildModel(
+        EigenArrayT output,
+        CoefficientArrayT const & coefficients,
         afw::geom::ellipses::Ellipse const & ellipse
     ) {
-        this->readEllipse(ellipse);
-        fillGaussian();
-        fillHermite1d(_xHermite, this->_xt);
-        fillHermite1d(_yHermite, this->_yt);
+        this->setTransform(ellipse);
+        this->forEachTile(
+            [this, &output, &coefficients](int begin, int size) {
+                fillTile(begin, size);
+                accumulateModel(output, coefficients, begin, size);
+            }
+        );
+    }
+
+    // Like buildModel(output, coefficients, ellipse), but using the coordinates in a shared grid.
+    template <typename EigenArrayT, typename CoefficientArrayT>
+    void buildModel(
+        EigenArrayT output,
+        CoefficientArrayT const & coefficients,
+        SharedGrid<T> const & grid,
+        double radius
+    ) {
+        T const scale = 1.0 / radius;
+        this->_detFactor = grid.getDetFactor() * scale * scale;
+        this->forEachTile(
+            [this, &output, &coefficients, &grid, scale](int begin, int size) {
+                fillTile(grid, scale, begin, size);
+                accumulateModel(output, coefficients, begin, size);
+            }
+        );
+    }
+
+    /*
+     *  Add lhs * rhs to the output, where lhs is the basis matrix for the given ellipse, evaluated into the
+     *  given workspace matrix one tile at a time so each tile is multiplied while it is still in cache.
+     *  With a cutoff, only the active points are evaluated and multiplied (see accumulateProduct()).
+     */
+    template <typename LhsT, typename RhsT, typename CompactT>
+    void buildProduct(
+        ndarray::Array<T,2,-1> const & output,
+        afw::geom::ellipses::Ellipse const & ellipse,
+        LhsT & lhs,
+        RhsT const & rhs,
+        CompactT & compact
+    ) {
+        this->setTransform(ellipse);
+        this->forEachTile(
+            [&](int begin, int size) {
+                fillTile(begin, size);
+                setBasis(lhs, begin, size);
+                this->accumulateProduct(output, lhs, rhs, compact, begin, size);
+            }
+        );
+    }
+
+    // Like buildProduct(output, ellipse, ...), but using the coordinates in a shared grid.
+    template <typename LhsT, typename RhsT, typename CompactT>
+    void buildProduct(
+        ndarray::Array<T,2,-1> const & output,
+        SharedGrid<T> const & grid,
+        double radius,
+        LhsT & lhs,
+        RhsT const & rhs,
+        CompactT & compact
+    ) {
+        T const scale = 1.0 / radius;
+        this->_detFactor = grid.getDetFactor() * scale * scale;
+        this->forEachTile(
+            [&](int begin, int size) {
+                fillTile(grid, scale, begin, size);
+                setBasis(lhs, begin, size);
+                this->accumulateProduct(output, lhs, rhs, compact, begin, size);
+            }
+        );
+    }
+
+    /*
+     *  Add lhs * rhs to rows [0, size) of tile, where lhs is the basis matrix for active points
+     *  [begin, begin + size), which is evaluated into the same rows of the given workspace matrix (after
+     *  fillTile() has been called for those points).
+     */
+    template <typename LhsT, typename RhsT>
+    void accumulateTileProduct(
+        typename Workspace::Matrix & tile,
+        LhsT & lhs,
+        RhsT const & rhs,
+        int begin,
+        int size
+    ) {
+        setBasis(lhs, begin, size);
+        tile.topRows(size).matrix().noalias() += lhs.middleRows(begin, size).matrix() * rhs;
+    }
+
+    // Add the products of the Gaussian and Hermite columns for active points [begin, begin + size) to the
+    // basis matrix.
+    template <typename EigenArrayT>
+    void accumulateBasis(EigenArrayT & output, int begin, int size) {
+        for (PackedIndex i; i.getOrder() <= _lhsOrder; ++i) {
+            accumulateColumn(
+                output, i.getIndex(), begin,
+                this->_detFactor * _gaussian.segment(begin, size)
+                    * _xHermite.col(i.getX()).segment(begin, size)
+                    * _yHermite.col(i.getY()).segment(begin, size)
+            );
+        }
+    }
+
+    // Like accumulateBasis(), but overwrites rows [begin, begin + size) of the output, which hold the
+    // active points in order (so the output is only in the usual layout if there is no cutoff).
+    template <typename EigenArrayT>
+    void setBasis(EigenArrayT & output, int begin, int size) {
+        for (PackedIndex i; i.getOrder() <= _lhsOrder; ++i) {
+            output.col(i.getIndex()).segment(begin, size)
+                = this->_detFactor * _gaussian.segment(begin, size)
+                * _xHermite.col(i.getX()).segment(begin, size) * _yHermite.col(i.getY()).segment(begin, size);
+        }
+    }
+
+    // Add an array of values for consecutive active points, starting at begin, to a column of the output.
+    template <typename EigenArrayT, typename ColumnT>
+    void accumulateColumn(EigenArrayT & output, int index, int begin, ColumnT const & column) {
+        int const size = column.size();
+        if (!this->_index) {
+            output.col(index).segment(begin, size) += column;
+            return;
+        }
+        _column.segment(begin, size) = column;
+        for (int k = begin; k < begin + size; ++k) {
+            output(this->_active[k], index) += _column[k];
+        }
+    }
+
+    // Add the coefficient-weighted sum of the basis functions at active points [begin, begin + size) to
+    // the output vector.
+    template <typename EigenArrayT, typename CoefficientArrayT>
+    void accumulateModel(
+        EigenArrayT & output,
+        CoefficientArrayT const & coefficients,
+        int begin,
+        int size
+    ) {
+        // The sum is computed in chunks small enough to hold on the stack, so it needs no workspace.
+        for (int chunkBegin = begin; chunkBegin < begin + size; chunkBegin += MODEL_CHUNK_SIZE) {
+            int const n = std::min(int(MODEL_CHUNK_SIZE), begin + size - chunkBegin);
+            Eigen::Array<T,Eigen::Dynamic,1,0,MODEL_CHUNK_SIZE,1> sum
+                = Eigen::Array<T,Eigen::Dynamic,1,0,MODEL_CHUNK_SIZE,1>::Zero(n);
+            for (PackedIndex i; i.getOrder() <= _lhsOrder; ++i) {
+                sum += T(coefficients[i.getIndex()]) * _xHermite.col(i.getX()).segment(chunkBegin, n)
+                    * _yHermite.col(i.getY()).segment(chunkBegin, n);
+            }
+            sum *= this->_detFactor * _gaussian.segment(chunkBegin, n);
+            if (!this->_index) {
+                output.segment(chunkBegin, n) += sum;
+                continue;
+            }
+            for (int k = 0; k < n; ++k) {
+                output[this->_active[chunkBegin + k]] += sum[k];
+            }
+        }
+    }
+
+    /*
+     *  Accumulate the derivative of the basis matrix with respect to a single parameter, given the
+     *  derivative of the grid transform with respect to that parameter (with elements ordered as
+     *  geom::AffineTransform's parameters).
+     *
+     *  This must be called after buildMatrix() with the same ellipse, as it reuses the Gaussian and
+     *  Hermite columns it computed.  Each basis function is detFactor * G(u) * G(v) * H_m(u) * H_n(v),
+     *  where (u, v) are the transformed coordinates, G is the Gaussian, and H_n are the normalized
+     *  Hermite polynomials, so we use d[G(u) H_n(u)]/du = G(u) [sqrt(2n) H_{n-1}(u) - u H_n(u)].
+     */
+    template <typename EigenArrayT>
+    void buildDerivative(
+        EigenArrayT output,
+        Eigen::Matrix<double,6,1> const & dTransform
+    ) {
+        typedef geom::AffineTransform AT;
+        AT const & t = this->_transform;
+        T const dDetFactor = dTransform[AT::XX]*t[AT::YY] + t[AT::XX]*dTransform[AT::YY]
+            - dTransform[AT::XY]*t[AT::YX] - t[AT::XY]*dTransform[AT::YX];
+        int const n = this->_activeSize;
+        reserveDerivatives();
+        // _du and _dv hold the derivatives of the transformed coordinates, times the factors they
+        // share with every basis function.
+        if (this->_index) {
+            // gather the original coordinates of the active points (_du is computed from _column and
+            // _dv before _dv is overwritten, and each element of _dv only depends on itself)
+            for (int k = 0; k < n; ++k) {
+                _column[k] = this->_x[this->_active[k]];
+                _dv[k] = this->_y[this->_active[k]];
+            }
+            computeCoordinateDerivatives(_column.head(n), _dv.head(n), dTransform);
+        } else {
+            computeCoordinateDerivatives(
+                ndarray::asEigenArray(this->_x), ndarray::asEigenArray(this->_y), dTransform
+            );
+        }
+        auto const gaussian = _gaussian.head(n);
+        auto const du = _du.head(n);
+        auto const dv = _dv.head(n);
+        auto const xt = this->_xt.head(n);
+        auto const yt = this->_yt.head(n);
         for (PackedIndex i; i.getOrder() <= _lhsOrder; ++i) {
-            output.col(i.getIndex())
-                += this->_detFactor * _gaussian * _xHermite.col(i.getX()) * _yHermite.col(i.getY());
+            int const nx = i.getX();
+            int const ny = i.getY();
+            auto const xHermite = _xHermite.col(nx).head(n);
+            auto const yHermite = _yHermite.col(ny).head(n);
+            accumulateColumn(
+                output, i.getIndex(), 0,
+                dDetFactor * gaussian * xHermite * yHermite
+                + du * yHermite * (intSqrt(2*nx) * _xHermite.col(std::max(nx - 1, 0)).head(n) - xt * xHermite)
+                + dv * xHermite * (intSqrt(2*ny) * _yHermite.col(std::max(ny - 1, 0)).head(n) - yt * yHermite)
+            );
+        }
+    }
+
+    // Make sure _du and _dv have room for all data points, allocating them on first use if the factory
+    // did not reserve them in the workspace (see MatrixBuilderFactory::setDerivativesEnabled).
+    void reserveDerivatives() {
+        int const dataSize = this->getDataSize();
+        if (_du.size() == dataSize) {
+            return;
+        }
+        Workspace workspace(2 * dataSize);
+        _derivativeManager = workspace.getManager();
+        new (&_du) typename Workspace::Vector(workspace.makeVector(dataSize));
+        new (&_dv) typename Workspace::Vector(workspace.makeVector(dataSize));
+    }
+
+    // Compute _du and _dv for buildDerivative() from the original coordinates of the active points.
+    template <typename XArrayT, typename YArrayT>
+    void computeCoordinateDerivatives(
+        XArrayT const & x,
+        YArrayT const & y,
+        Eigen::Matrix<double,6,1> const & dTransform
+    ) {
+        typedef geom::AffineTransform AT;
+        int const n = this->_activeSize;
+        _du.head(n) = this->_detFactor * _gaussian.head(n) * (
+            x * T(dTransform[AT::XX]) + y * T(dTransform[AT::XY]) + T(dTransform[AT::X])
+        );
+        _dv.head(n) = this->_detFactor * _gaussian.head(n) * (
+            x * T(dTransform[AT::YX]) + y * T(dTransform[AT::YY]) + T(dTransform[AT::Y])
+        );
+    }
+
+    // Fill the Gaussian and Hermite columns for active points [begin, begin + size).
+    void fillTile(int begin, int size) {
+        if (!this->_index) {
+            this->transformPoints(begin, size);
         }
+        auto const xt = this->_xt.segment(begin, size);
+        auto const yt = this->_yt.segment(begin, size);
+        _gaussian.segment(begin, size) = (-0.5*(xt.square() + yt.square())).exp();
+        fillHermite1d(_xHermite, begin, xt);
+        fillHermite1d(_yHermite, begin, yt);
     }
 
-    void fillGaussian() {
-        _gaussian = (-0.5*(this->_xt.square() + this->_yt.square())).exp();
+    // Like fillTile(begin, size), but using the coordinates in a shared grid, multiplied by scale.
+    void fillTile(SharedGrid<T> const & grid, T scale, int begin, int size) {
+        _gaussian.segment(begin, size)
+            = (grid.getRSquared().segment(begin, size) * T(-0.5 * scale * scale)).exp();
+        fillHermite1d(_xHermite, begin, grid.getXt().segment(begin, size) * scale);
+        fillHermite1d(_yHermite, begin, grid.getYt().segment(begin, size) * scale);
     }
 
+    // Fill coord.size() rows of output, starting at begin, with the 1-d Hermite functions evaluated at coord.
     template <typename CoordArray>
     void fillHermite1d(
         typename Workspace::Matrix & output,
+        int begin,
         CoordArray const & coord
     ) {
+        int const n = coord.size();
         if (output.cols() > 0) {
-            output.col(0).setConstant(BASIS_NORMALIZATION);
+            output.col(0).segment(begin, n).setConstant(BASIS_NORMALIZATION);
         }
         if (output.cols() > 1) {
-            output.col(1) = intSqrt(2) * coord * output.col(0);
+            output.col(1).segment(begin, n) = intSqrt(2) * coord * output.col(0).segment(begin, n);
         }
         for (int j = 2; j <= _lhsOrder; ++j) {
-            output.col(j) = rationalSqrt(2, j) * coord * output.col(j-1)
-                - rationalSqrt(j - 1, j) * output.col(j-2);
+            output.col(j).segment(begin, n) = rationalSqrt(2, j) * coord * output.col(j-1).segment(begin, n)
+                - rationalSqrt(j - 1, j) * output.col(j-2).segment(begin, n);
         }
     }
 
 protected:
+    // Number of data points summed at a time by accumulateModel().
+    static constexpr int MODEL_CHUNK_SIZE = 64;
+
     int _lhsOrder;
     typename Workspace::Vector _gaussian;
     typename Workspace::Matrix _xHermite;
     typename Workspace::Matrix _yHermite;
+    typename Workspace::Vector _du;     // only used for derivatives; empty until needed unless reserved
+    typename Workspace::Vector _dv;     // only used for derivatives; empty until needed unless reserved
+    typename Workspace::Vector _column; // only used if there is a cutoff
+    ndarray::Manager::Ptr _derivativeManager;  // owns _du and _dv if they were not reserved
 };
 
 } // anonymous
@@ -346,7 +1124,8 @@ public:
 
         virtual int computeWorkspace() const {
             return ShapeletImpl<T>::Factory::computeWorkspace()
-                +  this->getDataSize() * computeSize(this->getLhsOrder());
+                +  this->getDataSize() * computeSize(this->getLhsOrder())
+                +  (this->getIndex() ? this->getDataSize() * this->getBasisSize() : 0);
         }
 
         int getRhsOrder() const { return _rhsOrder; }
@@ -365,9 +1144,22 @@ public:
     ConvolvedShapeletImpl(Factory const & factory, Workspace * workspace) :
         ShapeletImpl<T>(factory, workspace),
         _ellipse(afw::geom::ellipses::Quadrupole()),
+        _psf(factory.getPsf()),
         _convolution(factory.getRhsOrder(), factory.getPsf()),
-        _lhs(workspace->makeMatrix(factory.getDataSize(), computeSize(_convolution.getRowOrder())))
-    {}
+        _lhs(workspace->makeMatrix(factory.getDataSize(), computeSize(_convolution.getRowOrder()))),
+        _convolutionMatrix(computeSize(_convolution.getRowOrder()), computeSize(_convolution.getColOrder())),
+        _compact(
+            workspace->makeMatrix(factory.getIndex() ? factory.getDataSize() : 0, factory.getBasisSize())
+        ),
+        _lhsCoefficients(computeSize(_convolution.getRowOrder()))
+    {
+        if (factory.getConvolutionCacheCapacity() > 0) {
+            _convolution.enableCache(
+                factory.getConvolutionCacheCapacity(),
+                factory.getConvolutionCacheQuantum()
+            );
+        }
+    }
 
     virtual int getBasisSize() const { return computeSize(_convolution.getColOrder()); }
 
@@ -382,29 +1174,205 @@ public:
             );
         }
         _ellipse = ellipse;
-        ndarray::Array<double const,2,2> rhs = computeTerms();
-        ndarray::asEigenMatrix(output) += _lhs.matrix() * ndarray::asEigenMatrix(rhs).cast<T>();
+        computeConvolutionMatrix();
+        this->buildProduct(output, _ellipse, _lhs, _convolutionMatrix.matrix(), _compact);
     }
 
-    ndarray::Array<double const,2,2> computeTerms() {
-        ndarray::Array<double const,2,2> rhs = _convolution.evaluate(_ellipse);
-        _lhs.setZero();
-        ShapeletImpl<T>::buildMatrix(_lhs, _ellipse);
-        return rhs;
+    virtual void prepareTiles(afw::geom::ellipses::Ellipse const & ellipse) {
+        if (!(ellipse.getCore().getDeterminantRadius() >= 0.0)) {
+            throw LSST_EXCEPT(
+                pex::exceptions::UnderflowError,
+                "Underflow error in ellipse scaling/convolution"
+            );
+        }
+        _ellipse = ellipse;
+        computeConvolutionMatrix();
+        this->setTransform(_ellipse);
     }
 
-protected:
-    mutable afw::geom::ellipses::Ellipse _ellipse;
-    GaussHermiteConvolution _convolution;
-    typename Workspace::Matrix _lhs;
-};
-
-} // anonymous
-
+    virtual void buildTile(typename Workspace::Matrix & tile, int begin, int size) {
+        this->fillTile(begin, size);
+        this->accumulateTileProduct(tile, _lhs, _convolutionMatrix.matrix(), begin, size);
+    }
 
-//===========================================================================================================
-//================== Non-Convolved, Remapped Shapelet Implementation ========================================
-//===========================================================================================================
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        if (!(ellipse.getCore().getDeterminantRadius() >= 0.0)) {
+            throw LSST_EXCEPT(
+                pex::exceptions::UnderflowError,
+                "Underflow error in ellipse scaling/convolution"
+            );
+        }
+        Eigen::Matrix<double,6,5> dTransform;
+        computeDerivativeTerms(ellipse, Eigen::Matrix<double,5,5>::Identity(), dTransform);
+        ndarray::asEigenMatrix(output).noalias() += _lhs.matrix() * _convolutionMatrix.matrix();
+        computeConvolutionDerivatives(ellipse, 1.0);
+        for (int n = 0; n < 3; ++n) {
+            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+            ndarray::asEigenMatrix(derivative).noalias() += _lhs.matrix() * _dConvolution[n];
+        }
+        for (int n = 0; n < 5; ++n) {
+            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+            _lhs.setZero();
+            this->buildDerivative(_lhs, dTransform.col(n));
+            ndarray::asEigenMatrix(derivative).noalias() += _lhs.matrix() * _convolutionMatrix.matrix();
+        }
+    }
+
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        if (!(ellipse.getCore().getDeterminantRadius() >= 0.0)) {
+            throw LSST_EXCEPT(
+                pex::exceptions::UnderflowError,
+                "Underflow error in ellipse scaling/convolution"
+            );
+        }
+        _ellipse = ellipse;
+        computeConvolutionMatrix();
+        // Contract the coefficients with the convolution matrix first, so we only need to evaluate one
+        // weighted sum of the lhs basis at each point.
+        _lhsCoefficients.noalias() = _convolutionMatrix.matrix() * ndarray::asEigenMatrix(coefficients);
+        ShapeletImpl<T>::buildModel(ndarray::asEigenArray(output), _lhsCoefficients, _ellipse);
+    }
+
+    // Compute the convolution matrix (into _convolutionMatrix) and the lhs matrix (into _lhs) for
+    // _ellipse, which is convolved in place.
+    void computeTerms() { computeTerms(_lhs); }
+
+    // Like computeTerms(), but puts the lhs matrix into the given array instead of _lhs.
+    template <typename EigenArrayT>
+    void computeTerms(EigenArrayT lhs) {
+        computeConvolutionMatrix();
+        lhs.setZero();
+        ShapeletImpl<T>::buildMatrix(lhs, _ellipse);
+    }
+
+    // Compute just the convolution matrix (into _convolutionMatrix), convolving _ellipse in place.
+    void computeConvolutionMatrix() {
+        // The convolution matrix is always computed in double precision (it's small, and the
+        // Hermite transforms involve cancellations that would lose too much precision in single
+        // precision), and converted to T just once here.
+        _convolutionMatrix = ndarray::asEigenArray(_convolution.evaluate(_ellipse)).template cast<T>();
+    }
+
+    /*
+     *  Like computeTerms(), but starts from the unconvolved ellipse (which it copies into _ellipse), and
+     *  also computes the derivative of the convolved ellipse's grid transform with respect to the
+     *  user-visible ellipse parameters, given the derivative of the unconvolved ellipse with respect to
+     *  those parameters.
+     */
+    void computeDerivativeTerms(
+        afw::geom::ellipses::Ellipse const & ellipse,
+        Eigen::Matrix<double,5,5> const & dEllipse,
+        Eigen::Matrix<double,6,5> & dTransform
+    ) {
+        // _ellipse always has a Quadrupole core, so we need a copy with the same parametrization as the
+        // derivative of the convolution.
+        afw::geom::ellipses::Ellipse convolved(ellipse);
+        Eigen::Matrix<double,5,5> dConvolved = convolved.convolve(_psf.getEllipse()).d() * dEllipse;
+        convolved.convolve(_psf.getEllipse()).inPlace();
+        dTransform = convolved.getGridTransform().d() * dConvolved;
+        _ellipse = ellipse;
+        computeTerms();
+    }
+
+    /*
+     *  Compute the derivatives of the convolution matrix with respect to the core parameters of the given
+     *  (user-visible) ellipse, when the basis is defined on that ellipse scaled by the given radius.
+     *
+     *  These are computed by central finite differences, which are cheap as they only involve the small
+     *  convolution matrix, not the data points.  We use a separate GaussHermiteConvolution that is never
+     *  cached, as the cache quantization would swamp the finite-difference steps.
+     */
+    void computeConvolutionDerivatives(afw::geom::ellipses::Ellipse const & ellipse, double radius) {
+        if (!_uncachedConvolution) {
+            _uncachedConvolution = std::make_shared<GaussHermiteConvolution>(
+                _convolution.getColOrder(), _psf
+            );
+        }
+        afw::geom::ellipses::Ellipse::ParameterVector const parameters = ellipse.getParameterVector();
+        afw::geom::ellipses::Ellipse perturbed(ellipse);
+        for (int n = 0; n < 3; ++n) {
+            double const step = CONVOLUTION_DERIVATIVE_STEP * std::max(std::abs(parameters[n]), 1.0);
+            afw::geom::ellipses::Ellipse::ParameterVector p = parameters;
+            p[n] = parameters[n] + step;
+            perturbed.setParameterVector(p);
+            perturbed.scale(radius);
+            _dConvolutionUpper = ndarray::asEigenMatrix(_uncachedConvolution->evaluate(perturbed));
+            p[n] = parameters[n] - step;
+            perturbed.setParameterVector(p);
+            perturbed.scale(radius);
+            _dConvolution[n] = (
+                (_dConvolutionUpper - ndarray::asEigenMatrix(_uncachedConvolution->evaluate(perturbed)))
+                / (2.0*step)
+            ).template cast<T>();
+        }
+    }
+
+protected:
+    // Relative step size for finite-difference derivatives of the convolution matrix; roughly the cube
+    // root of double-precision epsilon, as appropriate for central differences.
+    static constexpr double CONVOLUTION_DERIVATIVE_STEP = 1E-5;
+
+    mutable afw::geom::ellipses::Ellipse _ellipse;
+    ShapeletFunction _psf;
+    GaussHermiteConvolution _convolution;
+    typename Workspace::Matrix _lhs;
+    // The convolution matrix (and the rhs matrix of the remapped subclass) are not in the workspace, so
+    // they are not overwritten by other components that share it (see SimpleImpl::prepareTiles()).
+    Eigen::Array<T,Eigen::Dynamic,Eigen::Dynamic> _convolutionMatrix;
+    typename Workspace::Matrix _compact;  // only allocated if there is a cutoff
+    Eigen::Matrix<T,Eigen::Dynamic,1> _lhsCoefficients;
+    std::shared_ptr<GaussHermiteConvolution> _uncachedConvolution;
+    Eigen::MatrixXd _dConvolutionUpper;
+    Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> _dConvolution[3];
+};
+
+} // anonymous
+
+
+//===========================================================================================================
+//================== Non-Convolved, Remapped Shapelet Implementation ========================================
+//===========================================================================================================
+
+/*
+ * Both of the remapped implementations below compute a matrix that is the product of a large "lhs" matrix
+ * (with one row per data point) and a small "rhs" matrix (with one column per basis function), and they
+ * also implement this interface to let CompoundImpl compute those two factors separately.  That lets it
+ * put the lhs matrices of several components side-by-side in one matrix (and their rhs matrices on top
+ * of each other in another), replacing many small matrix products with a single larger one.
+ */
+
+namespace {
+
+template <typename T>
+class FactoredImpl {
+public:
+
+    typedef MatrixBuilderWorkspace<T> Workspace;
+
+    // Return the number of columns in the lhs matrix (which is also the number of rows in the rhs matrix),
+    // or zero if the lhs matrix is not computed for all data points (because there is a cutoff).
+    virtual int getFactorSize() const = 0;
+
+    // Overwrite lhs (data size x factor size) and rhsT (basis size x factor size) so that the matrix
+    // computed by buildMatrix() is lhs * rhsT^T.
+    virtual void buildFactors(
+        typename Workspace::Matrix lhs,
+        typename Workspace::Matrix rhsT,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) = 0;
+
+    virtual ~FactoredImpl() {}
+};
+
+} // anonymous
 
 /*
  * This implementation pair handles a standard Gauss-Hermite basis that is remapped to a different
@@ -419,7 +1387,7 @@ protected:
 namespace {
 
 template <typename T>
-class RemappedShapeletImpl : public ShapeletImpl<T> {
+class RemappedShapeletImpl : public ShapeletImpl<T>, public FactoredImpl<T> {
 public:
 
     typedef MatrixBuilderWorkspace<T> Workspace;
@@ -442,7 +1410,8 @@ public:
 
         virtual int computeWorkspace() const {
             return ShapeletImpl<T>::Factory::computeWorkspace()
-                +  this->getDataSize() * computeSize(this->getLhsOrder());
+                +  this->getDataSize() * computeSize(this->getLhsOrder())
+                +  (this->getIndex() ? this->getDataSize() * this->getBasisSize() : 0);
         }
 
         double getRadius() const { return _radius; }
@@ -466,7 +1435,11 @@ public:
         _radius(factory.getRadius()),
         // transpose the remap matrix to preserve memory order when we copy it; will untranspose later
         _remapMatrix(ndarray::asEigenMatrix(factory.getRemapMatrix()).template cast<T>().transpose()),
-        _lhs(workspace->makeMatrix(factory.getDataSize(), computeSize(factory.getLhsOrder())))
+        _lhs(workspace->makeMatrix(factory.getDataSize(), computeSize(factory.getLhsOrder()))),
+        _compact(
+            workspace->makeMatrix(factory.getIndex() ? factory.getDataSize() : 0, factory.getBasisSize())
+        ),
+        _lhsCoefficients(computeSize(factory.getLhsOrder()))
     {}
 
     virtual int getBasisSize() const { return _remapMatrix.rows(); }
@@ -475,19 +1448,114 @@ public:
         ndarray::Array<T,2,-1> const & output,
         afw::geom::ellipses::Ellipse const & ellipse
     ) {
+        // undo the transpose in the constructor
+        if (_grid) {
+            this->buildProduct(output, *_grid, _radius, _lhs, _remapMatrix.transpose(), _compact);
+        } else {
+            _ellipse = ellipse;
+            _ellipse.scale(_radius);
+            this->buildProduct(output, _ellipse, _lhs, _remapMatrix.transpose(), _compact);
+        }
+    }
+
+    virtual void prepareTiles(afw::geom::ellipses::Ellipse const & ellipse) {
+        if (_grid) {
+            T const scale = 1.0 / _radius;
+            this->_detFactor = _grid->getDetFactor() * scale * scale;
+        } else {
+            _ellipse = ellipse;
+            _ellipse.scale(_radius);
+            this->setTransform(_ellipse);
+        }
+    }
+
+    virtual void buildTile(typename Workspace::Matrix & tile, int begin, int size) {
+        if (_grid) {
+            this->fillTile(*_grid, T(1.0 / _radius), begin, size);
+        } else {
+            this->fillTile(begin, size);
+        }
+        // undo the transpose in the constructor
+        this->accumulateTileProduct(tile, _lhs, _remapMatrix.transpose(), begin, size);
+    }
+
+    virtual int getFactorSize() const { return this->_index ? 0 : _lhs.cols(); }
+
+    virtual void buildFactors(
+        typename Workspace::Matrix lhs,
+        typename Workspace::Matrix rhsT,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        buildLhs(lhs, ellipse);
+        rhsT.matrix() = _remapMatrix;
+    }
+
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        // the derivatives need the coordinates for this component, so we can't use the shared grid
         _ellipse = ellipse;
         _ellipse.scale(_radius);
         _lhs.setZero();
         ShapeletImpl<T>::buildMatrix(_lhs, _ellipse);
+        ndarray::asEigenMatrix(output).noalias() += _lhs.matrix() * _remapMatrix.transpose();
+        // scaling an ellipse by the radius divides its grid transform by the radius
+        Eigen::Matrix<double,6,5> dTransform = ellipse.getGridTransform().d() / _radius;
+        for (int n = 0; n < 5; ++n) {
+            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+            _lhs.setZero();
+            this->buildDerivative(_lhs, dTransform.col(n));
+            ndarray::asEigenMatrix(derivative).noalias() += _lhs.matrix() * _remapMatrix.transpose();
+        }
+    }
+
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
         // undo the transpose in the constructor
-        ndarray::asEigenMatrix(output) += _lhs.matrix() * _remapMatrix.transpose();
+        _lhsCoefficients.noalias() = _remapMatrix.transpose() * ndarray::asEigenMatrix(coefficients);
+        if (_grid) {
+            ShapeletImpl<T>::buildModel(ndarray::asEigenArray(output), _lhsCoefficients, *_grid, _radius);
+        } else {
+            _ellipse = ellipse;
+            _ellipse.scale(_radius);
+            ShapeletImpl<T>::buildModel(ndarray::asEigenArray(output), _lhsCoefficients, _ellipse);
+        }
     }
 
+    /*
+     *  Use coordinates from the given grid instead of computing them from the ellipse passed to
+     *  buildMatrix() or buildFactors(); the caller is then responsible for calling grid->readEllipse()
+     *  with that same (unscaled) ellipse first.
+     */
+    void setSharedGrid(PTR(SharedGrid<T> const) grid) { _grid = grid; }
+
 protected:
+
+    // Overwrite lhs with the unremapped basis matrix for the scaled ellipse.
+    template <typename EigenArrayT>
+    void buildLhs(EigenArrayT & lhs, afw::geom::ellipses::Ellipse const & ellipse) {
+        lhs.setZero();
+        if (_grid) {
+            ShapeletImpl<T>::buildMatrix(lhs, *_grid, _radius);
+        } else {
+            _ellipse = ellipse;
+            _ellipse.scale(_radius);
+            ShapeletImpl<T>::buildMatrix(lhs, _ellipse);
+        }
+    }
+
     mutable afw::geom::ellipses::Ellipse _ellipse;
     double _radius;
     Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> _remapMatrix;
     typename Workspace::Matrix _lhs;
+    typename Workspace::Matrix _compact;  // only allocated if there is a cutoff
+    Eigen::Matrix<T,Eigen::Dynamic,1> _lhsCoefficients;
+    PTR(SharedGrid<T> const) _grid;
 };
 
 } // anonymous
@@ -517,7 +1585,7 @@ protected:
 namespace {
 
 template <typename T>
-class RemappedConvolvedShapeletImpl : public ConvolvedShapeletImpl<T> {
+class RemappedConvolvedShapeletImpl : public ConvolvedShapeletImpl<T>, public FactoredImpl<T> {
 public:
 
     typedef MatrixBuilderWorkspace<T> Workspace;
@@ -539,11 +1607,6 @@ public:
 
         virtual int getBasisSize() const { return _remapMatrix.getSize<1>(); }
 
-        virtual int computeWorkspace() const {
-            return ConvolvedShapeletImpl<T>::Factory::computeWorkspace()
-                + computeSize(this->getLhsOrder()) * getBasisSize();
-        }
-
         double getRadius() const { return _radius; }
 
         ndarray::Array<double const,2,2> getRemapMatrix() const { return _remapMatrix; }
@@ -562,7 +1625,7 @@ public:
         _radius(factory.getRadius()),
         // transpose the remap matrix to preserve memory order when we copy it; will untranspose later
         _remapMatrix(ndarray::asEigenMatrix(factory.getRemapMatrix()).template cast<T>().transpose()),
-        _rhs(workspace->makeMatrix(computeSize(factory.getLhsOrder()), factory.getBasisSize()))
+        _rhs(computeSize(factory.getLhsOrder()), factory.getBasisSize())
     {}
 
     virtual int getBasisSize() const { return _remapMatrix.rows(); }
@@ -573,15 +1636,99 @@ public:
     ) {
         this->_ellipse = ellipse;
         this->_ellipse.scale(_radius);
-        ndarray::Array<double const,2,2> convolutionMatrix = this->computeTerms();
-        _rhs.matrix() = ndarray::asEigenMatrix(convolutionMatrix).cast<T>() * _remapMatrix.transpose();  // untranspose
-        ndarray::asEigenMatrix(output) += this->_lhs.matrix() * _rhs.matrix();
+        this->computeConvolutionMatrix();
+        // untranspose the remap matrix
+        _rhs.noalias() = this->_convolutionMatrix.matrix() * _remapMatrix.transpose();
+        this->buildProduct(output, this->_ellipse, this->_lhs, _rhs, this->_compact);
+    }
+
+    virtual void prepareTiles(afw::geom::ellipses::Ellipse const & ellipse) {
+        this->_ellipse = ellipse;
+        this->_ellipse.scale(_radius);
+        this->computeConvolutionMatrix();
+        _rhs.noalias() = this->_convolutionMatrix.matrix() * _remapMatrix.transpose();
+        this->setTransform(this->_ellipse);
+    }
+
+    virtual void buildTile(typename Workspace::Matrix & tile, int begin, int size) {
+        this->fillTile(begin, size);
+        this->accumulateTileProduct(tile, this->_lhs, _rhs, begin, size);
+    }
+
+    virtual int getFactorSize() const { return this->_index ? 0 : _rhs.rows(); }
+
+    virtual void buildFactors(
+        typename Workspace::Matrix lhs,
+        typename Workspace::Matrix rhsT,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        this->_ellipse = ellipse;
+        this->_ellipse.scale(_radius);
+        this->computeTerms(lhs);
+        // _remapMatrix is already transposed, so this is the transpose of _rhs in buildMatrix
+        rhsT.matrix().noalias() = _remapMatrix * this->_convolutionMatrix.matrix().transpose();
+    }
+
+    // Like buildFactors, but only computes the (transposed) rhs factor.  The lhs factor depends only on
+    // the convolved ellipse and the lhs order, so it can be taken from another component with the same
+    // radius and a PSF with the same ellipse.
+    void buildRhsFactor(
+        typename Workspace::Matrix rhsT,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        this->_ellipse = ellipse;
+        this->_ellipse.scale(_radius);
+        this->computeConvolutionMatrix();
+        rhsT.matrix().noalias() = _remapMatrix * this->_convolutionMatrix.matrix().transpose();
+    }
+
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        afw::geom::ellipses::Ellipse scaled(ellipse);
+        scaled.scale(_radius);
+        Eigen::Matrix<double,5,5> dScaled = Eigen::Matrix<double,5,5>::Identity();
+        dScaled.template topLeftCorner<3,3>()
+            = ellipse.getCore().transform(geom::LinearTransform::makeScaling(_radius)).d();
+        Eigen::Matrix<double,6,5> dTransform;
+        this->computeDerivativeTerms(scaled, dScaled, dTransform);
+        _rhs.noalias() = this->_convolutionMatrix.matrix() * _remapMatrix.transpose();
+        ndarray::asEigenMatrix(output).noalias() += this->_lhs.matrix() * _rhs;
+        this->computeConvolutionDerivatives(ellipse, _radius);
+        for (int n = 0; n < 3; ++n) {
+            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+            _rhs.noalias() = this->_dConvolution[n] * _remapMatrix.transpose();
+            ndarray::asEigenMatrix(derivative).noalias() += this->_lhs.matrix() * _rhs;
+        }
+        _rhs.noalias() = this->_convolutionMatrix.matrix() * _remapMatrix.transpose();
+        for (int n = 0; n < 5; ++n) {
+            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+            this->_lhs.setZero();
+            this->buildDerivative(this->_lhs, dTransform.col(n));
+            ndarray::asEigenMatrix(derivative).noalias() += this->_lhs.matrix() * _rhs;
+        }
+    }
+
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        this->_ellipse = ellipse;
+        this->_ellipse.scale(_radius);
+        this->computeConvolutionMatrix();
+        // untranspose the remap matrix, and apply it before the convolution matrix (which has more rows)
+        this->_lhsCoefficients.noalias() = this->_convolutionMatrix.matrix()
+            * (_remapMatrix.transpose() * ndarray::asEigenMatrix(coefficients));
+        ShapeletImpl<T>::buildModel(ndarray::asEigenArray(output), this->_lhsCoefficients, this->_ellipse);
     }
 
 protected:
     double _radius;
     Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> _remapMatrix;
-    typename Workspace::Matrix _rhs;
+    Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> _rhs;
 };
 
 } // anonymous
@@ -605,8 +1752,138 @@ protected:
  * of a large workspace, the components actually share the same workspace, so the workspace needed by
  * the compound implementation is actually the maximum needed by any of its components, not the sum of the
  * workspace needed by its components.
+ *
+ * When the factory's thread count is greater than one, the components are split into contiguous
+ * partitions, one per thread.  Components within a partition share workspace as described above, while
+ * each partition gets its own slice of the workspace (so the total is the per-component maximum times
+ * the number of partitions).  The first partition accumulates directly into the output matrix, and the
+ * others accumulate into partial matrices (also carved from the workspace, after the partition slices)
+ * that are added to the output in partition order after all threads have finished, so the result does
+ * not depend on thread scheduling.  The threads are started when the builder is created and wait for
+ * work between calls (see ThreadTeam), so a call does not pay for starting them.
+ *
+ * Within each partition, components whose lhs matrices have the same number of columns (i.e. the same
+ * lhs order) are grouped together, and we evaluate the lhs and (transposed) rhs factors of each component
+ * in a group into adjacent column blocks of two matrices owned by the group.  A single product of those
+ * two matrices then adds the contributions of all components in the group to the output, which is much
+ * more efficient than a separate small matrix product for each component.  This costs some extra memory
+ * (the group lhs matrices are not shared between groups), so components that don't share an order with
+ * any other component in their partition are still evaluated directly.
+ *
+ * When there is no PSF (and no cutoff), all components are evaluated on the same ellipse scaled by
+ * different radii, so they share a SharedGrid that transforms the data points to that ellipse's
+ * unit-circle coordinates once per call (before any partition starts), and each component just rescales
+ * those coordinates.
  */
 
+namespace detail {
+
+/*
+ *  A fixed set of worker threads that repeatedly run function(n) for each n in [0, size), without starting
+ *  new threads for every call: the size - 1 workers are started at construction and wait for work between
+ *  calls.  Only one call to run() may be in progress at a time, which is guaranteed by the builders that
+ *  own a team, as they cannot be called concurrently anyway.  This is not in the anonymous namespace only
+ *  because MultiEpochMatrixBuilder (declared in the header) holds one.
+ */
+class ThreadTeam {
+public:
+
+    explicit ThreadTeam(std::size_t size) :
+        _task(nullptr), _generation(0), _pending(0), _stop(false), _errors(size)
+    {
+        _threads.reserve(size - 1);
+        for (std::size_t n = 1; n < size; ++n) {
+            _threads.push_back(std::thread([this, n]() { work(n); }));
+        }
+    }
+
+    ThreadTeam(ThreadTeam const &) = delete;
+
+    ThreadTeam & operator=(ThreadTeam const &) = delete;
+
+    ~ThreadTeam() {
+        {
+            std::lock_guard<std::mutex> lock(_mutex);
+            _stop = true;
+        }
+        _start.notify_all();
+        for (std::vector<std::thread>::iterator i = _threads.begin(); i != _threads.end(); ++i) {
+            i->join();
+        }
+    }
+
+    std::size_t getSize() const { return _errors.size(); }
+
+    // Call function(n) for each n in [0, getSize()), with n = 0 in the calling thread, and rethrow the
+    // first exception (in order of n) after all of them have finished.
+    void run(std::function<void(std::size_t)> const & function) {
+        std::fill(_errors.begin(), _errors.end(), std::exception_ptr());
+        {
+            std::lock_guard<std::mutex> lock(_mutex);
+            _task = &function;
+            _pending = _threads.size();
+            ++_generation;
+        }
+        _start.notify_all();
+        try {
+            function(0);
+        } catch (...) {
+            _errors.front() = std::current_exception();
+        }
+        {
+            std::unique_lock<std::mutex> lock(_mutex);
+            _done.wait(lock, [this]() { return _pending == 0; });
+            _task = nullptr;
+        }
+        for (std::vector<std::exception_ptr>::const_iterator i = _errors.begin(); i != _errors.end(); ++i) {
+            if (*i) {
+                std::rethrow_exception(*i);
+            }
+        }
+    }
+
+private:
+
+    void work(std::size_t n) {
+        std::size_t generation = 0;
+        while (true) {
+            std::function<void(std::size_t)> const * task;
+            {
+                std::unique_lock<std::mutex> lock(_mutex);
+                _start.wait(lock, [this, generation]() { return _stop || _generation != generation; });
+                if (_stop) {
+                    return;
+                }
+                generation = _generation;
+                task = _task;
+            }
+            try {
+                (*task)(n);
+            } catch (...) {
+                _errors[n] = std::current_exception();
+            }
+            {
+                std::lock_guard<std::mutex> lock(_mutex);
+                if (--_pending == 0) {
+                    _done.notify_one();
+                }
+            }
+        }
+    }
+
+    std::mutex _mutex;
+    std::condition_variable _start;
+    std::condition_variable _done;
+    std::function<void(std::size_t)> const * _task;
+    std::size_t _generation;
+    std::size_t _pending;
+    bool _stop;
+    std::vector<std::exception_ptr> _errors;
+    std::vector<std::thread> _threads;
+};
+
+} // namespace detail
+
 namespace {
 
 template <typename T>
@@ -630,7 +1907,7 @@ public:
             ndarray::Array<T const,1,1> const & x,
             ndarray::Array<T const,1,1> const & y,
             MultiShapeletBasis const & basis
-        ) {
+        ) : _x(x), _y(y), _shareGrid(true) {
             _components.reserve(basis.getComponentCount());
             for (MultiShapeletBasis::Iterator i = basis.begin(); i != basis.end(); ++i) {
                 _components.push_back(
@@ -638,6 +1915,7 @@ public:
                         x, y, i->getOrder(), i->getRadius(), i->getMatrix()
                     )
                 );
+                _components.back()->setComponent(true);
             }
         }
 
@@ -646,7 +1924,7 @@ public:
             ndarray::Array<T const,1,1> const & y,
             MultiShapeletBasis const & basis,
             MultiShapeletFunction const & psf
-        ) {
+        ) : _x(x), _y(y), _shareGrid(false) {
             _components.reserve(psf.getComponents().size() * basis.getComponentCount());
             for (MultiShapeletBasis::Iterator i = basis.begin(); i != basis.end(); ++i) {
                 for (
@@ -659,6 +1937,7 @@ public:
                             x, y, i->getOrder(), i->getRadius(), i->getMatrix(), *j
                         )
                     );
+                    _components.back()->setComponent(true);
                 }
             }
         }
@@ -668,64 +1947,1182 @@ public:
         virtual int getDataSize() const { return _components.front()->getDataSize(); }
 
         virtual int computeWorkspace() const {
-            int ws = 0;
+            int const nPartitions = computePartitionCount();
+            return computeComponentWorkspace() * nPartitions
+                + (nPartitions - 1) * getDataSize() * (getBasisSize() + 1)  // partial matrices and models
+                + computeNormalTileSize() * (getBasisSize() + 2)  // tile and scratch for normal equations
+                + (shareGrid() ? SharedGrid<T>::computeWorkspace(getDataSize()) : 0);
+        }
+
+        virtual PTR(typename MatrixBuilder<T>::Impl) makeBuilderImpl(Workspace & workspace) const {
+            PTR(SharedGrid<T>) grid;
+            if (shareGrid()) {
+                grid = std::make_shared< SharedGrid<T> >(_x, _y, &workspace);
+            }
+            int const nPartitions = computePartitionCount();
+            int const componentWorkspace = computeComponentWorkspace();
+            int const nComponents = _components.size();
+            std::vector<Vector> partitions(nPartitions);
+            for (int n = 0; n < nPartitions; ++n) {
+                FactoryIterator const begin = _components.begin() + (n*nComponents) / nPartitions;
+                FactoryIterator const end = _components.begin() + ((n + 1)*nComponents) / nPartitions;
+                partitions[n].reserve(end - begin);
+                for (FactoryIterator i = begin; i != end; ++i) {
+                    // By copying the workspace here, we prevent the original from having its pointer updated
+                    // (yet), and hence each component builder in this partition starts grabbing workspace
+                    // arrays from the same point, and they all end up sharing the same space.  That's what
+                    // we want, because we call them one at a time, and they don't need anything to remain
+                    // between calls.
+                    Workspace wsCopy(workspace);
+                    partitions[n].push_back((**i).makeBuilderImpl(wsCopy));
+                    if (grid) {
+                        std::static_pointer_cast< RemappedShapeletImpl<T> >(partitions[n].back())
+                            ->setSharedGrid(grid);
+                    }
+                }
+                // Now we increment the workspace by the maximum needed by any individual component, so the
+                // next partition (which may run concurrently with this one) gets its own slice.
+                workspace.increment(componentWorkspace);
+            }
+            // The partial outputs of all partitions but the first come after the partition slices.
+            std::vector< ndarray::Array<T,2,-2> > partials;
+            std::vector< ndarray::Array<T,1,1> > modelPartials;
+            for (int n = 1; n < nPartitions; ++n) {
+                ndarray::Size const dataSize = getDataSize();
+                ndarray::Size const basisSize = getBasisSize();
+                T * data = workspace.makeMatrix(dataSize, basisSize).data();
+                ndarray::Array<T,2,2> partialT = ndarray::external(
+                    data, ndarray::makeVector(basisSize, dataSize),
+                    ndarray::makeVector(ndarray::Offset(dataSize), ndarray::Offset(1)), workspace.getManager()
+                );
+                partials.push_back(partialT.transpose());
+                modelPartials.push_back(
+                    ndarray::external(
+                        workspace.makeVector(dataSize).data(), ndarray::makeVector(dataSize),
+                        ndarray::makeVector(ndarray::Offset(1)), workspace.getManager()
+                    )
+                );
+            }
+            typename Workspace::Matrix normalTile
+                = workspace.makeMatrix(computeNormalTileSize(), getBasisSize());
+            typename Workspace::Matrix normalScratch = workspace.makeMatrix(computeNormalTileSize(), 2);
+            return std::make_shared<CompoundImpl>(
+                partitions, partials, modelPartials, grid, normalTile, normalScratch
+            );
+        }
+
+        virtual void setConvolutionCache(int capacity, double quantum) {
+            MatrixBuilderFactory<T>::Impl::setConvolutionCache(capacity, quantum);
             for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
-                ws = std::max((**i).computeWorkspace(), ws);
+                (**i).setConvolutionCache(capacity, quantum);
             }
-            return ws;
         }
 
-        virtual PTR(typename MatrixBuilder<T>::Impl) makeBuilderImpl(Workspace & workspace) const {
-            Vector builders;
-            builders.reserve(_components.size());
+        virtual void setTileSize(int tileSize) {
+            MatrixBuilderFactory<T>::Impl::setTileSize(tileSize);
             for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
-                // By copying the workspace here, we prevent the original from having its pointer updated
-                // (yet), and hence each component builder starts grabbing workspace arrays from the same
-                // point, and they all end up sharing the same space.  That's what we want, because we call
-                // them one at a time, and they don't need anything to remain between calls.
-                Workspace wsCopy(workspace);
-                builders.push_back((**i).makeBuilderImpl(wsCopy));
+                (**i).setTileSize(tileSize);
+            }
+        }
+
+        virtual void setDerivativesEnabled(bool enabled) {
+            MatrixBuilderFactory<T>::Impl::setDerivativesEnabled(enabled);
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                (**i).setDerivativesEnabled(enabled);
+            }
+        }
+
+        virtual void setCutoff(double cutoff) {
+            MatrixBuilderFactory<T>::Impl::setCutoff(cutoff);
+            // all components have the same points, so they can share a single index
+            PTR(PointIndex<T> const) index;
+            if (cutoff > 0.0) {
+                index = std::make_shared< PointIndex<T> >(_x, _y);
+            }
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                std::static_pointer_cast< typename SimpleImpl<T>::Factory >(*i)->setCutoff(cutoff, index);
             }
-            // Now, at the end, we increment the workspace by the amount we claimed we needed, which was
-            // the maximum needed by any individual components.
-            workspace.increment(computeWorkspace());
-            return std::make_shared<CompoundImpl>(builders);
         }
 
     private:
+
+        // Transforming all points to a shared grid would defeat the purpose of a cutoff, which is to
+        // only transform the points near each component.
+        bool shareGrid() const { return _shareGrid && !(this->getCutoff() > 0.0); }
+
+        // Normal equations are evaluated in tiles only if the components all have the same active points.
+        int computeNormalTileSize() const {
+            return (this->getCutoff() > 0.0) ? 0 : this->getNormalTileSize();
+        }
+
+        int computeComponentWorkspace() const {
+            int ws = 0;
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                ws = std::max((**i).computeWorkspace(), ws);
+            }
+            return ws;
+        }
+
+        int computePartitionCount() const {
+            return std::min(this->getThreadCount(), static_cast<int>(_components.size()));
+        }
+
+        ndarray::Array<T const,1,1> _x;
+        ndarray::Array<T const,1,1> _y;
+        bool _shareGrid;
         FactoryVector _components;
     };
 
-    explicit CompoundImpl(Vector const & components) : _components(components) {}
+    CompoundImpl(
+        std::vector<Vector> const & partitions,
+        std::vector< ndarray::Array<T,2,-2> > const & partials,
+        std::vector< ndarray::Array<T,1,1> > const & modelPartials,
+        PTR(SharedGrid<T>) grid,
+        typename Workspace::Matrix const & normalTile,
+        typename Workspace::Matrix const & normalScratch
+    ) : _partitions(partitions), _grid(grid), _partials(partials), _modelPartials(modelPartials),
+        _normalTile(normalTile), _normalScratch(normalScratch)
+    {
+        if (_partitions.size() > 1u) {
+            _team.reset(new detail::ThreadTeam(_partitions.size()));
+        }
+        _groups.reserve(_partitions.size());
+        for (std::size_t n = 0; n < _partitions.size(); ++n) {
+            _groups.push_back(makeGroups(_partitions[n]));
+        }
+    }
 
-    virtual int getDataSize() const { return _components.front()->getDataSize(); }
+    virtual int getDataSize() const { return _partitions.front().front()->getDataSize(); }
 
-    virtual int getBasisSize() const { return _components.front()->getBasisSize(); }
+    virtual int getBasisSize() const { return _partitions.front().front()->getBasisSize(); }
 
     virtual void buildMatrix(
         ndarray::Array<T,2,-1> const & output,
         afw::geom::ellipses::Ellipse const & ellipse
     ) {
-        for (Iterator i = _components.begin(); i != _components.end(); ++i) {
-            (**i).buildMatrix(output, ellipse);
+        if (_grid) {
+            _grid->readEllipse(ellipse);
+        }
+        runPartitions(
+            [this, &output, &ellipse](std::size_t n) {
+                if (n == 0) {
+                    buildPartition(_groups.front(), output, ellipse);
+                } else {
+                    _partials[n - 1].deep() = 0.0;
+                    buildPartition(_groups[n], _partials[n - 1], ellipse);
+                }
+            }
+        );
+        for (std::size_t n = 0; n < _partials.size(); ++n) {
+            ndarray::asEigenMatrix(output) += ndarray::asEigenMatrix(_partials[n]);
         }
     }
 
-private:
-    Vector _components;
-};
-
-} // anonymous
+    // Derivatives are always computed in a single thread; the components in different partitions have
+    // their own workspace, so we can just run them all one after the other.
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        typedef typename std::vector<Vector>::const_iterator PartitionIterator;
+        for (PartitionIterator p = _partitions.begin(); p != _partitions.end(); ++p) {
+            for (Iterator i = p->begin(); i != p->end(); ++i) {
+                (**i).buildDerivatives(output, derivatives, ellipse);
+            }
+        }
+    }
 
-//===========================================================================================================
-//================== MatrixBuilder ==========================================================================
-//===========================================================================================================
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        if (_grid) {
+            _grid->readEllipse(ellipse);
+        }
+        runPartitions(
+            [this, &output, &coefficients, &ellipse](std::size_t n) {
+                ndarray::Array<T,1,1> target = output;
+                if (n > 0) {
+                    target = _modelPartials[n - 1];
+                    target.deep() = 0.0;
+                }
+                for (Iterator i = _partitions[n].begin(); i != _partitions[n].end(); ++i) {
+                    (**i).buildModel(target, coefficients, ellipse);
+                }
+            }
+        );
+        for (std::size_t n = 0; n < _modelPartials.size(); ++n) {
+            ndarray::asEigenArray(output) += ndarray::asEigenArray(_modelPartials[n]);
+        }
+    }
 
-template <typename T>
-MatrixBuilder<T>::MatrixBuilder(
-    ndarray::Array<T const,1,1> const & x,
-    ndarray::Array<T const,1,1> const & y,
-    int order
+    /*
+     *  Normal equations are always computed in a single thread.  Without a cutoff, every component is
+     *  prepared for the ellipse first, and then each tile (which follows the partial outputs in the
+     *  workspace) is filled by all of them before it is added to the normal equations.  The components
+     *  do not reserve tiles of their own.  With a cutoff, the components have different active points,
+     *  so we just evaluate the full matrix.
+     */
+    virtual void buildNormalEquations(
+        ndarray::Array<T,2,2> const & gram,
+        ndarray::Array<T,1,1> const & projection,
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        if (_normalTile.rows() == 0) {
+            MatrixBuilder<T>::Impl::buildNormalEquations(gram, projection, weights, data, ellipse);
+            return;
+        }
+        if (_grid) {
+            _grid->readEllipse(ellipse);
+        }
+        std::vector<SimpleImpl<T>*> components;
+        typedef typename std::vector<Vector>::const_iterator PartitionIterator;
+        for (PartitionIterator p = _partitions.begin(); p != _partitions.end(); ++p) {
+            for (Iterator i = p->begin(); i != p->end(); ++i) {
+                components.push_back(static_cast<SimpleImpl<T>*>(i->get()));
+                components.back()->prepareTiles(ellipse);
+            }
+        }
+        typename Workspace::Matrix & tile = _normalTile;
+        int const dataSize = getDataSize();
+        int const tileSize = tile.rows();
+        for (int begin = 0; begin < dataSize; begin += tileSize) {
+            int const size = std::min(tileSize, dataSize - begin);
+            tile.topRows(size).setZero();
+            for (typename std::vector<SimpleImpl<T>*>::const_iterator i = components.begin();
+                 i != components.end(); ++i) {
+                (**i).buildTile(tile, begin, size);
+            }
+            accumulateNormalEquations(
+                gram, projection, weights, data, tile.topRows(size).matrix(), _normalScratch,
+                [begin](int r) { return begin + r; }
+            );
+        }
+    }
+
+private:
+
+    typedef std::vector< PTR(FactoredImpl<T>) > FactoredVector;
+
+    // A set of components from the same partition that are evaluated together, with lhs and rhsT holding
+    // the factors of all components side-by-side.  If there's only one component (or the components
+    // can't be factored, in which case factorSize is zero), factored is empty and lhs and rhsT are not
+    // allocated; we just call buildMatrix on each component instead.
+    struct Group {
+        int factorSize;
+        Vector components;
+        FactoredVector factored;
+        Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> lhs;
+        Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> rhsT;
+    };
+
+    typedef std::vector<Group> GroupVector;
+
+    GroupVector makeGroups(Vector const & components) const {
+        GroupVector groups;
+        for (Iterator i = components.begin(); i != components.end(); ++i) {
+            PTR(FactoredImpl<T>) factored = std::dynamic_pointer_cast< FactoredImpl<T> >(*i);
+            if (factored && factored->getFactorSize() == 0) {
+                factored.reset();
+            }
+            int const factorSize = factored ? factored->getFactorSize() : 0;
+            // Each component adds this many bytes to the lhs matrix of the group it joins.
+            std::size_t const lhsBytes = sizeof(T) * factorSize * getDataSize();
+            typename GroupVector::iterator g = factored ? groups.begin() : groups.end();
+            for (; g != groups.end(); ++g) {
+                if (g->factorSize == factorSize && (g->components.size() + 1) * lhsBytes <= MAX_GROUP_BYTES) {
+                    break;
+                }
+            }
+            if (g == groups.end()) {
+                groups.push_back(Group());
+                g = groups.end() - 1;
+                g->factorSize = factorSize;
+            }
+            g->components.push_back(*i);
+            if (factored) {
+                g->factored.push_back(factored);
+            }
+        }
+        for (typename GroupVector::iterator g = groups.begin(); g != groups.end(); ++g) {
+            if (g->factored.size() < 2u) {
+                g->factored.clear();
+                continue;
+            }
+            int const nColumns = g->factorSize * g->factored.size();
+            g->lhs.resize(getDataSize(), nColumns);
+            g->rhsT.resize(getBasisSize(), nColumns);
+        }
+        return groups;
+    }
+
+    // Call function(n) for each partition n, in the team's threads if there is more than one partition.
+    template <typename Function>
+    void runPartitions(Function function) {
+        if (_team) {
+            _team->run(function);
+        } else {
+            function(0);
+        }
+    }
+
+    static void buildPartition(
+        GroupVector & groups,
+        ndarray::Array<T,2,-1> const & output,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        for (typename GroupVector::iterator g = groups.begin(); g != groups.end(); ++g) {
+            if (g->factored.empty()) {
+                for (Iterator i = g->components.begin(); i != g->components.end(); ++i) {
+                    (**i).buildMatrix(output, ellipse);
+                }
+                continue;
+            }
+            int const dataSize = g->lhs.rows();
+            int const basisSize = g->rhsT.rows();
+            T * lhs = g->lhs.data();
+            T * rhsT = g->rhsT.data();
+            typedef typename FactoredVector::const_iterator FactoredIterator;
+            for (FactoredIterator i = g->factored.begin(); i != g->factored.end(); ++i) {
+                (**i).buildFactors(
+                    typename Workspace::Matrix(lhs, dataSize, g->factorSize),
+                    typename Workspace::Matrix(rhsT, basisSize, g->factorSize),
+                    ellipse
+                );
+                lhs += dataSize * g->factorSize;
+                rhsT += basisSize * g->factorSize;
+            }
+            ndarray::asEigenMatrix(output).noalias() += g->lhs * g->rhsT.transpose();
+        }
+    }
+
+    // Maximum size of a group's lhs matrix; beyond this, filling it and reading it back again costs more
+    // in cache misses than we save by doing one matrix product instead of several (this is about half the
+    // size of a typical L2 cache).
+    static constexpr std::size_t MAX_GROUP_BYTES = 1 << 20;
+
+    std::vector<Vector> _partitions;
+    PTR(SharedGrid<T>) _grid;
+    std::vector<GroupVector> _groups;
+    std::vector< ndarray::Array<T,2,-2> > _partials;
+    std::vector< ndarray::Array<T,1,1> > _modelPartials;
+    typename Workspace::Matrix _normalTile;  // empty if there is a cutoff
+    typename Workspace::Matrix _normalScratch;  // empty if there is a cutoff
+    std::unique_ptr<detail::ThreadTeam> _team;  // null if there is only one partition
+};
+
+} // anonymous
+
+//===========================================================================================================
+//================== Mixture-of-Gaussians Implementation ====================================================
+//===========================================================================================================
+
+/*
+ * This implementation pair handles the common special case of a MultiShapeletBasis in which every
+ * component has order zero (i.e. a mixture of Gaussians), optionally convolved with a MultiShapeletFunction
+ * whose components also all have order zero.  The convolution of two elliptical Gaussians is just another
+ * elliptical Gaussian whose moments are the sums of the moments of the two, so each (basis component, PSF
+ * component) pair contributes
+ *
+ *     2 p exp(-q/2) / sqrt(det(Q))
+ *
+ * times the (single-row) remap matrix of the basis component, where p is the PSF component's coefficient,
+ * Q is the sum of the moments of the PSF component's ellipse and the basis ellipse scaled by the basis
+ * component's radius, and q is the squared distance of a data point from the sum of their centers in the
+ * metric defined by Q^{-1}.  Without a PSF, we use a single "PSF component" with zero moments, and the
+ * factor 2 p is replaced by the normalization of an order-zero shapelet function, pi^{-1/2}.  This avoids
+ * the convolution matrices and Hermite polynomials needed by the general implementations above, and
+ * evaluates just one exponential per pair per data point.
+ *
+ * As in the compound implementation, we put the Gaussians for all pairs side-by-side in an lhs matrix and
+ * multiply that by a matrix of amplitudes (with one row per pair) to form the output, here one tile of
+ * data points at a time.  Without a cutoff, the data points are split into contiguous ranges, one per
+ * thread, which write to disjoint rows of the output.  With a cutoff, each pair only touches the data
+ * points within its own (convolved) cutoff ellipse, so we add the contribution of each pair directly to
+ * the rows of those points, in a single thread.
+ */
+
+namespace {
+
+template <typename T>
+class GaussianMixtureImpl : public SimpleImpl<T> {
+public:
+
+    typedef MatrixBuilderWorkspace<T> Workspace;
+    typedef Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> AmplitudeMatrix;
+
+    // The moments, center, and amplitude factor (2 p, as described above) of a PSF component.
+    struct PsfComponent {
+        double ixx;
+        double iyy;
+        double ixy;
+        double x;
+        double y;
+        double factor;
+    };
+
+    typedef std::vector<PsfComponent> PsfVector;
+
+    class Factory : public SimpleImpl<T>::Factory {
+    public:
+
+        Factory(
+            ndarray::Array<T const,1,1> const & x,
+            ndarray::Array<T const,1,1> const & y,
+            MultiShapeletBasis const & basis
+        ) : SimpleImpl<T>::Factory(x, y) {
+            PsfComponent const delta = {0.0, 0.0, 0.0, 0.0, 0.0, BASIS_NORMALIZATION * BASIS_NORMALIZATION};
+            _psf.push_back(delta);
+            setBasis(basis);
+        }
+
+        Factory(
+            ndarray::Array<T const,1,1> const & x,
+            ndarray::Array<T const,1,1> const & y,
+            MultiShapeletBasis const & basis,
+            MultiShapeletFunction const & psf
+        ) : SimpleImpl<T>::Factory(x, y) {
+            typedef MultiShapeletFunction::ComponentList::const_iterator Iterator;
+            for (Iterator i = psf.getComponents().begin(); i != psf.getComponents().end(); ++i) {
+                ShapeletFunction hermite(*i);
+                hermite.changeBasisType(HERMITE);
+                afw::geom::ellipses::Quadrupole const moments(hermite.getEllipse().getCore());
+                PsfComponent const component = {
+                    moments.getIxx(), moments.getIyy(), moments.getIxy(),
+                    hermite.getEllipse().getCenter().getX(), hermite.getEllipse().getCenter().getY(),
+                    2.0 * hermite.getCoefficients()[0]
+                };
+                _psf.push_back(component);
+            }
+            setBasis(basis);
+        }
+
+        virtual int getBasisSize() const { return _amplitudes.cols(); }
+
+        virtual int computeWorkspace() const {
+            return SimpleImpl<T>::Factory::computeWorkspace()
+                + (this->getDerivativesEnabled() ? 2 : 1) * this->getDataSize() * _amplitudes.rows();
+        }
+
+        std::vector<double> const & getRadii() const { return _radii; }
+
+        PsfVector const & getPsf() const { return _psf; }
+
+        AmplitudeMatrix const & getAmplitudes() const { return _amplitudes; }
+
+        virtual PTR(typename MatrixBuilder<T>::Impl) makeBuilderImpl(Workspace & workspace) const {
+            return std::make_shared<GaussianMixtureImpl>(*this, &workspace);
+        }
+
+    private:
+
+        // Set the radii and the amplitude matrix, which has a row for each (basis component, PSF component)
+        // pair, with the PSF component index varying fastest.
+        void setBasis(MultiShapeletBasis const & basis) {
+            _amplitudes.resize(basis.getComponentCount() * _psf.size(), basis.getSize());
+            int k = 0;
+            for (MultiShapeletBasis::Iterator i = basis.begin(); i != basis.end(); ++i) {
+                _radii.push_back(i->getRadius());
+                for (typename PsfVector::const_iterator j = _psf.begin(); j != _psf.end(); ++j, ++k) {
+                    _amplitudes.row(k)
+                        = (ndarray::asEigenMatrix(i->getMatrix()).row(0) * j->factor).template cast<T>();
+                }
+            }
+        }
+
+        std::vector<double> _radii;
+        PsfVector _psf;
+        AmplitudeMatrix _amplitudes;
+    };
+
+    GaussianMixtureImpl(Factory const & factory, Workspace * workspace) :
+        SimpleImpl<T>(factory, workspace),
+        _threadCount(factory.getThreadCount()),
+        _radii(factory.getRadii()),
+        _psf(factory.getPsf()),
+        _amplitudes(factory.getAmplitudes()),
+        _modelAmplitudes(_amplitudes.rows()),
+        _gaussians(_amplitudes.rows()),
+        _lhs(workspace->makeMatrix(factory.getDataSize(), _amplitudes.rows())),
+        _dLhs(
+            workspace->makeMatrix(
+                factory.getDerivativesEnabled() ? factory.getDataSize() : 0, _amplitudes.rows()
+            )
+        )
+    {
+        std::size_t const nThreads = computeThreadCount();
+        if (nThreads > 1u) {
+            _team.reset(new detail::ThreadTeam(nThreads));
+        }
+    }
+
+    virtual int getBasisSize() const { return _amplitudes.cols(); }
+
+    virtual void buildMatrix(
+        ndarray::Array<T,2,-1> const & output,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        setGaussians(ellipse);
+        auto outputMatrix = ndarray::asEigenMatrix(output);
+        if (this->_index) {
+            for (std::size_t k = 0; k < _gaussians.size(); ++k) {
+                forEachActivePoint(
+                    _gaussians[k],
+                    [this, k, &outputMatrix](int i, double, double, double value) {
+                        outputMatrix.row(i) += T(value) * _amplitudes.row(k);
+                    }
+                );
+            }
+            return;
+        }
+        forEachTileInThreads(
+            [this, &outputMatrix](int begin, int size) {
+                fillGaussians(begin, size);
+                outputMatrix.middleRows(begin, size).noalias()
+                    += _lhs.middleRows(begin, size).matrix() * _amplitudes;
+            }
+        );
+    }
+
+    virtual void prepareTiles(afw::geom::ellipses::Ellipse const & ellipse) { setGaussians(ellipse); }
+
+    // This ignores the cutoff, so it is only used without one (see buildNormalEquations).
+    virtual void buildTile(typename Workspace::Matrix & tile, int begin, int size) {
+        fillGaussians(begin, size);
+        tile.topRows(size).matrix().noalias() += _lhs.middleRows(begin, size).matrix() * _amplitudes;
+    }
+
+    virtual void buildNormalEquations(
+        ndarray::Array<T,2,2> const & gram,
+        ndarray::Array<T,1,1> const & projection,
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        // With a cutoff, the Gaussians are evaluated one pair at a time rather than in tiles of points.
+        if (this->_index) {
+            MatrixBuilder<T>::Impl::buildNormalEquations(gram, projection, weights, data, ellipse);
+        } else {
+            SimpleImpl<T>::buildNormalEquations(gram, projection, weights, data, ellipse);
+        }
+    }
+
+    // Derivatives are always computed in a single thread.
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        setGaussians(ellipse);
+        // derivatives of the moments of the ellipse with respect to its core parameters
+        afw::geom::ellipses::Quadrupole moments;
+        Eigen::Matrix3d const dMoments = moments.dAssign(ellipse.getCore());
+        auto outputMatrix = ndarray::asEigenMatrix(output);
+        if (this->_index) {
+            for (std::size_t k = 0; k < _gaussians.size(); ++k) {
+                Gaussian const & g = _gaussians[k];
+                forEachActivePoint(
+                    g,
+                    [this, k, &g, &dMoments, &outputMatrix, &derivatives](
+                        int i, double dx, double dy, double value
+                    ) {
+                        outputMatrix.row(i) += T(value) * _amplitudes.row(k);
+                        Eigen::Matrix<double,5,1> const dValue
+                            = computeDerivatives(g, dMoments, dx, dy, value);
+                        for (int n = 0; n < 5; ++n) {
+                            ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+                            ndarray::asEigenMatrix(derivative).row(i) += T(dValue[n]) * _amplitudes.row(k);
+                        }
+                    }
+                );
+            }
+            return;
+        }
+        reserveDerivatives();
+        this->forEachTile(
+            [this, &dMoments, &outputMatrix, &derivatives](int begin, int size) {
+                fillGaussians(begin, size);
+                outputMatrix.middleRows(begin, size).noalias()
+                    += _lhs.middleRows(begin, size).matrix() * _amplitudes;
+                for (int n = 0; n < 5; ++n) {
+                    fillDerivatives(n, dMoments, begin, size);
+                    ndarray::Array<T,2,-2> derivative = derivatives[n].transpose();
+                    ndarray::asEigenMatrix(derivative).middleRows(begin, size).noalias()
+                        += _dLhs.middleRows(begin, size).matrix() * _amplitudes;
+                }
+            }
+        );
+    }
+
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        setGaussians(ellipse);
+        _modelAmplitudes.noalias() = _amplitudes * ndarray::asEigenMatrix(coefficients);
+        auto model = ndarray::asEigenMatrix(output);
+        if (this->_index) {
+            for (std::size_t k = 0; k < _gaussians.size(); ++k) {
+                forEachActivePoint(
+                    _gaussians[k],
+                    [this, k, &model](int i, double, double, double value) {
+                        model[i] += T(value) * _modelAmplitudes[k];
+                    }
+                );
+            }
+            return;
+        }
+        forEachTileInThreads(
+            [this, &model](int begin, int size) {
+                fillGaussians(begin, size);
+                model.segment(begin, size).noalias()
+                    += _lhs.middleRows(begin, size).matrix() * _modelAmplitudes;
+            }
+        );
+    }
+
+private:
+
+    /*
+     *  A convolved Gaussian for one (basis component, PSF component) pair, which we evaluate as
+     *  exp(logNorm - q/2), where q = sxx dx^2 + 2 sxy dx dy + syy dy^2 and (dx, dy) is the offset from the
+     *  center (x, y).
+     */
+    struct Gaussian {
+        double x;
+        double y;
+        double ixx;             // moments (the sum of the scaled basis and PSF moments)
+        double iyy;
+        double ixy;
+        double sxx;             // elements of the inverse of the moments matrix
+        double syy;
+        double sxy;
+        double logNorm;         // -log(det(moments))/2
+        double radiusSquared;   // square of the basis component's radius
+    };
+
+    // Compute the convolved Gaussians for the given ellipse.
+    void setGaussians(afw::geom::ellipses::Ellipse const & ellipse) {
+        afw::geom::ellipses::Quadrupole const moments(ellipse.getCore());
+        typename std::vector<Gaussian>::iterator g = _gaussians.begin();
+        for (std::vector<double>::const_iterator r = _radii.begin(); r != _radii.end(); ++r) {
+            for (typename PsfVector::const_iterator j = _psf.begin(); j != _psf.end(); ++j, ++g) {
+                g->radiusSquared = (*r) * (*r);
+                g->x = ellipse.getCenter().getX() + j->x;
+                g->y = ellipse.getCenter().getY() + j->y;
+                g->ixx = g->radiusSquared * moments.getIxx() + j->ixx;
+                g->iyy = g->radiusSquared * moments.getIyy() + j->iyy;
+                g->ixy = g->radiusSquared * moments.getIxy() + j->ixy;
+                double const det = g->ixx * g->iyy - g->ixy * g->ixy;
+                if (!(det > 0.0)) {
+                    throw LSST_EXCEPT(
+                        pex::exceptions::UnderflowError,
+                        "Underflow error in ellipse scaling/convolution"
+                    );
+                }
+                g->sxx = g->iyy / det;
+                g->syy = g->ixx / det;
+                g->sxy = -g->ixy / det;
+                g->logNorm = -0.5 * std::log(det);
+            }
+        }
+    }
+
+    // Fill rows [begin, begin + size) of _lhs with the values of all the Gaussians at those data points.
+    void fillGaussians(int begin, int size) {
+        auto const x = ndarray::asEigenArray(this->_x).segment(begin, size);
+        auto const y = ndarray::asEigenArray(this->_y).segment(begin, size);
+        for (std::size_t k = 0; k < _gaussians.size(); ++k) {
+            Gaussian const & g = _gaussians[k];
+            auto const dx = x - T(g.x);
+            auto const dy = y - T(g.y);
+            _lhs.col(k).segment(begin, size) = (
+                T(g.logNorm)
+                - T(0.5*g.sxx) * dx.square() - T(g.sxy) * dx * dy - T(0.5*g.syy) * dy.square()
+            ).exp();
+        }
+    }
+
+    /*
+     *  Return the derivatives of a Gaussian with respect to the ellipse core parameters and center at a
+     *  single point, given its offset (dx, dy) from the center and its value there.
+     *
+     *  With S = Q^{-1} and w = S d, the derivative of the log of the Gaussian with respect to the moments
+     *  matrix Q is (w w^T - S)/2, and Q = r^2 M + P, where M are the moments of the ellipse and P are the
+     *  moments of the PSF component.  The derivative of the log with respect to the center is just w.
+     */
+    static Eigen::Matrix<double,5,1> computeDerivatives(
+        Gaussian const & g,
+        Eigen::Matrix3d const & dMoments,
+        double dx, double dy, double value
+    ) {
+        double const wx = g.sxx*dx + g.sxy*dy;
+        double const wy = g.sxy*dx + g.syy*dy;
+        Eigen::Vector3d dLogMoments;
+        dLogMoments[0] = 0.5 * g.radiusSquared * (wx*wx - g.sxx);
+        dLogMoments[1] = 0.5 * g.radiusSquared * (wy*wy - g.syy);
+        dLogMoments[2] = g.radiusSquared * (wx*wy - g.sxy);
+        Eigen::Matrix<double,5,1> result;
+        result.head<3>() = value * dMoments.transpose() * dLogMoments;
+        result[3] = value * wx;
+        result[4] = value * wy;
+        return result;
+    }
+
+    // Fill rows [begin, begin + size) of _dLhs with the derivatives of the Gaussians with respect to
+    // ellipse parameter n, given the values of the Gaussians in the same rows of _lhs.
+    void fillDerivatives(int n, Eigen::Matrix3d const & dMoments, int begin, int size) {
+        auto const x = ndarray::asEigenArray(this->_x).segment(begin, size);
+        auto const y = ndarray::asEigenArray(this->_y).segment(begin, size);
+        for (std::size_t k = 0; k < _gaussians.size(); ++k) {
+            Gaussian const & g = _gaussians[k];
+            auto const dx = x - T(g.x);
+            auto const dy = y - T(g.y);
+            auto const wx = T(g.sxx) * dx + T(g.sxy) * dy;
+            auto const wy = T(g.sxy) * dx + T(g.syy) * dy;
+            auto const value = _lhs.col(k).segment(begin, size);
+            if (n < 3) {
+                double const cxx = 0.5 * g.radiusSquared * dMoments(0, n);
+                double const cyy = 0.5 * g.radiusSquared * dMoments(1, n);
+                double const cxy = g.radiusSquared * dMoments(2, n);
+                _dLhs.col(k).segment(begin, size) = value * (
+                    T(cxx) * wx.square() + T(cyy) * wy.square() + T(cxy) * wx * wy
+                    - T(cxx * g.sxx + cyy * g.syy + cxy * g.sxy)
+                );
+            } else if (n == 3) {
+                _dLhs.col(k).segment(begin, size) = value * wx;
+            } else {
+                _dLhs.col(k).segment(begin, size) = value * wy;
+            }
+        }
+    }
+
+    // Make sure _dLhs has room for all data points, allocating it on first use if the factory did not
+    // reserve it in the workspace (see MatrixBuilderFactory::setDerivativesEnabled).
+    void reserveDerivatives() {
+        int const dataSize = this->getDataSize();
+        if (_dLhs.rows() == dataSize) {
+            return;
+        }
+        Workspace workspace(dataSize * _amplitudes.rows());
+        _derivativeManager = workspace.getManager();
+        new (&_dLhs) typename Workspace::Matrix(workspace.makeMatrix(dataSize, _amplitudes.rows()));
+    }
+
+    /*
+     *  Call function(i, dx, dy, value) for each data point i within the cutoff of the given Gaussian, where
+     *  (dx, dy) is the offset of the point from the center of the Gaussian and value is the Gaussian there.
+     */
+    template <typename Function>
+    void forEachActivePoint(Gaussian const & g, Function function) const {
+        PointIndex<T> const & index = *this->_index;
+        double const cutoffSquared = this->_cutoff * this->_cutoff;
+        double const halfWidth = this->_cutoff * std::sqrt(g.ixx);
+        double const halfHeight = this->_cutoff * std::sqrt(g.iyy);
+        index.forEachRun(
+            g.x - halfWidth, g.x + halfWidth, g.y - halfHeight, g.y + halfHeight,
+            [&index, &g, &function, cutoffSquared](int begin, int end) {
+                for (int k = begin; k < end; ++k) {
+                    double const dx = index.getX(k) - g.x;
+                    double const dy = index.getY(k) - g.y;
+                    double const q = g.sxx*dx*dx + 2.0*g.sxy*dx*dy + g.syy*dy*dy;
+                    if (q <= cutoffSquared) {
+                        function(index.getIndex(k), dx, dy, std::exp(g.logNorm - 0.5*q));
+                    }
+                }
+            }
+        );
+    }
+
+    std::size_t computeThreadCount() const {
+        return std::max<std::size_t>(1, std::min<std::size_t>(_threadCount, this->getDataSize()));
+    }
+
+    // Call function(begin, size) for tiles of data points, with the data points split into contiguous
+    // ranges that are processed in separate threads.
+    template <typename Function>
+    void forEachTileInThreads(Function function) const {
+        std::size_t const dataSize = this->getDataSize();
+        if (!_team) {
+            this->forEachTile(0, dataSize, function);
+            return;
+        }
+        std::size_t const nThreads = _team->getSize();
+        _team->run(
+            [this, dataSize, nThreads, &function](std::size_t n) {
+                this->forEachTile(dataSize * n / nThreads, dataSize * (n + 1) / nThreads, function);
+            }
+        );
+    }
+
+    int _threadCount;
+    std::vector<double> _radii;
+    PsfVector _psf;
+    AmplitudeMatrix _amplitudes;
+    Eigen::Matrix<T,Eigen::Dynamic,1> _modelAmplitudes;
+    std::vector<Gaussian> _gaussians;
+    typename Workspace::Matrix _lhs;
+    typename Workspace::Matrix _dLhs;   // only used for derivatives; empty until needed unless reserved
+    ndarray::Manager::Ptr _derivativeManager;  // owns _dLhs if it was not reserved
+    std::unique_ptr<detail::ThreadTeam> _team;  // null if the builder runs in a single thread
+};
+
+} // anonymous
+
+//===========================================================================================================
+//================== Multi-Band Implementation ==============================================================
+//===========================================================================================================
+
+/*
+ * This implementation pair evaluates the same MultiShapeletBasis on the same data points for several bands
+ * that differ only in their PSFs, with the matrices for the different bands stacked along the rows of the
+ * output (band b occupies rows [b*N, (b+1)*N), where N is the number of data points).  Like the compound
+ * implementation, it holds one remapped, convolved component for each (band, basis component, PSF
+ * component) triple, and all components share the same workspace.
+ *
+ * Most of the work of a convolved component is evaluating the Gaussian and Hermite polynomial terms (the
+ * "lhs" matrix) at each data point, and these depend only on the convolved ellipse and the lhs order,
+ * not on the PSF coefficients.  Components with the same basis component and PSF components with the same
+ * ellipse (e.g. when the per-band PSF approximations share their shapes and differ only in their
+ * coefficients, or when some bands have the same PSF) therefore have the same lhs matrix, up to the number
+ * of columns (the Hermite terms are packed in order, so a lower-order lhs matrix is a leading block of
+ * a higher-order one).  The factory puts such components in a group led by the one with the highest lhs
+ * order; the lead's lhs matrix is evaluated once per ellipse, and each other member of the group just
+ * computes its own (small) convolution and remap factor and multiplies it by the leading columns of the
+ * shared matrix.  Components whose PSF ellipses differ in every band have nothing to share, and are
+ * evaluated just as in the compound implementation.
+ *
+ * With a cutoff, each component only evaluates its own active points, so we don't share lhs matrices at
+ * all.  Derivatives are computed one band at a time into a private array (as the output has to be split
+ * along its last dimension), and so are normal equations (in tiles of a single band's data points, which
+ * follow the components' shared workspace).  Everything is done in a single thread.
+ */
+
+namespace {
+
+template <typename T>
+class MultiBandImpl : public MatrixBuilder<T>::Impl {
+public:
+
+    typedef MatrixBuilderWorkspace<T> Workspace;
+
+    typedef RemappedConvolvedShapeletImpl<T> Component;
+    typedef std::vector<PTR(Component)> Vector;
+
+    typedef typename RemappedConvolvedShapeletImpl<T>::Factory FactoryComponent;
+    typedef std::vector<PTR(FactoryComponent)> FactoryVector;
+    typedef typename FactoryVector::const_iterator FactoryIterator;
+
+    // Indices of the components that share an lhs matrix, with the one with the highest lhs order first.
+    typedef std::vector<int> Group;
+
+    class Factory : public MatrixBuilderFactory<T>::Impl {
+    public:
+
+        Factory(
+            ndarray::Array<T const,1,1> const & x,
+            ndarray::Array<T const,1,1> const & y,
+            MultiShapeletBasis const & basis,
+            std::vector<MultiShapeletFunction> const & psfs
+        ) : _x(x), _y(y), _bandCount(psfs.size()) {
+            // the basis component index and PSF component ellipse shared by the members of each group
+            std::vector< std::pair<int,afw::geom::ellipses::Ellipse::ParameterVector> > keys;
+            for (int b = 0; b < _bandCount; ++b) {
+                int c = 0;
+                MultiShapeletFunction::ComponentList const & psf = psfs[b].getComponents();
+                for (MultiShapeletBasis::Iterator i = basis.begin(); i != basis.end(); ++i, ++c) {
+                    typedef MultiShapeletFunction::ComponentList::const_iterator PsfIterator;
+                    for (PsfIterator j = psf.begin(); j != psf.end(); ++j) {
+                        int const n = _components.size();
+                        _components.push_back(
+                            std::make_shared<FactoryComponent>(
+                                x, y, i->getOrder(), i->getRadius(), i->getMatrix(), *j
+                            )
+                        );
+                        _components.back()->setComponent(true);
+                        _bands.push_back(b);
+                        // compare ellipses with the same parametrization, regardless of their core types
+                        afw::geom::ellipses::Ellipse const ellipse(
+                            afw::geom::ellipses::Quadrupole(j->getEllipse().getCore()),
+                            j->getEllipse().getCenter()
+                        );
+                        std::pair<int,afw::geom::ellipses::Ellipse::ParameterVector> key(
+                            c, ellipse.getParameterVector()
+                        );
+                        std::size_t g = 0;
+                        while (g < keys.size() && keys[g] != key) {
+                            ++g;
+                        }
+                        if (g == keys.size()) {
+                            keys.push_back(key);
+                            _groups.push_back(Group());
+                        }
+                        // keep the component with the highest lhs order at the front of the group
+                        Group & group = _groups[g];
+                        if (!group.empty()
+                            && _components[group.front()]->getLhsOrder() < _components[n]->getLhsOrder()) {
+                            group.insert(group.begin(), n);
+                        } else {
+                            group.push_back(n);
+                        }
+                    }
+                }
+            }
+        }
+
+        virtual int getBasisSize() const { return _components.front()->getBasisSize(); }
+
+        virtual int getDataSize() const { return _components.front()->getDataSize() * _bandCount; }
+
+        virtual int computeWorkspace() const {
+            return computeComponentWorkspace() + computeNormalTileSize() * (getBasisSize() + 2);
+        }
+
+        virtual PTR(typename MatrixBuilder<T>::Impl) makeBuilderImpl(Workspace & workspace) const {
+            Vector components;
+            components.reserve(_components.size());
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                // All components share the same workspace (see CompoundImpl::Factory::makeBuilderImpl).
+                Workspace wsCopy(workspace);
+                components.push_back(std::static_pointer_cast<Component>((**i).makeBuilderImpl(wsCopy)));
+            }
+            workspace.increment(computeComponentWorkspace());
+            typename Workspace::Matrix normalTile
+                = workspace.makeMatrix(computeNormalTileSize(), getBasisSize());
+            typename Workspace::Matrix normalScratch = workspace.makeMatrix(computeNormalTileSize(), 2);
+            return std::make_shared<MultiBandImpl>(
+                components, _bands, _groups, _components.front()->getDataSize(), _bandCount,
+                normalTile, normalScratch
+            );
+        }
+
+        virtual void setConvolutionCache(int capacity, double quantum) {
+            MatrixBuilderFactory<T>::Impl::setConvolutionCache(capacity, quantum);
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                (**i).setConvolutionCache(capacity, quantum);
+            }
+        }
+
+        virtual void setTileSize(int tileSize) {
+            MatrixBuilderFactory<T>::Impl::setTileSize(tileSize);
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                (**i).setTileSize(tileSize);
+            }
+        }
+
+        virtual void setDerivativesEnabled(bool enabled) {
+            MatrixBuilderFactory<T>::Impl::setDerivativesEnabled(enabled);
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                (**i).setDerivativesEnabled(enabled);
+            }
+        }
+
+        virtual void setCutoff(double cutoff) {
+            MatrixBuilderFactory<T>::Impl::setCutoff(cutoff);
+            // all components have the same points, so they can share a single index
+            PTR(PointIndex<T> const) index;
+            if (cutoff > 0.0) {
+                index = std::make_shared< PointIndex<T> >(_x, _y);
+            }
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                (**i).setCutoff(cutoff, index);
+            }
+        }
+
+    private:
+
+        // Normal equations are evaluated in tiles of points from a single band, and only if the components
+        // all have the same active points (see CompoundImpl::Factory::computeNormalTileSize).
+        int computeNormalTileSize() const {
+            if (this->getCutoff() > 0.0) {
+                return 0;
+            }
+            return std::min(this->getNormalTileSize(), _components.front()->getDataSize());
+        }
+
+        int computeComponentWorkspace() const {
+            int ws = 0;
+            for (FactoryIterator i = _components.begin(); i != _components.end(); ++i) {
+                ws = std::max((**i).computeWorkspace(), ws);
+            }
+            return ws;
+        }
+
+        ndarray::Array<T const,1,1> _x;
+        ndarray::Array<T const,1,1> _y;
+        int _bandCount;
+        FactoryVector _components;
+        std::vector<int> _bands;
+        std::vector<Group> _groups;
+    };
+
+    MultiBandImpl(
+        Vector const & components,
+        std::vector<int> const & bands,
+        std::vector<Group> const & groups,
+        int bandDataSize,
+        int bandCount,
+        typename Workspace::Matrix const & normalTile,
+        typename Workspace::Matrix const & normalScratch
+    ) : _components(components), _bands(bands), _groups(groups), _bandDataSize(bandDataSize),
+        _bandCount(bandCount), _normalTile(normalTile), _normalScratch(normalScratch)
+    {
+        int lhsSize = 0;
+        for (typename std::vector<Group>::const_iterator g = _groups.begin(); g != _groups.end(); ++g) {
+            if (g->size() > 1u) {
+                lhsSize = std::max(lhsSize, _components[g->front()]->getFactorSize());
+            }
+        }
+        _lhs.resize(lhsSize > 0 ? _bandDataSize : 0, lhsSize);
+        _rhsT.resize(getBasisSize(), lhsSize);
+    }
+
+    virtual int getDataSize() const { return _bandDataSize * _bandCount; }
+
+    virtual int getBasisSize() const { return _components.front()->getBasisSize(); }
+
+    virtual void buildMatrix(
+        ndarray::Array<T,2,-1> const & output,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        for (typename std::vector<Group>::const_iterator g = _groups.begin(); g != _groups.end(); ++g) {
+            Component & lead = *_components[g->front()];
+            int const lhsSize = lead.getFactorSize();
+            if (g->size() == 1u || lhsSize == 0) {
+                // nothing to share (or a cutoff, which makes each component evaluate only its own points)
+                for (Group::const_iterator i = g->begin(); i != g->end(); ++i) {
+                    _components[*i]->buildMatrix(getBand(output, _bands[*i]), ellipse);
+                }
+                continue;
+            }
+            typename Workspace::Matrix lhs(_lhs.data(), _bandDataSize, lhsSize);
+            for (Group::const_iterator i = g->begin(); i != g->end(); ++i) {
+                Component & component = *_components[*i];
+                int const size = component.getFactorSize();
+                typename Workspace::Matrix rhsT(_rhsT.data(), getBasisSize(), size);
+                if (i == g->begin()) {
+                    lead.buildFactors(lhs, rhsT, ellipse);
+                } else {
+                    component.buildRhsFactor(rhsT, ellipse);
+                }
+                ndarray::asEigenMatrix(output).middleRows(_bands[*i] * _bandDataSize, _bandDataSize).noalias()
+                    += lhs.matrix().leftCols(size) * rhsT.matrix().transpose();
+            }
+        }
+    }
+
+    virtual void buildDerivatives(
+        ndarray::Array<T,2,-1> const & output,
+        ndarray::Array<T,3,3> const & derivatives,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        if (_bandDerivatives.isEmpty()) {
+            _bandDerivatives = ndarray::allocate(ndarray::makeVector(5, getBasisSize(), _bandDataSize));
+        }
+        for (int b = 0; b < _bandCount; ++b) {
+            _bandDerivatives.deep() = 0.0;
+            for (std::size_t i = 0; i < _components.size(); ++i) {
+                if (_bands[i] == b) {
+                    _components[i]->buildDerivatives(getBand(output, b), _bandDerivatives, ellipse);
+                }
+            }
+            for (int n = 0; n < 5; ++n) {
+                ndarray::asEigenMatrix(derivatives[n]).middleCols(b * _bandDataSize, _bandDataSize)
+                    += ndarray::asEigenMatrix(_bandDerivatives[n]);
+            }
+        }
+    }
+
+    virtual void buildModel(
+        ndarray::Array<T,1,1> const & output,
+        ndarray::Array<T const,1,1> const & coefficients,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        for (std::size_t i = 0; i < _components.size(); ++i) {
+            int const begin = _bands[i] * _bandDataSize;
+            _components[i]->buildModel(
+                output[ndarray::view(begin, begin + _bandDataSize)], coefficients, ellipse
+            );
+        }
+    }
+
+    /*
+     *  Without a cutoff, normal equations are evaluated one band at a time: the components for the band
+     *  are prepared for the ellipse, and then each tile of that band's data points is filled by all of
+     *  them before it is added to the normal equations (as in CompoundImpl::buildNormalEquations).  The
+     *  lhs matrices are not shared in this case, as each tile holds only a small block of them.  With a
+     *  cutoff, we just evaluate the full matrix.
+     */
+    virtual void buildNormalEquations(
+        ndarray::Array<T,2,2> const & gram,
+        ndarray::Array<T,1,1> const & projection,
+        ndarray::Array<T const,1,1> const & weights,
+        ndarray::Array<T const,1,1> const & data,
+        afw::geom::ellipses::Ellipse const & ellipse
+    ) {
+        if (_normalTile.rows() == 0) {
+            MatrixBuilder<T>::Impl::buildNormalEquations(gram, projection, weights, data, ellipse);
+            return;
+        }
+        typename Workspace::Matrix & tile = _normalTile;
+        int const tileSize = tile.rows();
+        for (int b = 0; b < _bandCount; ++b) {
+            for (std::size_t i = 0; i < _components.size(); ++i) {
+                if (_bands[i] == b) {
+                    _components[i]->prepareTiles(ellipse);
+                }
+            }
+            int const offset = b * _bandDataSize;
+            for (int begin = 0; begin < _bandDataSize; begin += tileSize) {
+                int const size = std::min(tileSize, _bandDataSize - begin);
+                tile.topRows(size).setZero();
+                for (std::size_t i = 0; i < _components.size(); ++i) {
+                    if (_bands[i] == b) {
+                        _components[i]->buildTile(tile, begin, size);
+                    }
+                }
+                accumulateNormalEquations(
+                    gram, projection, weights, data, tile.topRows(size).matrix(), _normalScratch,
+                    [offset, begin](int r) { return offset + begin + r; }
+                );
+            }
+        }
+    }
+
+private:
+
+    ndarray::Array<T,2,-1> getBand(ndarray::Array<T,2,-1> const & output, int band) const {
+        return output[ndarray::view(band * _bandDataSize, (band + 1) * _bandDataSize)()];
+    }
+
+    Vector _components;
+    std::vector<int> _bands;
+    std::vector<Group> _groups;
+    int _bandDataSize;
+    int _bandCount;
+    Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> _lhs;   // empty if no components share lhs matrices
+    Eigen::Matrix<T,Eigen::Dynamic,Eigen::Dynamic> _rhsT;
+    ndarray::Array<T,3,3> _bandDerivatives;   // only allocated when derivatives are first computed
+    typename Workspace::Matrix _normalTile;  // empty if there is a cutoff
+    typename Workspace::Matrix _normalScratch;  // empty if there is a cutoff
+};
+
+} // anonymous
+
+//===========================================================================================================
+//================== MatrixBuilder ==========================================================================
+//===========================================================================================================
+
+template <typename T>
+MatrixBuilder<T>::MatrixBuilder(
+    ndarray::Array<T const,1,1> const & x,
+    ndarray::Array<T const,1,1> const & y,
+    int order
 ) {
     *this = MatrixBuilderFactory<T>(x, y, order)();
 }
@@ -759,6 +3156,16 @@ MatrixBuilder<T>::MatrixBuilder(
     *this = MatrixBuilderFactory<T>(x, y, basis, psf)();
 }
 
+template <typename T>
+MatrixBuilder<T>::MatrixBuilder(
+    ndarray::Array<T const,1,1> const & x,
+    ndarray::Array<T const,1,1> const & y,
+    MultiShapeletBasis const & basis,
+    std::vector<MultiShapeletFunction> const & psfs
+) {
+    *this = MatrixBuilderFactory<T>(x, y, basis, psfs)();
+}
+
 template <typename T>
 int MatrixBuilder<T>::getDataSize() const {
     return _impl->getDataSize();
@@ -776,6 +3183,13 @@ ndarray::Array<T,2,-2> MatrixBuilder<T>::allocateOutput() const {
     return t.transpose();
 }
 
+template <typename T>
+ndarray::Array<T,3,3> MatrixBuilder<T>::allocateOutput(int n) const {
+    ndarray::Array<T,3,3> t = ndarray::allocate(ndarray::makeVector(n, getBasisSize(), getDataSize()));
+    t.deep() = 0.0;
+    return t;
+}
+
 template <typename T>
 void MatrixBuilder<T>::operator()(
     ndarray::Array<T,2,-1> const & output,
@@ -784,6 +3198,140 @@ void MatrixBuilder<T>::operator()(
     _impl->buildMatrix(output, ellipse);
 }
 
+template <typename T>
+void MatrixBuilder<T>::operator()(
+    ndarray::Array<T,3,3> const & output,
+    ndarray::Array<double const,2,1> const & parameters,
+    std::string const & ellipseType
+) const {
+    LSST_THROW_IF_NE(
+        parameters.template getSize<1>(), 5,
+        pex::exceptions::LengthError,
+        "Number of ellipse parameters (%d) is not 5 (%d)"
+    );
+    LSST_THROW_IF_NE(
+        output.template getSize<0>(), parameters.template getSize<0>(),
+        pex::exceptions::LengthError,
+        "Number of output matrices (%d) does not match number of parameter rows (%d)"
+    );
+    LSST_THROW_IF_NE(
+        output.template getSize<1>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Output basis dimension (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        output.template getSize<2>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Output data dimension (%d) does not match data size (%d)"
+    );
+    afw::geom::ellipses::Ellipse ellipse(afw::geom::ellipses::BaseCore::make(ellipseType), geom::Point2D());
+    typename ndarray::Array<T,3,3>::Iterator outIter = output.begin();
+    for (
+        ndarray::Array<double const,2,1>::Iterator i = parameters.begin();
+        i != parameters.end();
+        ++i, ++outIter
+    ) {
+        outIter->deep() = 0.0;
+        ellipse.setParameterVector(ndarray::asEigenMatrix(*i));
+        _impl->buildMatrix(outIter->transpose(), ellipse);
+    }
+}
+
+template <typename T>
+void MatrixBuilder<T>::computeDerivatives(
+    ndarray::Array<T,2,-1> const & output,
+    ndarray::Array<T,3,3> const & derivatives,
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    LSST_THROW_IF_NE(
+        derivatives.template getSize<0>(), 5,
+        pex::exceptions::LengthError,
+        "Number of derivative matrices (%d) is not 5 (%d)"
+    );
+    LSST_THROW_IF_NE(
+        derivatives.template getSize<1>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Derivative basis dimension (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        derivatives.template getSize<2>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Derivative data dimension (%d) does not match data size (%d)"
+    );
+    output.deep() = 0.0;
+    derivatives.deep() = 0.0;
+    _impl->buildDerivatives(output, derivatives, ellipse);
+}
+
+template <typename T>
+void MatrixBuilder<T>::computeModel(
+    ndarray::Array<T,1,1> const & output,
+    ndarray::Array<T const,1,1> const & coefficients,
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    LSST_THROW_IF_NE(
+        output.template getSize<0>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Output size (%d) does not match data size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        coefficients.template getSize<0>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Number of coefficients (%d) does not match basis size (%d)"
+    );
+    output.deep() = 0.0;
+    _impl->buildModel(output, coefficients, ellipse);
+}
+
+template <typename T>
+void MatrixBuilder<T>::computeNormalEquations(
+    ndarray::Array<T,2,2> const & gram,
+    ndarray::Array<T,1,1> const & projection,
+    ndarray::Array<T const,1,1> const & weights,
+    ndarray::Array<T const,1,1> const & data,
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    LSST_THROW_IF_NE(
+        gram.template getSize<0>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Number of Gram matrix rows (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        gram.template getSize<1>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Number of Gram matrix columns (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        projection.template getSize<0>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Projection size (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        weights.template getSize<0>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Number of weights (%d) does not match data size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        data.template getSize<0>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Data vector size (%d) does not match data size (%d)"
+    );
+    if (!(ndarray::asEigenArray(weights) >= 0).all()) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            "Weights must be nonnegative"
+        );
+    }
+    gram.deep() = 0.0;
+    projection.deep() = 0.0;
+    _impl->buildNormalEquations(gram, projection, weights, data, ellipse);
+    // only the lower triangle is accumulated; copy it to the upper triangle
+    auto gramMatrix = ndarray::asEigenMatrix(gram);
+    for (int j = 1; j < gramMatrix.cols(); ++j) {
+        gramMatrix.col(j).head(j) = gramMatrix.row(j).head(j).transpose();
+    }
+}
+
 template <typename T>
 MatrixBuilder<T>::MatrixBuilder(PTR(Impl) impl) :
     _impl(impl)
@@ -869,6 +3417,23 @@ bool isSimple(MultiShapeletBasisComponent const & component) {
         );
 }
 
+// helper functions for the next two ctors: test if all components of a MultiShapeletBasis or
+// MultiShapeletFunction are Gaussians (i.e. have order zero)
+bool isGaussianMixture(MultiShapeletBasis const & basis) {
+    for (MultiShapeletBasis::Iterator i = basis.begin(); i != basis.end(); ++i) {
+        if (i->getOrder() != 0) return false;
+    }
+    return true;
+}
+
+bool isGaussianMixture(MultiShapeletFunction const & psf) {
+    typedef MultiShapeletFunction::ComponentList::const_iterator Iterator;
+    for (Iterator i = psf.getComponents().begin(); i != psf.getComponents().end(); ++i) {
+        if (i->getOrder() != 0) return false;
+    }
+    return true;
+}
+
 } // anonymous
 
 template <typename T>
@@ -877,7 +3442,9 @@ MatrixBuilderFactory<T>::MatrixBuilderFactory(
     ndarray::Array<T const,1,1> const & y,
     MultiShapeletBasis const & basis
 ) {
-    if (basis.getComponentCount() == 1) {
+    if (isGaussianMixture(basis)) {
+        _impl = std::make_shared< typename GaussianMixtureImpl<T>::Factory >(x, y, basis);
+    } else if (basis.getComponentCount() == 1) {
         MultiShapeletBasisComponent const & component = *basis.begin();
         if (isSimple(component)) {
             _impl = std::make_shared< typename ShapeletImpl<T>::Factory >(x, y, component.getOrder());
@@ -898,7 +3465,9 @@ MatrixBuilderFactory<T>::MatrixBuilderFactory(
     MultiShapeletBasis const & basis,
     MultiShapeletFunction const & psf
 ) {
-    if (basis.getComponentCount() == 1 && psf.getComponents().size() == 1u) {
+    if (isGaussianMixture(basis) && isGaussianMixture(psf)) {
+        _impl = std::make_shared< typename GaussianMixtureImpl<T>::Factory >(x, y, basis, psf);
+    } else if (basis.getComponentCount() == 1 && psf.getComponents().size() == 1u) {
         ShapeletFunction const & psfComponent = psf.getComponents().front();
         MultiShapeletBasisComponent const & component = *basis.begin();
         if (isSimple(component)) {
@@ -915,6 +3484,30 @@ MatrixBuilderFactory<T>::MatrixBuilderFactory(
     }
 }
 
+template <typename T>
+MatrixBuilderFactory<T>::MatrixBuilderFactory(
+    ndarray::Array<T const,1,1> const & x,
+    ndarray::Array<T const,1,1> const & y,
+    MultiShapeletBasis const & basis,
+    std::vector<MultiShapeletFunction> const & psfs
+) {
+    if (psfs.empty()) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            "At least one band is required"
+        );
+    }
+    for (std::size_t b = 0; b < psfs.size(); ++b) {
+        if (psfs[b].getComponents().empty()) {
+            throw LSST_EXCEPT(
+                pex::exceptions::InvalidParameterError,
+                (boost::format("PSF for band %d has no components") % b).str()
+            );
+        }
+    }
+    _impl = std::make_shared< typename MultiBandImpl<T>::Factory >(x, y, basis, psfs);
+}
+
 template <typename T>
 int MatrixBuilderFactory<T>::getDataSize() const { return _impl->getDataSize(); }
 
@@ -924,6 +3517,71 @@ int MatrixBuilderFactory<T>::getBasisSize() const { return _impl->getBasisSize()
 template <typename T>
 int MatrixBuilderFactory<T>::computeWorkspace() const { return _impl->computeWorkspace(); }
 
+template <typename T>
+int MatrixBuilderFactory<T>::getThreadCount() const { return _impl->getThreadCount(); }
+
+template <typename T>
+void MatrixBuilderFactory<T>::setThreadCount(int threadCount) {
+    if (threadCount < 1) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Thread count (%d) must be positive") % threadCount).str()
+        );
+    }
+    _impl->setThreadCount(threadCount);
+}
+
+template <typename T>
+void MatrixBuilderFactory<T>::setConvolutionCache(int capacity, double quantum) {
+    if (capacity < 0) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Cache capacity (%d) must not be negative") % capacity).str()
+        );
+    }
+    if (!(quantum >= 0.0)) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Cache quantum (%g) must not be negative") % quantum).str()
+        );
+    }
+    _impl->setConvolutionCache(capacity, quantum);
+}
+
+template <typename T>
+double MatrixBuilderFactory<T>::getCutoff() const { return _impl->getCutoff(); }
+
+template <typename T>
+void MatrixBuilderFactory<T>::setCutoff(double cutoff) {
+    if (!(cutoff >= 0.0)) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Cutoff (%g) must not be negative") % cutoff).str()
+        );
+    }
+    _impl->setCutoff(cutoff);
+}
+
+template <typename T>
+int MatrixBuilderFactory<T>::getTileSize() const { return _impl->getTileSize(); }
+
+template <typename T>
+void MatrixBuilderFactory<T>::setTileSize(int tileSize) {
+    if (tileSize < 0) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Tile size (%d) must not be negative") % tileSize).str()
+        );
+    }
+    _impl->setTileSize(tileSize);
+}
+
+template <typename T>
+bool MatrixBuilderFactory<T>::getDerivativesEnabled() const { return _impl->getDerivativesEnabled(); }
+
+template <typename T>
+void MatrixBuilderFactory<T>::setDerivativesEnabled(bool enabled) { _impl->setDerivativesEnabled(enabled); }
+
 template <typename T>
 MatrixBuilder<T> MatrixBuilderFactory<T>::operator()() const {
     return MatrixBuilder<T>(_impl->makeBuilderImpl());
@@ -934,6 +3592,305 @@ MatrixBuilder<T> MatrixBuilderFactory<T>::operator()(Workspace & workspace) cons
     return MatrixBuilder<T>(_impl->makeBuilderImpl(workspace));
 }
 
+//===========================================================================================================
+//================== MatrixBuilderPool ======================================================================
+//===========================================================================================================
+
+template <typename T>
+MatrixBuilderPool<T>::MatrixBuilderPool(Factory const & factory, int size) :
+    _factory(factory), _size(0)
+{
+    _available.reserve(size);
+    for (int n = 0; n < size; ++n) {
+        _available.push_back(_factory()._impl);
+        ++_size;
+    }
+}
+
+template <typename T>
+MatrixBuilder<T> MatrixBuilderPool<T>::acquire() {
+    PTR(BuilderImpl) impl;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        if (!_available.empty()) {
+            impl = _available.back();
+            _available.pop_back();
+            _acquired.insert(impl.get());
+            return Builder(impl);
+        }
+    }
+    // Create the new builder without holding the lock; the factory is not modified by this.
+    impl = _factory()._impl;
+    std::lock_guard<std::mutex> lock(_mutex);
+    ++_size;
+    _acquired.insert(impl.get());
+    return Builder(impl);
+}
+
+template <typename T>
+void MatrixBuilderPool<T>::release(Builder const & builder) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (_acquired.erase(builder._impl.get()) == 0u) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            "MatrixBuilder was not acquired from this pool, or has already been released"
+        );
+    }
+    _available.push_back(builder._impl);
+}
+
+template <typename T>
+int MatrixBuilderPool<T>::getSize() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _size;
+}
+
+template <typename T>
+int MatrixBuilderPool<T>::getAvailable() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _available.size();
+}
+
+//===========================================================================================================
+//================== MultiEpochMatrixBuilder ================================================================
+//===========================================================================================================
+
+template <typename T>
+MultiEpochMatrixBuilder<T>::MultiEpochMatrixBuilder(
+    std::vector<Factory> const & factories,
+    std::vector<geom::AffineTransform> const & transforms
+) : _transforms(transforms), _threadCount(1)
+{
+    LSST_THROW_IF_NE(
+        transforms.size(), factories.size(),
+        pex::exceptions::LengthError,
+        "Number of transforms (%d) does not match number of factories (%d)"
+    );
+    if (factories.empty()) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            "At least one epoch is required"
+        );
+    }
+    _builders.reserve(factories.size());
+    _offsets.reserve(factories.size() + 1);
+    _offsets.push_back(0);
+    for (std::size_t n = 0; n < factories.size(); ++n) {
+        LSST_THROW_IF_NE(
+            factories[n].getBasisSize(), factories.front().getBasisSize(),
+            pex::exceptions::LengthError,
+            "Basis size of epoch factory (%d) does not match basis size of first epoch (%d)"
+        );
+        _builders.push_back(factories[n]());
+        _offsets.push_back(_offsets.back() + factories[n].getDataSize());
+    }
+    _derivatives.resize(factories.size());
+    for (std::size_t n = 0; n < factories.size(); ++n) {
+        if (factories[n].getDerivativesEnabled()) {
+            _derivatives[n] = _builders[n].allocateOutput(5);
+        }
+    }
+}
+
+template <typename T>
+int MultiEpochMatrixBuilder<T>::getDataOffset(int epoch) const {
+    if (epoch < 0 || epoch > getEpochCount()) {
+        throw LSST_EXCEPT(
+            pex::exceptions::OutOfRangeError,
+            (boost::format("Epoch index (%d) out of range [0, %d]") % epoch % getEpochCount()).str()
+        );
+    }
+    return _offsets[epoch];
+}
+
+template <typename T>
+MatrixBuilder<T> const & MultiEpochMatrixBuilder<T>::getBuilder(int epoch) const {
+    if (epoch < 0 || epoch >= getEpochCount()) {
+        throw LSST_EXCEPT(
+            pex::exceptions::OutOfRangeError,
+            (boost::format("Epoch index (%d) out of range [0, %d)") % epoch % getEpochCount()).str()
+        );
+    }
+    return _builders[epoch];
+}
+
+template <typename T>
+geom::AffineTransform const & MultiEpochMatrixBuilder<T>::getTransform(int epoch) const {
+    if (epoch < 0 || epoch >= getEpochCount()) {
+        throw LSST_EXCEPT(
+            pex::exceptions::OutOfRangeError,
+            (boost::format("Epoch index (%d) out of range [0, %d)") % epoch % getEpochCount()).str()
+        );
+    }
+    return _transforms[epoch];
+}
+
+template <typename T>
+void MultiEpochMatrixBuilder<T>::setThreadCount(int threadCount) {
+    if (threadCount < 1) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Thread count (%d) must be positive") % threadCount).str()
+        );
+    }
+    _threadCount = threadCount;
+    std::size_t const nThreads = std::min<std::size_t>(threadCount, _builders.size());
+    if (nThreads == 1u) {
+        _team.reset();
+    } else if (!_team || _team->getSize() != nThreads) {
+        _team = std::make_shared<detail::ThreadTeam>(nThreads);
+    }
+}
+
+template <typename T>
+ndarray::Array<T,2,-2> MultiEpochMatrixBuilder<T>::allocateOutput() const {
+    ndarray::Array<T,2,2> t = ndarray::allocate(getBasisSize(), getDataSize());
+    t.deep() = 0.0;
+    return t.transpose();
+}
+
+template <typename T>
+ndarray::Array<T,3,3> MultiEpochMatrixBuilder<T>::allocateOutput(int n) const {
+    ndarray::Array<T,3,3> t = ndarray::allocate(ndarray::makeVector(n, getBasisSize(), getDataSize()));
+    t.deep() = 0.0;
+    return t;
+}
+
+template <typename T>
+template <typename Function>
+void MultiEpochMatrixBuilder<T>::forEachEpoch(Function function) const {
+    if (!_team) {
+        for (std::size_t n = 0; n < _builders.size(); ++n) {
+            function(n);
+        }
+        return;
+    }
+    // Each thread handles every nThreads-th epoch, using only those epochs' builders.
+    std::size_t const nThreads = _team->getSize();
+    _team->run(
+        [this, nThreads, &function](std::size_t thread) {
+            for (std::size_t n = thread; n < _builders.size(); n += nThreads) {
+                function(n);
+            }
+        }
+    );
+}
+
+template <typename T>
+void MultiEpochMatrixBuilder<T>::operator()(
+    ndarray::Array<T,2,-1> const & output,
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    LSST_THROW_IF_NE(
+        output.template getSize<0>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Number of output rows (%d) does not match data size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        output.template getSize<1>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Number of output columns (%d) does not match basis size (%d)"
+    );
+    output.deep() = 0.0;
+    forEachEpoch(
+        [this, &output, &ellipse](std::size_t n) {
+            afw::geom::ellipses::Ellipse epochEllipse(ellipse);
+            epochEllipse.transform(_transforms[n]).inPlace();
+            _builders[n](output[ndarray::view(_offsets[n], _offsets[n + 1])()], epochEllipse);
+        }
+    );
+}
+
+template <typename T>
+void MultiEpochMatrixBuilder<T>::computeDerivatives(
+    ndarray::Array<T,2,-1> const & output,
+    ndarray::Array<T,3,3> const & derivatives,
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    LSST_THROW_IF_NE(
+        output.template getSize<0>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Number of output rows (%d) does not match data size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        output.template getSize<1>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Number of output columns (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        derivatives.template getSize<0>(), 5,
+        pex::exceptions::LengthError,
+        "Number of derivative matrices (%d) is not 5 (%d)"
+    );
+    LSST_THROW_IF_NE(
+        derivatives.template getSize<1>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Derivative basis dimension (%d) does not match basis size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        derivatives.template getSize<2>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Derivative data dimension (%d) does not match data size (%d)"
+    );
+    output.deep() = 0.0;
+    derivatives.deep() = 0.0;
+    // allocate any missing per-epoch derivatives here, rather than in the threads
+    for (std::size_t n = 0; n < _builders.size(); ++n) {
+        if (_derivatives[n].isEmpty()) {
+            _derivatives[n] = _builders[n].allocateOutput(5);
+        }
+    }
+    forEachEpoch(
+        [this, &output, &derivatives, &ellipse](std::size_t n) {
+            afw::geom::ellipses::Ellipse epochEllipse(ellipse);
+            // derivative of the epoch ellipse parameters with respect to the reference ellipse parameters
+            Eigen::Matrix<double,5,5> jacobian = epochEllipse.transform(_transforms[n]).d();
+            epochEllipse.transform(_transforms[n]).inPlace();
+            int const begin = _offsets[n];
+            int const size = _offsets[n + 1] - begin;
+            ndarray::Array<T,3,3> const & epochDerivatives = _derivatives[n];
+            _builders[n].computeDerivatives(
+                output[ndarray::view(begin, _offsets[n + 1])()], epochDerivatives, epochEllipse
+            );
+            for (int i = 0; i < 5; ++i) {
+                auto block = ndarray::asEigenMatrix(derivatives[i]).middleCols(begin, size);
+                for (int j = 0; j < 5; ++j) {
+                    if (jacobian(j, i) != 0.0) {
+                        block += T(jacobian(j, i)) * ndarray::asEigenMatrix(epochDerivatives[j]);
+                    }
+                }
+            }
+        }
+    );
+}
+
+template <typename T>
+void MultiEpochMatrixBuilder<T>::computeModel(
+    ndarray::Array<T,1,1> const & output,
+    ndarray::Array<T const,1,1> const & coefficients,
+    afw::geom::ellipses::Ellipse const & ellipse
+) const {
+    LSST_THROW_IF_NE(
+        output.template getSize<0>(), getDataSize(),
+        pex::exceptions::LengthError,
+        "Output size (%d) does not match data size (%d)"
+    );
+    LSST_THROW_IF_NE(
+        coefficients.template getSize<0>(), getBasisSize(),
+        pex::exceptions::LengthError,
+        "Number of coefficients (%d) does not match basis size (%d)"
+    );
+    forEachEpoch(
+        [this, &output, &coefficients, &ellipse](std::size_t n) {
+            afw::geom::ellipses::Ellipse epochEllipse(ellipse);
+            epochEllipse.transform(_transforms[n]).inPlace();
+            _builders[n].computeModel(
+                output[ndarray::view(_offsets[n], _offsets[n + 1])], coefficients, epochEllipse
+            );
+        }
+    );
+}
+
 //===========================================================================================================
 //================== Explicit Instantiation =================================================================
 //===========================================================================================================
@@ -941,7 +3898,9 @@ MatrixBuilder<T> MatrixBuilderFactory<T>::operator()(Workspace & workspace) cons
 #define INSTANTIATE(T)                                          \
     template class MatrixBuilder<T>;                            \
     template class MatrixBuilderFactory<T>;                     \
-    template class MatrixBuilderWorkspace<T>
+    template class MatrixBuilderWorkspace<T>;                   \
+    template class MatrixBuilderPool<T>;                        \
+    template class MultiEpochMatrixBuilder<T>
 
 INSTANTIATE(float);
 INSTANTIATE(double);
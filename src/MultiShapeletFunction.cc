@@ -99,18 +99,34 @@ ndarray::Array<double,1,1> MultiShapeletFunctionEvaluator::operator()(
     ndarray::Array<double const,1> const & y
 ) const {
     ndarray::Array<double,1,1> output = ndarray::allocate(x.getSize<0>());
-    for (int i = 0, n = x.getSize<0>(); i < n; ++i) {
-        output[i] = (*this)(x[i], y[i]);
+    output.deep() = 0.0;
+    for (ComponentList::const_iterator i = _components.begin(); i != _components.end(); ++i) {
+        i->_addToArray(output, x, y);
+    }
+    return output;
+}
+
+ndarray::Array<float,1,1> MultiShapeletFunctionEvaluator::operator()(
+    ndarray::Array<float const,1> const & x,
+    ndarray::Array<float const,1> const & y
+) const {
+    ndarray::Array<double,1,1> tmp = ndarray::allocate(x.getSize<0>());
+    tmp.deep() = 0.0;
+    for (ComponentList::const_iterator i = _components.begin(); i != _components.end(); ++i) {
+        i->_addToArray(tmp, x, y);
     }
+    ndarray::Array<float,1,1> output = ndarray::allocate(x.getSize<0>());
+    ndarray::asEigenArray(output) = ndarray::asEigenArray(tmp).cast<float>();
     return output;
 }
 
 void MultiShapeletFunctionEvaluator::addToImage(
     ndarray::Array<double,2,1> const & array,
-    geom::Point2I const & xy0
+    geom::Point2I const & xy0,
+    double truncation
 ) const {
     for (ComponentList::const_iterator i = _components.begin(); i != _components.end(); ++i) {
-        i->addToImage(array, xy0);
+        i->addToImage(array, xy0, truncation);
     }
 }
 
@@ -22,6 +22,8 @@
  * see <http://www.lsstcorp.org/LegalNotices/>.
  */
 
+#include <algorithm>
+
 #include "boost/format.hpp"
 
 #include "ndarray/eigen.h"
@@ -45,6 +47,65 @@ static inline void validateSize(int expected, int actual) {
     }
 }
 
+/*
+ *  Fill the columns of 'output' with the 1-d Gauss-Hermite functions of order 0 through output.cols()-1,
+ *  evaluated at each of the coordinates in 'coord'.
+ *
+ *  This uses the same recurrence (and the same sequence of floating-point operations) as
+ *  GaussHermiteEvaluator uses for a single point, just applied to many points at once.
+ */
+void fillGaussHermite1d(Eigen::ArrayXXd & output, Eigen::ArrayXd const & coord) {
+    for (int i = 0; i < coord.size(); ++i) {
+        output(i, 0) = BASIS_NORMALIZATION * std::exp(-0.5*coord[i]*coord[i]);
+    }
+    if (output.cols() > 1) {
+        output.col(1) = rationalSqrt(2, 1) * coord * output.col(0);
+    }
+    for (int n = 2; n < output.cols(); ++n) {
+        output.col(n) = rationalSqrt(2, n) * coord * output.col(n-1)
+            - rationalSqrt(n - 1, n) * output.col(n-2);
+    }
+}
+
+/*
+ *  Evaluate the packed HERMITE expansion 'coefficients' (without any normalization) at each of the
+ *  transformed (unit-circle) coordinates (u, v), setting 'sum' to the results.
+ *
+ *  The Hermite workspace arrays must have one row per point and (order + 1) columns.
+ */
+void sumGaussHermite2d(
+    ndarray::Array<double const,1,1> const & coefficients,
+    Eigen::ArrayXd const & u,
+    Eigen::ArrayXd const & v,
+    Eigen::ArrayXXd & uHermite,
+    Eigen::ArrayXXd & vHermite,
+    Eigen::ArrayXd & sum
+) {
+    int const order = uHermite.cols() - 1;
+    fillGaussHermite1d(uHermite, u);
+    fillGaussHermite1d(vHermite, v);
+    sum.setZero();
+    for (PackedIndex i; i.getOrder() <= order; ++i) {
+        sum += coefficients[i.getIndex()] * uHermite.col(i.getX()) * vHermite.col(i.getY());
+    }
+}
+
+// Number of points evaluated at once by the array evaluation kernel; small enough that the workspace
+// for a chunk stays in cache, large enough to amortize the per-chunk overheads.
+int const ARRAY_CHUNK_SIZE = 256;
+
+/*
+ *  Shrink the half-open range of pixel positions [begin, end) to the pixels within radius of center.
+ *  Returns false if the result is empty.
+ */
+bool clipRange(int & begin, int & end, double center, double radius) {
+    double const lower = std::ceil(center - radius);
+    double const upper = std::floor(center + radius) + 1.0;
+    if (lower > begin) begin = static_cast<int>(std::min(lower, static_cast<double>(end)));
+    if (upper < end) end = static_cast<int>(std::max(upper, static_cast<double>(begin)));
+    return begin < end;
+}
+
 } // anonymous
 
 double const ShapeletFunction::FLUX_FACTOR = 2.0 * std::sqrt(geom::PI);
@@ -189,22 +250,131 @@ ndarray::Array<double,1,1> ShapeletFunctionEvaluator::operator()(
     ndarray::Array<double const,1> const & y
 ) const {
     ndarray::Array<double,1,1> output = ndarray::allocate(x.getSize<0>());
-    for (int i = 0, n = x.getSize<0>(); i < n; ++i) {
-        output[i] = (*this)(x[i], y[i]);
-    }
+    output.deep() = 0.0;
+    _addToArray(output, x, y);
+    return output;
+}
+
+ndarray::Array<float,1,1> ShapeletFunctionEvaluator::operator()(
+    ndarray::Array<float const,1> const & x,
+    ndarray::Array<float const,1> const & y
+) const {
+    ndarray::Array<double,1,1> tmp = ndarray::allocate(x.getSize<0>());
+    tmp.deep() = 0.0;
+    _addToArray(tmp, x, y);
+    ndarray::Array<float,1,1> output = ndarray::allocate(x.getSize<0>());
+    ndarray::asEigenArray(output) = ndarray::asEigenArray(tmp).cast<float>();
     return output;
 }
 
+template <typename T>
+void ShapeletFunctionEvaluator::_addToArray(
+    ndarray::Array<double,1,1> const & output,
+    ndarray::Array<T const,1> const & x,
+    ndarray::Array<T const,1> const & y
+) const {
+    LSST_THROW_IF_NE(
+        y.template getSize<0>(), x.template getSize<0>(),
+        pex::exceptions::LengthError,
+        "Number of y coordinates (%d) does not match number of x coordinates (%d)"
+    );
+    LSST_THROW_IF_NE(
+        output.getSize<0>(), x.template getSize<0>(),
+        pex::exceptions::LengthError,
+        "Output array size (%d) does not match number of points (%d)"
+    );
+    typedef Eigen::Map<Eigen::Array<T,Eigen::Dynamic,1> const,0,Eigen::InnerStride<>> CoordMap;
+    int const size = x.template getSize<0>();
+    int const order = _h.getOrder();
+    Eigen::Matrix2d const linear = _transform.getLinear().getMatrix();
+    Eigen::Vector2d const translation = _transform.getTranslation().asEigen();
+    Eigen::ArrayXd u;
+    Eigen::ArrayXd v;
+    Eigen::ArrayXXd uHermite;
+    Eigen::ArrayXXd vHermite;
+    Eigen::ArrayXd sum;
+    for (int begin = 0; begin < size; begin += ARRAY_CHUNK_SIZE) {
+        int const n = std::min(ARRAY_CHUNK_SIZE, size - begin);
+        if (u.size() != n) {  // only happens for the first and last chunks
+            u.resize(n);
+            v.resize(n);
+            uHermite.resize(n, order + 1);
+            vHermite.resize(n, order + 1);
+            sum.resize(n);
+        }
+        CoordMap xChunk(x.getData() + begin*x.template getStride<0>(), n,
+                        Eigen::InnerStride<>(x.template getStride<0>()));
+        CoordMap yChunk(y.getData() + begin*y.template getStride<0>(), n,
+                        Eigen::InnerStride<>(y.template getStride<0>()));
+        u = (linear(0, 0) * xChunk.template cast<double>() + linear(0, 1) * yChunk.template cast<double>())
+            + translation[0];
+        v = (linear(1, 0) * xChunk.template cast<double>() + linear(1, 1) * yChunk.template cast<double>())
+            + translation[1];
+        sumGaussHermite2d(_coefficients, u, v, uHermite, vHermite, sum);
+        ndarray::asEigenArray(output).segment(begin, n) += _normalization * sum;
+    }
+}
+
+template void ShapeletFunctionEvaluator::_addToArray(
+    ndarray::Array<double,1,1> const &, ndarray::Array<float const,1> const &,
+    ndarray::Array<float const,1> const &
+) const;
+
+template void ShapeletFunctionEvaluator::_addToArray(
+    ndarray::Array<double,1,1> const &, ndarray::Array<double const,1> const &,
+    ndarray::Array<double const,1> const &
+) const;
+
 void ShapeletFunctionEvaluator::addToImage(
     ndarray::Array<double,2,1> const & array,
-    geom::Point2I const & xy0
+    geom::Point2I const & xy0,
+    double truncation
 ) const {
+    if (truncation < 0.0) {
+        throw LSST_EXCEPT(
+            pex::exceptions::InvalidParameterError,
+            (boost::format("Truncation factor (%g) must not be negative") % truncation).str()
+        );
+    }
+    if (truncation > 0.0) {
+        // The inverse of the grid transform maps the unit circle to the function's ellipse, so its rows
+        // give the half-widths of the ellipse's bounding box, and its translation the ellipse center.
+        geom::AffineTransform const inverse = _transform.inverted();
+        Eigen::Matrix2d const m = inverse.getLinear().getMatrix();
+        int xBegin = xy0.getX();
+        int xEnd = xy0.getX() + array.getSize<1>();
+        int yBegin = xy0.getY();
+        int yEnd = xy0.getY() + array.getSize<0>();
+        if (!clipRange(xBegin, xEnd, inverse.getTranslation().getX(), truncation * m.row(0).norm()) ||
+            !clipRange(yBegin, yEnd, inverse.getTranslation().getY(), truncation * m.row(1).norm())) {
+            return;
+        }
+        ndarray::Array<double,2,1> subArray = array[
+            ndarray::view(yBegin - xy0.getY(), yEnd - xy0.getY())(xBegin - xy0.getX(), xEnd - xy0.getX())
+        ];
+        addToImage(subArray, geom::Point2I(xBegin, yBegin));
+        return;
+    }
+    // Rather than evaluating the function one pixel at a time, we evaluate a full row at once: the
+    // transformed coordinates are linear in the column position, and the 1-d Gauss-Hermite functions
+    // of each transformed coordinate can be computed for all pixels in a row with array operations.
+    int const width = array.getSize<1>();
+    if (width == 0) return;
+    int const order = _h.getOrder();
+    Eigen::Matrix2d const linear = _transform.getLinear().getMatrix();
+    Eigen::Vector2d const translation = _transform.getTranslation().asEigen();
+    Eigen::ArrayXd const x = Eigen::ArrayXd::LinSpaced(width, xy0.getX(), xy0.getX() + width - 1);
+    Eigen::ArrayXd u(width);
+    Eigen::ArrayXd v(width);
+    Eigen::ArrayXXd uHermite(width, order + 1);
+    Eigen::ArrayXXd vHermite(width, order + 1);
+    Eigen::ArrayXd sum(width);
     ndarray::Array<double,2,1>::Iterator yIter = array.begin();
     for (int y = xy0.getY(); yIter != array.end(); ++y, ++yIter) {
-        ndarray::Array<double,2,1>::Reference::Iterator xIter = yIter->begin();
-        for (int x = xy0.getX(); xIter != yIter->end(); ++x, ++xIter) {
-            *xIter += (*this)(x, y);
-        }
+        u = (linear(0, 0) * x + linear(0, 1) * y) + translation[0];
+        v = (linear(1, 0) * x + linear(1, 1) * y) + translation[1];
+        sumGaussHermite2d(_coefficients, u, v, uHermite, vHermite, sum);
+        Eigen::Map<Eigen::ArrayXd>(yIter->getData(), width) += _normalization * sum;
     }
 }
 
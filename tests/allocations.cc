@@ -0,0 +1,192 @@
+// -*- LSST-C++ -*-
+/*
+ * LSST Data Management System
+ * Copyright 2008-2017 LSST Corporation.
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <http://www.lsstcorp.org/LegalNotices/>.
+ */
+
+/*
+ * Tests that the compute-into-buffer HermiteTransformMatrix API and GaussHermiteConvolution::evaluate
+ * do not allocate memory when they are called repeatedly, and that MatrixBuilder::computeNormalEquations
+ * does not allocate memory for each tile, which the Python tests cannot observe.
+ */
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE shapelet_allocations
+
+#include <cmath>
+#include <cstdlib>
+#include <new>
+
+#include "boost/test/unit_test.hpp"
+
+#include "lsst/shapelet/GaussHermiteConvolution.h"
+#include "lsst/shapelet/HermiteTransformMatrix.h"
+#include "lsst/shapelet/MatrixBuilder.h"
+#include "lsst/shapelet/MultiShapeletBasis.h"
+#include "lsst/shapelet/ShapeletFunction.h"
+
+namespace {
+
+// Number of calls to the global operator new (including the array form) so far.
+long allocationCount = 0;
+
+} // anonymous
+
+void * operator new(std::size_t size) {
+    ++allocationCount;
+    if (void * p = std::malloc(size ? size : 1)) {
+        return p;
+    }
+    throw std::bad_alloc();
+}
+
+void * operator new[](std::size_t size) { return operator new(size); }
+
+void operator delete(void * p) noexcept { std::free(p); }
+
+void operator delete[](void * p) noexcept { std::free(p); }
+
+void operator delete(void * p, std::size_t) noexcept { std::free(p); }
+
+void operator delete[](void * p, std::size_t) noexcept { std::free(p); }
+
+namespace lsst { namespace shapelet {
+
+namespace {
+
+namespace ellipses = afw::geom::ellipses;
+
+ShapeletFunction makePsf(int order) {
+    ShapeletFunction psf(order, HERMITE, ellipses::Ellipse(ellipses::Axes(1.5, 1.2, 0.3)));
+    for (int n = 0; n < psf.getCoefficients().getSize<0>(); ++n) {
+        psf.getCoefficients()[n] = 1.0 / (n + 1);
+    }
+    return psf;
+}
+
+// Return the number of allocations made by the second of two identical calls to computeNormalEquations.
+long countNormalEquationAllocations(MatrixBuilderFactory<double> & factory, int tileSize) {
+    factory.setTileSize(tileSize);
+    MatrixBuilder<double> builder = factory();
+    int const dataSize = builder.getDataSize();
+    int const basisSize = builder.getBasisSize();
+    ndarray::Array<double,2,2> gram = ndarray::allocate(basisSize, basisSize);
+    ndarray::Array<double,1,1> projection = ndarray::allocate(basisSize);
+    ndarray::Array<double,1,1> weights = ndarray::allocate(dataSize);
+    ndarray::Array<double,1,1> data = ndarray::allocate(dataSize);
+    for (int i = 0; i < dataSize; ++i) {
+        weights[i] = 1.0 + 0.01*i;
+        data[i] = std::cos(0.1*i);
+    }
+    ellipses::Ellipse const ellipse(ellipses::Axes(1.3, 0.9, 0.2));
+    builder.computeNormalEquations(gram, projection, weights, data, ellipse);
+    long const count = allocationCount;
+    builder.computeNormalEquations(gram, projection, weights, data, ellipse);
+    return allocationCount - count;
+}
+
+} // anonymous
+
+BOOST_AUTO_TEST_CASE(HermiteTransformMatrixCompute) {
+    HermiteTransformMatrix htm(8);
+    Eigen::Matrix2d transforms[3];
+    transforms[0] << 1.1, 0.2, -0.3, 0.9;
+    transforms[1] << 0.7, -0.4, 0.1, 1.3;
+    transforms[2] << 2.0, 0.5, 0.5, 1.5;
+    for (int order = 0; order <= htm.getOrder(); ++order) {
+        Eigen::MatrixXd result;
+        Eigen::VectorXd workspace;
+        htm.compute(transforms[0], order, result, workspace);
+        double const * data = result.data();
+        long const count = allocationCount;
+        for (int i = 0; i < 3; ++i) {
+            htm.compute(transforms[i], order, result, workspace);
+        }
+        BOOST_CHECK_EQUAL(allocationCount, count);
+        BOOST_CHECK_EQUAL(result.data(), data);
+        BOOST_CHECK(result.isApprox(htm.compute(transforms[2], order)));
+    }
+}
+
+BOOST_AUTO_TEST_CASE(GaussHermiteConvolutionEvaluate) {
+    ellipses::Ellipse const cores[] = {
+        ellipses::Ellipse(ellipses::Quadrupole(2.0, 3.0, 1.0)),
+        ellipses::Ellipse(ellipses::Quadrupole(1.5, 1.0, -0.2)),
+        ellipses::Ellipse(ellipses::Quadrupole(4.0, 3.5, 0.5)),
+    };
+    for (int psfOrder = 0; psfOrder <= 4; psfOrder += 2) {
+        for (int colOrder = 0; colOrder <= 8; colOrder += 4) {
+            GaussHermiteConvolution convolution(colOrder, makePsf(psfOrder));
+            // evaluate() convolves its argument in place, so we reset it from cores before each call
+            ellipses::Ellipse ellipse(cores[0]);
+            ndarray::Array<double const,2,2> first = convolution.evaluate(ellipse);
+            double const * data[3];
+            long const count = allocationCount;
+            for (int i = 0; i < 3; ++i) {
+                ellipse = cores[i];
+                data[i] = convolution.evaluate(ellipse).getData();
+            }
+            BOOST_CHECK_EQUAL(allocationCount, count);
+            // the result is always written to the same storage
+            for (int i = 0; i < 3; ++i) {
+                BOOST_CHECK_EQUAL(data[i], first.getData());
+            }
+        }
+    }
+}
+
+BOOST_AUTO_TEST_CASE(MatrixBuilderNormalEquations) {
+    int const dataSize = 60;
+    ndarray::Array<double,1,1> x = ndarray::allocate(dataSize);
+    ndarray::Array<double,1,1> y = ndarray::allocate(dataSize);
+    for (int i = 0; i < dataSize; ++i) {
+        x[i] = 0.5*(i % 10) - 2.0;
+        y[i] = 0.6*(i / 10) - 1.5;
+    }
+    MultiShapeletBasis basis(4);
+    for (int n = 0; n < 2; ++n) {
+        ndarray::Array<double,2,2> matrix = ndarray::allocate(computeSize(2 + n), 4);
+        for (int i = 0; i < matrix.getSize<0>(); ++i) {
+            for (int j = 0; j < 4; ++j) {
+                matrix[i][j] = 1.0 / (i + j + n + 1);
+            }
+        }
+        basis.addComponent(0.8 + n, 2 + n, matrix);
+    }
+    MultiShapeletFunction psf;
+    psf.getComponents().push_back(makePsf(2));
+    std::vector<MultiShapeletFunction> psfs(2, psf);
+    MatrixBuilderFactory<double> factories[] = {
+        MatrixBuilderFactory<double>(x, y, 4),
+        MatrixBuilderFactory<double>(x, y, 4, makePsf(2)),
+        MatrixBuilderFactory<double>(x, y, basis),
+        MatrixBuilderFactory<double>(x, y, basis, psf),
+        MatrixBuilderFactory<double>(x, y, basis, psfs),
+    };
+    for (MatrixBuilderFactory<double> & factory : factories) {
+        // evaluating one point per tile must not allocate any more than evaluating them all in one tile
+        BOOST_CHECK_EQUAL(
+            countNormalEquationAllocations(factory, 1),
+            countNormalEquationAllocations(factory, dataSize)
+        );
+    }
+}
+
+}} // namespace lsst::shapelet
@@ -86,6 +86,46 @@ class HermiteTransformMatrixTestCase(lsst.shapelet.tests.ShapeletTestCase):
                         v2 += m[i, j] * self.ht(jnx)(origPoint.getX()) * self.ht(jny)(origPoint.getY())
                     self.assertFloatsAlmostEqual(v1, v2, rtol=1E-11)
 
+    @staticmethod
+    def computeReference(coeff, coeffInv, transform, order):
+        """Direct (slow) evaluation of the transform matrix, summing every term of the expansion."""
+        size = lsst.shapelet.computeSize(order)
+        result = np.zeros((size, size), dtype=float)
+
+        def binomial(n, a, b):
+            return [scipy.special.comb(n, k, exact=True) * a**(n - k) * b**k for k in range(n + 1)]
+
+        for j, jx, jy in lsst.shapelet.HermiteIndexGenerator(order):
+            for k, kx, ky in lsst.shapelet.HermiteIndexGenerator(order):
+                if (kx + ky) < (jx + jy) or (kx + ky - jx - jy) % 2:
+                    continue
+                element = 0.0
+                for m in range(order + 1):
+                    bm = binomial(m, transform[0, 0], transform[0, 1])
+                    for p in range(m + 1):
+                        for n in range(order - m + 1):
+                            bn = binomial(n, transform[1, 0], transform[1, 1])
+                            for q in range(n + 1):
+                                element += (coeff[kx, m] * coeff[ky, n] * bm[p] * bn[q] *
+                                            coeffInv[m + n - p - q, jx] * coeffInv[p + q, jy])
+                result[k, j] = element
+        return result
+
+    @unittest.skipIf(scipy is None, "Test requires SciPy")
+    def testTransformMatrixReference(self):
+        """Test the optimized compute() against a direct summation over all terms."""
+        coeff = self.htm.getCoefficientMatrix()
+        coeffInv = self.htm.getInverseCoefficientMatrix()
+        transforms = [np.identity(2), np.array([[0.0, 2.0], [-1.5, 0.0]])]
+        transforms.extend(np.random.randn(3, 2, 2))
+        for transform in transforms:
+            for order in range(self.order + 1):
+                m = self.htm.compute(transform, order)
+                check = self.computeReference(coeff, coeffInv, transform, order)
+                self.assertFloatsAlmostEqual(m, check, rtol=1E-13, atol=1E-14)
+            self.assertFloatsAlmostEqual(self.htm.compute(transform), self.htm.compute(transform, self.order),
+                                         rtol=0.0, atol=0.0)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
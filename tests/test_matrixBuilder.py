@@ -25,6 +25,7 @@ import unittest
 import numpy as np
 
 import lsst.geom
+import lsst.pex.exceptions
 import lsst.utils.tests
 import lsst.afw.geom.ellipses
 import lsst.shapelet.tests
@@ -234,6 +235,24 @@ class MatrixBuilderTestCase(lsst.shapelet.tests.ShapeletTestCase):
         checkVector = checkEvaluator(self.xD, self.yD)
         self.assertFloatsAlmostEqual(np.dot(matrixD, coefficients), checkVector, rtol=1E-12, atol=1E-12)
 
+    def testConvolvedMatrixBuilderPrecision(self):
+        """Test that single-precision convolved and remapped-convolved builders agree with double-precision
+        ones to within a small multiple of float round-off, relative to the largest matrix element.
+        """
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.4, 0.9, 0.5),
+                                                 lsst.geom.Point2D(0.2, -0.1))
+        size = 5
+        for psfOrder in (0, 2, 4):
+            psf = self.makeRandomShapeletFunction(order=psfOrder)
+            for order in (2, 4, 6):
+                basis = lsst.shapelet.MultiShapeletBasis(size)
+                basis.addComponent(1.7, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+                for args in [(order, psf), (basis, lsst.shapelet.MultiShapeletFunction([psf]))]:
+                    matrixF = lsst.shapelet.MatrixBuilderF.Factory(self.xF, self.yF, *args)()(ellipse)
+                    matrixD = lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, *args)()(ellipse)
+                    error = np.abs(matrixF - matrixD).max() / np.abs(matrixD).max()
+                    self.assertLess(error, 1E-5, msg="psfOrder=%d, order=%d" % (psfOrder, order))
+
     def testCompoundMatrixBuilder(self):
         ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(4.0, 3.0, 1.0),
                                                  lsst.geom.Point2D(3.2, 1.0))
@@ -330,6 +349,681 @@ class MatrixBuilderTestCase(lsst.shapelet.tests.ShapeletTestCase):
         checkVector = checkEvaluator(self.xD, self.yD)
         self.assertFloatsAlmostEqual(np.dot(matrix1D, coefficients), checkVector, rtol=1E-13, atol=1E-14)
 
+    def testGroupedCompoundMatrixBuilder(self):
+        # components with the same order are evaluated together with one matrix product; check that
+        # against evaluating each component separately
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(4.0, 3.0, 1.0),
+                                                 lsst.geom.Point2D(3.2, 1.0))
+        radii = [0.5, 0.7, 1.2, 2.0]
+        orders = [3, 4, 4, 4]
+        size = 6
+        psfEllipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.5, 1.2, 0.3))
+        psf = lsst.shapelet.MultiShapeletFunction(
+            [self.makeRandomShapeletFunction(order=2, ellipse=psfEllipse, scale=scale)
+             for scale in (1.0, 2.0)]
+        )
+        matrices = [np.random.randn(lsst.shapelet.computeSize(order), size) for order in orders]
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order, matrix in zip(radii, orders, matrices):
+            basis.addComponent(radius, order, matrix)
+        singlePsfs = [lsst.shapelet.MultiShapeletFunction([component]) for component in psf.getComponents()]
+        for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                    (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-13)]:
+            matrix = Builder(x, y, basis)(ellipse)
+            convolvedMatrix = Builder(x, y, basis, psf)(ellipse)
+            check = np.zeros(matrix.shape, dtype=matrix.dtype)
+            convolvedCheck = np.zeros(matrix.shape, dtype=matrix.dtype)
+            for radius, order, remapMatrix in zip(radii, orders, matrices):
+                single = lsst.shapelet.MultiShapeletBasis(size)
+                single.addComponent(radius, order, remapMatrix)
+                check += Builder(x, y, single)(ellipse)
+                for singlePsf in singlePsfs:
+                    convolvedCheck += Builder(x, y, single, singlePsf)(ellipse)
+            self.assertFloatsAlmostEqual(matrix, check, rtol=rtol, atol=rtol*np.abs(check).max())
+            self.assertFloatsAlmostEqual(convolvedMatrix, convolvedCheck, rtol=rtol,
+                                         atol=rtol*np.abs(convolvedCheck).max())
+
+    def testBatchedMatrixBuilder(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(4.0, 3.0, 1.0),
+                                                 lsst.geom.Point2D(3.2, 1.0))
+        radii = [0.7, 1.2]
+        orders = [4, 3]
+        size = 8
+        psf = self.makeRandomMultiShapeletFunction()
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in zip(radii, orders):
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        parameters = np.zeros((5, 5), dtype=float)
+        for i in range(parameters.shape[0]):
+            ellipse.getCore().scale(1.1)
+            ellipse.setCenter(lsst.geom.Point2D(*np.random.randn(2)))
+            parameters[i, :] = ellipse.getParameterVector()
+        ellipseType = ellipse.getCore().getName()
+        for Builder, x, y in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF),
+                              (lsst.shapelet.MatrixBuilderD, self.xD, self.yD)]:
+            builder = Builder(x, y, basis, psf)
+            output = builder.allocateOutput(parameters.shape[0])
+            self.assertEqual(output.shape, (parameters.shape[0], size, x.size))
+            # fill with garbage to check that outputs are zeroed before filling
+            output[:, :, :] = 1.0
+            builder(output, parameters, ellipseType)
+            allocated = builder(parameters, ellipseType)
+            self.assertFloatsAlmostEqual(output, allocated, rtol=0.0, atol=0.0)
+            for i in range(parameters.shape[0]):
+                ellipse.setParameterVector(parameters[i, :])
+                # same code, called one ellipse at a time
+                self.assertFloatsAlmostEqual(output[i].transpose(), builder(ellipse), rtol=0.0, atol=0.0)
+            with self.assertRaises(lsst.pex.exceptions.LengthError):
+                builder(parameters[:, :3].copy(), ellipseType)
+            with self.assertRaises(lsst.pex.exceptions.LengthError):
+                builder(output[1:], parameters, ellipseType)
+
+    def testThreadedCompoundMatrixBuilder(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(4.0, 3.0, 1.0),
+                                                 lsst.geom.Point2D(3.2, 1.0))
+        radii = [0.7, 1.2, 2.5]
+        orders = [4, 3, 2]
+        size = 8
+        psf = self.makeRandomMultiShapeletFunction()
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in zip(radii, orders):
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        nComponents = len(radii) * len(psf.getComponents())
+        for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                    (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-13)]:
+            serialFactory = Builder.Factory(x, y, basis, psf)
+            self.assertEqual(serialFactory.getThreadCount(), 1)
+            serialMatrix = serialFactory()(ellipse)
+            for nThreads in (2, 4, nComponents + 2):
+                factory = Builder.Factory(x, y, basis, psf)
+                factory.setThreadCount(nThreads)
+                self.assertEqual(factory.getThreadCount(), nThreads)
+                nPartitions = min(nThreads, nComponents)
+                # each partition needs its own workspace, and all but the first a partial matrix and model,
+                # while there is only one tile (and scratch for its weights and data) for normal equations,
+                # which here holds all data points
+                tileWorkspace = x.size*(size + 2)
+                self.assertEqual(factory.computeWorkspace(),
+                                 (serialFactory.computeWorkspace() - tileWorkspace)*nPartitions +
+                                 (nPartitions - 1)*x.size*(size + 1) + tileWorkspace)
+                workspace = Builder.Workspace(factory.computeWorkspace())
+                builder = factory(workspace)
+                self.assertEqual(workspace.getRemaining(), 0)
+                matrix1 = builder(ellipse)
+                matrix2 = builder(ellipse)
+                # threaded reduction is deterministic
+                self.assertFloatsAlmostEqual(matrix1, matrix2, rtol=0.0, atol=0.0)
+                # but may differ from the serial result by round-off
+                self.assertFloatsAlmostEqual(matrix1, serialMatrix, rtol=rtol, atol=rtol)
+            with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+                serialFactory.setThreadCount(0)
+
+    def testSharedGridCompoundMatrixBuilder(self):
+        """Test that unconvolved multi-component builders, whose components share a single transformed
+        grid of data points unless there is a cutoff, agree with the sum of single-component builders.
+        """
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.2, 0.8, 0.4),
+                                                 lsst.geom.Point2D(0.2, -0.1))
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        componentBases = []
+        for radius, order in [(0.5, 2), (1.0, 4), (1.8, 3)]:
+            matrix = np.random.randn(lsst.shapelet.computeSize(order), size)
+            basis.addComponent(radius, order, matrix)
+            componentBasis = lsst.shapelet.MultiShapeletBasis(size)
+            componentBasis.addComponent(radius, order, matrix)
+            componentBases.append(componentBasis)
+        coefficients = np.random.randn(size)
+        weights = np.random.uniform(0.5, 2.0, size=self.xD.size)
+        data = np.random.randn(self.xD.size)
+        for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                    (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-13)]:
+            factory = Builder.Factory(x, y, basis)
+            componentFactories = [Builder.Factory(x, y, b) for b in componentBases]
+            for threadCount, cutoff, tileSize in [(1, 0.0, 0), (2, 0.0, 7), (3, 0.0, 0), (1, 2.5, 0),
+                                                  (2, 2.5, 7)]:
+                for f in [factory] + componentFactories:
+                    f.setThreadCount(threadCount)
+                    f.setCutoff(cutoff)
+                    f.setTileSize(tileSize)
+                check = sum(f()(ellipse).astype(np.float64) for f in componentFactories)
+                workspace = Builder.Workspace(factory.computeWorkspace())
+                builder = factory(workspace)
+                self.assertEqual(workspace.getRemaining(), 0)
+                matrix = builder(ellipse)
+                atol = rtol*np.abs(check).max()
+                self.assertFloatsAlmostEqual(matrix, check, rtol=rtol, atol=atol)
+                checkModel = np.dot(check, coefficients)
+                self.assertFloatsAlmostEqual(builder.computeModel(coefficients.astype(x.dtype), ellipse),
+                                             checkModel, rtol=rtol, atol=rtol*np.abs(checkModel).max())
+                checkGram = np.dot(check.transpose()*weights, check)
+                checkProjection = np.dot(check.transpose(), weights*data)
+                gram, projection = builder.computeNormalEquations(weights.astype(x.dtype),
+                                                                  data.astype(x.dtype), ellipse)
+                self.assertFloatsAlmostEqual(gram, checkGram, rtol=rtol,
+                                             atol=rtol*np.abs(checkGram).max())
+                self.assertFloatsAlmostEqual(projection, checkProjection, rtol=rtol,
+                                             atol=rtol*np.abs(checkProjection).max())
+
+    def testMatrixBuilderDerivatives(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.5, 1.1, 0.6),
+                                                 lsst.geom.Point2D(0.3, -0.2))
+        size = 6
+        function = self.makeRandomShapeletFunction(order=3)
+        psf = self.makeRandomMultiShapeletFunction()
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.7, 3), (1.2, 2)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        builders = [
+            lsst.shapelet.MatrixBuilderD(self.xD, self.yD, function.getOrder()),
+            lsst.shapelet.MatrixBuilderD(self.xD, self.yD, function.getOrder(), psf.getComponents()[0]),
+            lsst.shapelet.MatrixBuilderD(self.xD, self.yD, basis),
+            lsst.shapelet.MatrixBuilderD(self.xD, self.yD, basis, psf),
+        ]
+        parameters = ellipse.getParameterVector()
+        for builder in builders:
+            output = builder.allocateOutput()
+            derivatives = builder.allocateOutput(5)
+            # fill with garbage to check that outputs are zeroed before filling
+            output[:, :] = 1.0
+            derivatives[:, :, :] = 1.0
+            builder.computeDerivatives(output, derivatives, ellipse)
+            self.assertFloatsAlmostEqual(output, builder(ellipse), rtol=0.0, atol=0.0)
+            perturbed = lsst.afw.geom.ellipses.Ellipse(ellipse)
+            for i in range(5):
+                step = 1E-5*max(abs(parameters[i]), 1.0)
+                p = parameters.copy()
+                p[i] += step
+                perturbed.setParameterVector(p)
+                upper = builder(perturbed)
+                p[i] -= 2*step
+                perturbed.setParameterVector(p)
+                lower = builder(perturbed)
+                self.assertFloatsAlmostEqual(derivatives[i].transpose(), (upper - lower)/(2*step),
+                                             rtol=1E-6, atol=1E-7)
+            with self.assertRaises(lsst.pex.exceptions.LengthError):
+                builder.computeDerivatives(output, derivatives[1:], ellipse)
+
+    def testMatrixBuilderCutoff(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(0.6, 0.4, 0.3),
+                                                 lsst.geom.Point2D(0.2, -0.1))
+        order = 2
+        size = 6
+        radii = [0.5, 1.5]
+        matrices = [np.random.randn(lsst.shapelet.computeSize(order), size) for radius in radii]
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, matrix in zip(radii, matrices):
+            basis.addComponent(radius, order, matrix)
+        cutoff = 2.5
+
+        def computeMask(radius):
+            scaled = lsst.afw.geom.ellipses.Ellipse(ellipse)
+            scaled.scale(radius)
+            transform = scaled.getGridTransform()
+            points = [transform(lsst.geom.Point2D(x, y)) for x, y in zip(self.xD, self.yD)]
+            return np.array([p.getX()**2 + p.getY()**2 <= cutoff**2 for p in points])
+
+        # points beyond the cutoff for a component get no contribution from that component
+        simpleCheck = lsst.shapelet.MatrixBuilderD(self.xD, self.yD, order)(ellipse)
+        simpleCheck[np.logical_not(computeMask(1.0))] = 0.0
+        compoundCheck = np.zeros((self.xD.size, size), dtype=float)
+        for radius, matrix in zip(radii, matrices):
+            single = lsst.shapelet.MultiShapeletBasis(size)
+            single.addComponent(radius, order, matrix)
+            mask = computeMask(radius)
+            compoundCheck[mask] += lsst.shapelet.MatrixBuilderD(self.xD, self.yD, single)(ellipse)[mask]
+
+        for args, check in [((order,), simpleCheck), ((basis,), compoundCheck)]:
+            factory = lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, *args)
+            self.assertEqual(factory.getCutoff(), 0.0)
+            with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+                factory.setCutoff(-1.0)
+            full = factory()(ellipse)
+            # a cutoff beyond all points has no effect
+            factory.setCutoff(1E8)
+            self.assertFloatsAlmostEqual(factory()(ellipse), full, rtol=1E-14, atol=1E-14)
+            factory.setCutoff(cutoff)
+            self.assertEqual(factory.getCutoff(), cutoff)
+            workspace = lsst.shapelet.MatrixBuilderD.Workspace(factory.computeWorkspace())
+            builder = factory(workspace)
+            self.assertEqual(workspace.getRemaining(), 0)
+            matrix = builder(ellipse)
+            self.assertFloatsAlmostEqual(matrix, check, rtol=1E-13, atol=1E-14)
+            # the derivative path uses the same points
+            output = builder.allocateOutput()
+            derivatives = builder.allocateOutput(5)
+            builder.computeDerivatives(output, derivatives, ellipse)
+            self.assertFloatsAlmostEqual(output, matrix, rtol=1E-14, atol=1E-14)
+
+    def testConvolvedMatrixBuilderCutoff(self):
+        # pixel-grid data, so the spatial index bands are whole rows
+        y, x = np.mgrid[-6:7, -5:6]
+        x = x.flatten().astype(float)
+        y = y.flatten().astype(float)
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.2, 0.8, 0.3),
+                                                 lsst.geom.Point2D(0.4, -0.3))
+        psf = self.makeRandomMultiShapeletFunction(nComponents=1)
+        order = 2
+        size = 4
+        radii = [0.5, 1.5]
+        matrices = [np.random.randn(lsst.shapelet.computeSize(order), size) for radius in radii]
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, matrix in zip(radii, matrices):
+            basis.addComponent(radius, order, matrix)
+        cutoff = 2.0
+
+        def computeMask(radius):
+            # the cutoff applies to the convolved ellipse, whose moments are the sums of the moments
+            scaled = lsst.afw.geom.ellipses.Quadrupole(ellipse.getCore())
+            scaled.scale(radius)
+            psfEllipse = psf.getComponents()[0].getEllipse()
+            psfCore = lsst.afw.geom.ellipses.Quadrupole(psfEllipse.getCore())
+            convolved = lsst.afw.geom.ellipses.Ellipse(
+                lsst.afw.geom.ellipses.Quadrupole(scaled.getIxx() + psfCore.getIxx(),
+                                                  scaled.getIyy() + psfCore.getIyy(),
+                                                  scaled.getIxy() + psfCore.getIxy()),
+                lsst.geom.Point2D(ellipse.getCenter().getX() + psfEllipse.getCenter().getX(),
+                                  ellipse.getCenter().getY() + psfEllipse.getCenter().getY())
+            )
+            transform = convolved.getGridTransform()
+            points = [transform(lsst.geom.Point2D(xi, yi)) for xi, yi in zip(x, y)]
+            return np.array([p.getX()**2 + p.getY()**2 <= cutoff**2 for p in points])
+
+        simpleCheck = lsst.shapelet.MatrixBuilderD(x, y, order, psf.getComponents()[0])(ellipse)
+        simpleCheck[np.logical_not(computeMask(1.0))] = 0.0
+        compoundCheck = np.zeros((x.size, size), dtype=float)
+        for radius, matrix in zip(radii, matrices):
+            single = lsst.shapelet.MultiShapeletBasis(size)
+            single.addComponent(radius, order, matrix)
+            mask = computeMask(radius)
+            compoundCheck[mask] += lsst.shapelet.MatrixBuilderD(x, y, single, psf)(ellipse)[mask]
+
+        for args, check in [((order, psf.getComponents()[0]), simpleCheck), ((basis, psf), compoundCheck)]:
+            factory = lsst.shapelet.MatrixBuilderD.Factory(x, y, *args)
+            factory.setCutoff(cutoff)
+            matrix = factory()(ellipse)
+            self.assertFloatsAlmostEqual(matrix, check, rtol=1E-13, atol=1E-14)
+            # the mask should actually remove some points, but not all of them
+            self.assertTrue((check == 0.0).all(axis=1).any())
+            self.assertFalse((check == 0.0).all())
+
+    def testMatrixBuilderTileSize(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(0.6, 0.4, 0.3),
+                                                 lsst.geom.Point2D(0.2, -0.1))
+        psf = self.makeRandomMultiShapeletFunction(nComponents=1)
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.5, 2), (1.5, 3)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        for args in [(3,), (3, psf.getComponents()[0]), (basis,), (basis, psf)]:
+            factory = lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, *args)
+            self.assertEqual(factory.getTileSize(), 0)
+            with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+                factory.setTileSize(-1)
+            for cutoff in (0.0, 2.5):
+                factory.setCutoff(cutoff)
+                factory.setTileSize(0)
+                full = factory()(ellipse)
+                # a tile size that doesn't divide the number of points evenly
+                factory.setTileSize(7)
+                self.assertEqual(factory.getTileSize(), 7)
+                self.assertFloatsAlmostEqual(factory()(ellipse), full, rtol=1E-13, atol=1E-14)
+
+    def testMatrixBuilderDerivativesEnabled(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(0.9, 0.7, 0.3),
+                                                 lsst.geom.Point2D(0.1, -0.2))
+        psf = self.makeRandomMultiShapeletFunction(nComponents=2)
+        size = 4
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        gaussianBasis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.5, 2), (1.5, 1)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+            gaussianBasis.addComponent(radius, 0, np.random.randn(1, size))
+        for args in [(3,), (3, psf.getComponents()[0]), (basis,), (basis, psf), (gaussianBasis,)]:
+            factory = lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, *args)
+            self.assertFalse(factory.getDerivativesEnabled())
+            for cutoff in (0.0, 2.5):
+                factory.setCutoff(cutoff)
+                factory.setDerivativesEnabled(False)
+                smallWorkspace = factory.computeWorkspace()
+                builder = factory()
+                output = builder.allocateOutput()
+                derivatives = builder.allocateOutput(5)
+                # buffers for derivatives are allocated on first use, and then reused
+                for i in range(2):
+                    builder.computeDerivatives(output, derivatives, ellipse)
+                factory.setDerivativesEnabled(True)
+                self.assertTrue(factory.getDerivativesEnabled())
+                self.assertGreater(factory.computeWorkspace(), smallWorkspace)
+                reservedOutput = builder.allocateOutput()
+                reservedDerivatives = builder.allocateOutput(5)
+                factory().computeDerivatives(reservedOutput, reservedDerivatives, ellipse)
+                self.assertFloatsAlmostEqual(output, reservedOutput, rtol=0.0, atol=0.0)
+                self.assertFloatsAlmostEqual(derivatives, reservedDerivatives, rtol=0.0, atol=0.0)
+
+    def testMatrixBuilderModel(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(0.6, 0.4, 0.3),
+                                                 lsst.geom.Point2D(0.2, -0.1))
+        psf = self.makeRandomMultiShapeletFunction(nComponents=2)
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.5, 2), (1.5, 3), (2.0, 3)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        for args in [(3,), (3, psf.getComponents()[0]), (basis,), (basis, psf)]:
+            for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                        (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-13)]:
+                factory = Builder.Factory(x, y, *args)
+                for threadCount, cutoff in [(1, 0.0), (2, 0.0), (1, 2.5)]:
+                    factory.setThreadCount(threadCount)
+                    factory.setCutoff(cutoff)
+                    builder = factory()
+                    coefficients = np.random.randn(builder.getBasisSize()).astype(x.dtype)
+                    check = np.dot(builder(ellipse), coefficients)
+                    self.assertFloatsAlmostEqual(builder.computeModel(coefficients, ellipse), check,
+                                                 rtol=rtol, atol=rtol*np.abs(check).max())
+                    # the output is zeroed first
+                    output = np.ones(builder.getDataSize(), dtype=x.dtype)
+                    builder.computeModel(output, coefficients, ellipse)
+                    self.assertFloatsAlmostEqual(output, check, rtol=rtol, atol=rtol*np.abs(check).max())
+                    with self.assertRaises(lsst.pex.exceptions.LengthError):
+                        builder.computeModel(coefficients[:-1], ellipse)
+
+    def testGaussianMixtureMatrixBuilder(self):
+        """Test builders for bases and PSFs in which every component has order zero, which use a dedicated
+        mixture-of-Gaussians implementation, against equivalent order-one bases and PSFs with zero
+        higher-order terms, which use the general implementation.
+        """
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.2, 0.8, 0.4),
+                                                 lsst.geom.Point2D(0.3, -0.2))
+        size = 3
+        gaussianBasis = lsst.shapelet.MultiShapeletBasis(size)
+        paddedBasis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius in [0.4, 0.9, 1.6]:
+            matrix = np.random.randn(1, size)
+            gaussianBasis.addComponent(radius, 0, matrix)
+            paddedBasis.addComponent(radius, 1, np.concatenate([matrix, np.zeros((2, size))]))
+        gaussianPsf = []
+        paddedPsf = []
+        for i in range(2):
+            gaussian = self.makeRandomShapeletFunction(order=0)
+            padded = lsst.shapelet.ShapeletFunction(1, gaussian.getBasisType(), gaussian.getEllipse())
+            padded.getCoefficients()[0] = gaussian.getCoefficients()[0]
+            gaussianPsf.append(gaussian)
+            paddedPsf.append(padded)
+        gaussianPsf = lsst.shapelet.MultiShapeletFunction(gaussianPsf)
+        paddedPsf = lsst.shapelet.MultiShapeletFunction(paddedPsf)
+        for gaussianArgs, paddedArgs in [((gaussianBasis,), (paddedBasis,)),
+                                         ((gaussianBasis, gaussianPsf), (paddedBasis, paddedPsf))]:
+            for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                        (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-13)]:
+                gaussianFactory = Builder.Factory(x, y, *gaussianArgs)
+                paddedFactory = Builder.Factory(x, y, *paddedArgs)
+                for threadCount, cutoff, tileSize in [(1, 0.0, 0), (2, 0.0, 7), (1, 2.5, 0)]:
+                    for factory in (gaussianFactory, paddedFactory):
+                        factory.setThreadCount(threadCount)
+                        factory.setCutoff(cutoff)
+                        factory.setTileSize(tileSize)
+                    builder = gaussianFactory()
+                    self.checkAccessors(builder, size)
+                    check = paddedFactory()(ellipse)
+                    atol = rtol*np.abs(check).max()
+                    self.assertFloatsAlmostEqual(builder(ellipse), check, rtol=rtol, atol=atol)
+                    coefficients = np.random.randn(size).astype(x.dtype)
+                    self.assertFloatsAlmostEqual(builder.computeModel(coefficients, ellipse),
+                                                 np.dot(check, coefficients), rtol=rtol,
+                                                 atol=rtol*np.abs(np.dot(check, coefficients)).max())
+                    output = builder.allocateOutput()
+                    derivatives = builder.allocateOutput(5)
+                    paddedOutput = builder.allocateOutput()
+                    paddedDerivatives = builder.allocateOutput(5)
+                    builder.computeDerivatives(output, derivatives, ellipse)
+                    paddedFactory().computeDerivatives(paddedOutput, paddedDerivatives, ellipse)
+                    self.assertFloatsAlmostEqual(output, check, rtol=rtol, atol=atol)
+                    self.assertFloatsAlmostEqual(derivatives, paddedDerivatives, rtol=1E-5,
+                                                 atol=1E-5*np.abs(paddedDerivatives).max())
+
+    def testMatrixBuilderNormalEquations(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(0.6, 0.4, 0.3),
+                                                 lsst.geom.Point2D(0.2, -0.1))
+        psf = self.makeRandomMultiShapeletFunction(nComponents=2)
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.5, 2), (1.5, 3), (2.0, 3)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        # multi-band builders fill each tile from a single band, so we use tiles that don't divide x.size
+        psfs = [psf, self.makeRandomMultiShapeletFunction(nComponents=2), psf]
+        for args in [(3,), (3, psf.getComponents()[0]), (basis,), (basis, psf), (basis, psfs)]:
+            for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                        (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-12)]:
+                factory = Builder.Factory(x, y, *args)
+                for threadCount, cutoff, tileSize in [(1, 0.0, 0), (2, 0.0, 7), (1, 2.5, 0), (1, 2.5, 7)]:
+                    factory.setThreadCount(threadCount)
+                    factory.setCutoff(cutoff)
+                    factory.setTileSize(tileSize)
+                    builder = factory()
+                    weights = np.random.uniform(0.5, 2.0, size=builder.getDataSize()).astype(x.dtype)
+                    data = np.random.randn(builder.getDataSize()).astype(x.dtype)
+                    matrix = builder(ellipse).astype(np.float64)
+                    checkGram = np.dot(matrix.transpose()*weights, matrix)
+                    checkProjection = np.dot(matrix.transpose(), weights*data)
+                    gram, projection = builder.computeNormalEquations(weights, data, ellipse)
+                    self.assertFloatsAlmostEqual(gram, checkGram, rtol=rtol,
+                                                 atol=rtol*np.abs(checkGram).max())
+                    self.assertFloatsAlmostEqual(projection, checkProjection, rtol=rtol,
+                                                 atol=rtol*np.abs(checkProjection).max())
+                    # the outputs are zeroed first, and the Gram matrix is fully symmetric
+                    gram = np.ones((builder.getBasisSize(), builder.getBasisSize()), dtype=x.dtype)
+                    projection = np.ones(builder.getBasisSize(), dtype=x.dtype)
+                    builder.computeNormalEquations(gram, projection, weights, data, ellipse)
+                    self.assertFloatsAlmostEqual(gram, gram.transpose(), rtol=0.0, atol=0.0)
+                    self.assertFloatsAlmostEqual(gram, checkGram, rtol=rtol,
+                                                 atol=rtol*np.abs(checkGram).max())
+                    self.assertFloatsAlmostEqual(projection, checkProjection, rtol=rtol,
+                                                 atol=rtol*np.abs(checkProjection).max())
+                    with self.assertRaises(lsst.pex.exceptions.LengthError):
+                        builder.computeNormalEquations(weights[:-1], data, ellipse)
+                    with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+                        builder.computeNormalEquations(-weights, data, ellipse)
+
+    def testMatrixBuilderPool(self):
+        function = self.makeRandomShapeletFunction(order=3)
+        psf = self.makeRandomShapeletFunction(order=2)
+        factory = lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, function.getOrder(), psf)
+        pool = lsst.shapelet.MatrixBuilderD.Pool(factory, 1)
+        self.assertEqual(pool.getSize(), 1)
+        self.assertEqual(pool.getAvailable(), 1)
+        builder1 = pool.acquire()
+        builder2 = pool.acquire()
+        self.checkAccessors(builder1, factory.getBasisSize())
+        self.checkAccessors(builder2, factory.getBasisSize())
+        self.assertEqual(pool.getSize(), 2)
+        self.assertEqual(pool.getAvailable(), 0)
+        # same code, different workspace
+        self.assertFloatsAlmostEqual(builder1(function.getEllipse()), builder2(function.getEllipse()),
+                                     rtol=0.0, atol=0.0)
+        self.assertFloatsAlmostEqual(builder1(function.getEllipse()), factory()(function.getEllipse()),
+                                     rtol=0.0, atol=0.0)
+        pool.release(builder1)
+        self.assertEqual(pool.getAvailable(), 1)
+        # releasing twice, or releasing a builder from somewhere else, is an error
+        with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+            pool.release(builder1)
+        with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+            pool.release(factory())
+        # idle builders are reused rather than creating new ones
+        builder3 = pool.acquire()
+        self.assertEqual(pool.getSize(), 2)
+        pool.release(builder2)
+        pool.release(builder3)
+        self.assertEqual(pool.getAvailable(), 2)
+
+    def testMultiEpochMatrixBuilder(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.5, 1.1, 0.6),
+                                                 lsst.geom.Point2D(0.3, -0.2))
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.7, 3), (1.2, 2)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        factories = []
+        transforms = []
+        for nData in [50, 30, 40]:
+            x = np.random.randn(nData)
+            y = np.random.randn(nData)
+            factories.append(lsst.shapelet.MatrixBuilderD.Factory(x, y, basis,
+                                                                  self.makeRandomMultiShapeletFunction()))
+            linear = lsst.geom.LinearTransform(np.identity(2) + 0.1*np.random.randn(2, 2))
+            transforms.append(lsst.geom.AffineTransform(linear, lsst.geom.Extent2D(*np.random.randn(2))))
+        # the derivatives of this epoch are allocated up front, and the others on first use
+        factories[1].setDerivativesEnabled(True)
+        builder = lsst.shapelet.MatrixBuilderD.MultiEpoch(factories, transforms)
+        self.assertEqual(builder.getEpochCount(), 3)
+        self.assertEqual(builder.getDataSize(), 120)
+        self.assertEqual(builder.getBasisSize(), size)
+        self.assertEqual([builder.getDataOffset(n) for n in range(4)], [0, 50, 80, 120])
+        # each block of rows is the matrix of one epoch, evaluated with the transformed ellipse
+        check = np.concatenate([factory()(ellipse.transform(transform))
+                                for factory, transform in zip(factories, transforms)])
+        parameters = ellipse.getParameterVector()
+        for threadCount in (1, 2, 3, 2, 1):
+            builder.setThreadCount(threadCount)
+            self.assertFloatsAlmostEqual(builder(ellipse), check, rtol=1E-13, atol=1E-14)
+            coefficients = np.random.randn(size)
+            self.assertFloatsAlmostEqual(builder.computeModel(coefficients, ellipse),
+                                         np.dot(check, coefficients), rtol=1E-13, atol=1E-14)
+            output = builder.allocateOutput()
+            derivatives = builder.allocateOutput(5)
+            # fill with garbage to check that outputs are zeroed before filling
+            output[:, :] = 1.0
+            derivatives[:, :, :] = 1.0
+            builder.computeDerivatives(output, derivatives, ellipse)
+            self.assertFloatsAlmostEqual(output, check, rtol=1E-13, atol=1E-14)
+            # the per-epoch derivatives are reused, so a second call must give the same result
+            output2 = builder.allocateOutput()
+            derivatives2 = builder.allocateOutput(5)
+            builder.computeDerivatives(output2, derivatives2, ellipse)
+            self.assertFloatsAlmostEqual(derivatives2, derivatives, rtol=0.0, atol=0.0)
+            perturbed = lsst.afw.geom.ellipses.Ellipse(ellipse)
+            for i in range(5):
+                step = 1E-5*max(abs(parameters[i]), 1.0)
+                p = parameters.copy()
+                p[i] += step
+                perturbed.setParameterVector(p)
+                upper = builder(perturbed)
+                p[i] -= 2*step
+                perturbed.setParameterVector(p)
+                lower = builder(perturbed)
+                self.assertFloatsAlmostEqual(derivatives[i].transpose(), (upper - lower)/(2*step),
+                                             rtol=1E-6, atol=1E-7)
+        with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+            builder.setThreadCount(0)
+        with self.assertRaises(lsst.pex.exceptions.LengthError):
+            builder(builder.allocateOutput()[1:], ellipse)
+        with self.assertRaises(lsst.pex.exceptions.LengthError):
+            lsst.shapelet.MatrixBuilderD.MultiEpoch(factories, transforms[1:])
+        with self.assertRaises(lsst.pex.exceptions.LengthError):
+            lsst.shapelet.MatrixBuilderD.MultiEpoch(
+                factories + [lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, 2)],
+                transforms + [lsst.geom.AffineTransform()]
+            )
+
+    def testMultiBandMatrixBuilder(self):
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(1.5, 1.1, 0.6),
+                                                 lsst.geom.Point2D(0.3, -0.2))
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.7, 3), (1.2, 2)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        # PSFs with different shapes in each band
+        distinctPsfs = [self.makeRandomMultiShapeletFunction(nComponents=2) for band in range(3)]
+        # PSFs whose components have the same shapes in all bands, but different orders and coefficients,
+        # which lets the builder share the evaluation of the convolved basis functions between bands
+        shapes = [component.getEllipse() for component in distinctPsfs[0].getComponents()]
+        sharedPsfs = [
+            lsst.shapelet.MultiShapeletFunction([
+                self.makeRandomShapeletFunction(order=(band + n) % 3, ellipse=shape)
+                for n, shape in enumerate(shapes)
+            ])
+            for band in range(3)
+        ]
+        for psfs in (distinctPsfs, sharedPsfs):
+            for Builder, x, y, rtol in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF, 1E-5),
+                                        (lsst.shapelet.MatrixBuilderD, self.xD, self.yD, 1E-13)]:
+                factory = Builder.Factory(x, y, basis, psfs)
+                self.checkAccessors(factory, size)
+                self.assertEqual(factory.getDataSize(), 3*x.size)
+                for cutoff, tileSize in [(0.0, 0), (0.0, 7), (2.5, 0)]:
+                    factory.setCutoff(cutoff)
+                    factory.setTileSize(tileSize)
+                    builder = factory()
+                    bandFactories = [Builder.Factory(x, y, basis, psf) for psf in psfs]
+                    for bandFactory in bandFactories:
+                        bandFactory.setCutoff(cutoff)
+                    check = np.concatenate([bandFactory()(ellipse) for bandFactory in bandFactories])
+                    atol = rtol*np.abs(check).max()
+                    self.assertFloatsAlmostEqual(builder(ellipse), check, rtol=rtol, atol=atol)
+                    coefficients = np.random.randn(size).astype(x.dtype)
+                    self.assertFloatsAlmostEqual(builder.computeModel(coefficients, ellipse),
+                                                 np.dot(check, coefficients), rtol=rtol,
+                                                 atol=rtol*np.abs(np.dot(check, coefficients)).max())
+                    output = builder.allocateOutput()
+                    derivatives = builder.allocateOutput(5)
+                    builder.computeDerivatives(output, derivatives, ellipse)
+                    self.assertFloatsAlmostEqual(output, check, rtol=rtol, atol=atol)
+                    for band, bandFactory in enumerate(bandFactories):
+                        bandBuilder = bandFactory()
+                        bandOutput = bandBuilder.allocateOutput()
+                        bandDerivatives = bandBuilder.allocateOutput(5)
+                        bandBuilder.computeDerivatives(bandOutput, bandDerivatives, ellipse)
+                        self.assertFloatsAlmostEqual(derivatives[:, :, band*x.size:(band + 1)*x.size],
+                                                     bandDerivatives, rtol=rtol,
+                                                     atol=rtol*np.abs(bandDerivatives).max())
+        with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+            lsst.shapelet.MatrixBuilderD.Factory(self.xD, self.yD, basis, [])
+
+    def testThreadedMatrixBuilder(self):
+        """Test that builders acquired from a pool and called from Python threads (with the GIL released)
+        give the same results as calling them serially."""
+        psf = self.makeRandomMultiShapeletFunction(nComponents=2)
+        size = 6
+        basis = lsst.shapelet.MultiShapeletBasis(size)
+        for radius, order in [(0.5, 2), (1.5, 3)]:
+            basis.addComponent(radius, order, np.random.randn(lsst.shapelet.computeSize(order), size))
+        ellipses = [
+            lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Axes(np.random.uniform(1.0, 1.4),
+                                                                       np.random.uniform(0.6, 1.0),
+                                                                       np.random.uniform(-1.0, 1.0)),
+                                           lsst.geom.Point2D(*np.random.randn(2)*0.2))
+            for i in range(16)
+        ]
+        for Builder, x, y in [(lsst.shapelet.MatrixBuilderF, self.xF, self.yF),
+                              (lsst.shapelet.MatrixBuilderD, self.xD, self.yD)]:
+            factory = Builder.Factory(x, y, basis, psf)
+            pool = Builder.Pool(factory)
+            coefficients = np.random.randn(size).astype(x.dtype)
+            weights = np.random.uniform(0.5, 2.0, size=x.size).astype(x.dtype)
+            data = np.random.randn(x.size).astype(x.dtype)
+
+            def run(ellipse):
+                builder = pool.acquire()
+                try:
+                    output = builder.allocateOutput()
+                    derivatives = builder.allocateOutput(5)
+                    builder.computeDerivatives(output, derivatives, ellipse)
+                    model = builder.computeModel(coefficients, ellipse)
+                    gram, projection = builder.computeNormalEquations(weights, data, ellipse)
+                    return builder(ellipse), output, derivatives, model, gram, projection
+                finally:
+                    pool.release(builder)
+
+            self.assertThreadSafe(run, ellipses*4)
+            self.assertEqual(pool.getAvailable(), pool.getSize())
+            self.assertLessEqual(pool.getSize(), 4)
+            builder = pool.acquire()
+            try:
+                self.assertReleasesGil(builder.computeNormalEquations, weights, data, ellipses[0])
+            finally:
+                pool.release(builder)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
@@ -96,6 +96,126 @@ class ProjectionTestCase(lsst.shapelet.tests.ShapeletTestCase):
         r0 = ghc0.evaluate(ellipse2)
         self.assertFloatsAlmostEqual(rN[:15, 0], r0[:15, 0], rtol=1E-14)
 
+    def testConvolutionCache(self):
+        """Test that caching convolution matrices gives the same results as recomputing them."""
+        psf = self.makeRandomShapeletFunction(order=2)
+        ghc = lsst.shapelet.GaussHermiteConvolution(2, psf)
+        ghcCheck = lsst.shapelet.GaussHermiteConvolution(2, psf)
+        self.assertEqual(ghc.getCacheCapacity(), 0)
+        ghc.enableCache(2)
+        self.assertEqual(ghc.getCacheCapacity(), 2)
+        cores = [lsst.afw.geom.ellipses.Quadrupole(2.0, 3.0, 1.0),
+                 lsst.afw.geom.ellipses.Quadrupole(1.5, 1.0, -0.2),
+                 lsst.afw.geom.ellipses.Quadrupole(4.0, 3.5, 0.5)]
+        # core index for each call, and whether we expect that call to hit the cache
+        sequence = [(0, False), (0, True), (1, False), (0, True), (2, False), (1, False), (0, False)]
+        hits = 0
+        for n, (i, hit) in enumerate(sequence):
+            ellipse1 = lsst.afw.geom.ellipses.Ellipse(cores[i], lsst.geom.Point2D(*np.random.randn(2)))
+            ellipse2 = lsst.afw.geom.ellipses.Ellipse(ellipse1)
+            r1 = ghc.evaluate(ellipse1).copy()
+            r2 = ghcCheck.evaluate(ellipse2).copy()
+            self.assertFloatsAlmostEqual(r1, r2, rtol=0.0, atol=0.0)
+            self.assertFloatsAlmostEqual(ellipse1.getParameterVector(), ellipse2.getParameterVector(),
+                                         rtol=0.0, atol=0.0)
+            hits += hit
+            self.assertEqual(ghc.getCacheHitCount(), hits)
+            self.assertEqual(ghc.getCacheMissCount(), n + 1 - hits)
+        # with a nonzero quantum, nearby cores share a cache entry
+        ghc.enableCache(4, 1E-3)
+        self.assertEqual(ghc.getCacheHitCount(), 0)
+        self.assertEqual(ghc.getCacheMissCount(), 0)
+        r1 = ghc.evaluate(lsst.afw.geom.ellipses.Ellipse(cores[0])).copy()
+        r2 = ghc.evaluate(lsst.afw.geom.ellipses.Ellipse(
+            lsst.afw.geom.ellipses.Quadrupole(2.0 + 1E-6, 3.0, 1.0))).copy()
+        self.assertEqual(ghc.getCacheHitCount(), 1)
+        self.assertFloatsAlmostEqual(r1, r2, rtol=0.0, atol=0.0)
+        ghc.disableCache()
+        self.assertEqual(ghc.getCacheCapacity(), 0)
+        self.assertEqual(ghc.getCacheHitCount(), 0)
+        with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+            ghc.enableCache(0)
+        # caching in MatrixBuilder should give the same matrices as without
+        x = np.random.randn(50)
+        y = np.random.randn(50)
+        factory = lsst.shapelet.MatrixBuilderD.Factory(x, y, 3, psf)
+        builder1 = factory()
+        factory.setConvolutionCache(4)
+        builder2 = factory()
+        for center in np.random.randn(3, 2):
+            ellipse = lsst.afw.geom.ellipses.Ellipse(cores[0], lsst.geom.Point2D(*center))
+            self.assertFloatsAlmostEqual(builder1(ellipse), builder2(ellipse), rtol=0.0, atol=0.0)
+
+    def testRepeatedEvaluation(self):
+        """Test that reusing the scratch buffers across evaluations does not leak state between them."""
+        psf = self.makeRandomShapeletFunction(order=3)
+        cores = [lsst.afw.geom.ellipses.Quadrupole(2.0, 3.0, 1.0),
+                 lsst.afw.geom.ellipses.Quadrupole(1.5, 1.0, -0.2),
+                 lsst.afw.geom.ellipses.Quadrupole(4.0, 3.5, 0.5)]
+        ghc = lsst.shapelet.GaussHermiteConvolution(4, psf)
+        for i in [0, 1, 2, 1, 0]:
+            r1 = ghc.evaluate(lsst.afw.geom.ellipses.Ellipse(cores[i])).copy()
+            ghcCheck = lsst.shapelet.GaussHermiteConvolution(4, psf)
+            r2 = ghcCheck.evaluate(lsst.afw.geom.ellipses.Ellipse(cores[i]))
+            self.assertFloatsAlmostEqual(r1, r2, rtol=0.0, atol=0.0)
+        # computing the transform matrix at a lower order than the last call must not leave stale elements
+        htm = lsst.shapelet.HermiteTransformMatrix(6)
+        transform = np.array([[1.1, 0.2], [-0.3, 0.9]])
+        self.assertFloatsAlmostEqual(htm.compute(transform, 2), htm.compute(transform, 6)[:6, :6],
+                                     rtol=0.0, atol=0.0)
+
+    def testTableCache(self):
+        """Test that convolution tables are shared between objects with the same orders."""
+        psf = self.makeRandomShapeletFunction(order=2)
+        ellipse = lsst.afw.geom.ellipses.Ellipse(lsst.afw.geom.ellipses.Quadrupole(2.0, 3.0, 1.0))
+        lsst.shapelet.GaussHermiteConvolution.clearTableCache()
+        self.assertEqual(lsst.shapelet.GaussHermiteConvolution.getTableCacheCount(), 0)
+        self.assertEqual(lsst.shapelet.GaussHermiteConvolution.getTableCacheBytes(), 0)
+        ghc1 = lsst.shapelet.GaussHermiteConvolution(3, psf)
+        count = lsst.shapelet.GaussHermiteConvolution.getTableCacheCount()
+        nBytes = lsst.shapelet.GaussHermiteConvolution.getTableCacheBytes()
+        self.assertEqual(count, 2)
+        self.assertGreater(nBytes, 0)
+        # a second object with the same orders (but a different PSF) should reuse the same tables
+        ghc2 = lsst.shapelet.GaussHermiteConvolution(3, self.makeRandomShapeletFunction(order=2))
+        self.assertEqual(lsst.shapelet.GaussHermiteConvolution.getTableCacheCount(), count)
+        self.assertEqual(lsst.shapelet.GaussHermiteConvolution.getTableCacheBytes(), nBytes)
+        # different orders need new tables
+        lsst.shapelet.GaussHermiteConvolution(2, psf)
+        self.assertEqual(lsst.shapelet.GaussHermiteConvolution.getTableCacheCount(), count + 2)
+        r1 = ghc1.evaluate(lsst.afw.geom.ellipses.Ellipse(ellipse)).copy()
+        # clearing the cache must not affect existing objects, or results for new ones
+        lsst.shapelet.GaussHermiteConvolution.clearTableCache()
+        self.assertEqual(lsst.shapelet.GaussHermiteConvolution.getTableCacheCount(), 0)
+        self.assertFloatsAlmostEqual(ghc1.evaluate(lsst.afw.geom.ellipses.Ellipse(ellipse)), r1,
+                                     rtol=0.0, atol=0.0)
+        ghc3 = lsst.shapelet.GaussHermiteConvolution(3, psf)
+        self.assertFloatsAlmostEqual(ghc3.evaluate(lsst.afw.geom.ellipses.Ellipse(ellipse)), r1,
+                                     rtol=0.0, atol=0.0)
+        self.assertEqual(ghc2.getRowOrder(), 5)
+
+    def testThreadedConvolution(self):
+        """Test that distinct objects evaluated concurrently (with the GIL released) give the same results
+        as evaluating them serially."""
+        psfs = [self.makeRandomShapeletFunction(order=order) for order in (1, 2, 3)]
+        cores = [lsst.afw.geom.ellipses.Quadrupole(*(np.random.rand(3)*[2.0, 2.0, 0.5] + [1.0, 1.0, 0.0]))
+                 for i in range(20)]
+
+        def run(psf):
+            ghc = lsst.shapelet.GaussHermiteConvolution(4, psf)
+            ghc.enableCache(4)
+            results = []
+            for repeat in range(5):
+                for core in cores:
+                    ellipse = lsst.afw.geom.ellipses.Ellipse(core)
+                    results.append(ghc.evaluate(ellipse).copy())
+                    results.append(ellipse.getParameterVector())
+            return results
+
+        self.assertThreadSafe(run, psfs*4)
+        ghc = lsst.shapelet.GaussHermiteConvolution(8, self.makeRandomShapeletFunction(order=4))
+        self.assertReleasesGil(ghc.evaluate, lsst.afw.geom.ellipses.Ellipse(cores[0]))
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
@@ -31,6 +31,7 @@ except ImportError:
     scipy = None
 
 import lsst.utils.tests
+import lsst.pex.exceptions
 import lsst.shapelet.tests
 import lsst.afw.image
 import lsst.geom as geom
@@ -125,6 +126,79 @@ class ShapeletFunctionTestCase(lsst.shapelet.tests.ShapeletTestCase):
             self.assertFloatsAlmostEqual(image.getArray(), check)
             self.assertFloatsAlmostEqual(array, check)
 
+    def testArrayEvaluation(self):
+        # enough points to span several internal chunks, with a strided view for x
+        x = np.random.randn(2*1000)[::2] * 3.0
+        y = np.random.randn(1000) * 3.0
+        functions = self.functions + [self.makeRandomMultiShapeletFunction(nComponents=3)]
+        for f in functions:
+            ev = f.evaluate()
+            check = np.array([ev(float(px), float(py)) for px, py in zip(x, y)])
+            self.assertFloatsAlmostEqual(ev(x, y), check)
+            x32 = x.astype(np.float32)
+            y32 = y.astype(np.float32)
+            z32 = ev(x32, y32)
+            self.assertEqual(z32.dtype, np.float32)
+            check32 = np.array([ev(float(px), float(py)) for px, py in zip(x32, y32)])
+            self.assertFloatsAlmostEqual(z32, check32, rtol=1E-6, atol=1E-7)
+            with self.assertRaises(lsst.pex.exceptions.LengthError):
+                ev(x, y[:-1])
+
+    def testAddToImageTruncated(self):
+        bbox = geom.Box2I(geom.Point2I(-20, -15), geom.Extent2I(40, 32))
+        x = np.arange(bbox.getBeginX(), bbox.getEndX(), dtype=float)
+        y = np.arange(bbox.getBeginY(), bbox.getEndY(), dtype=float)
+        xg, yg = np.meshgrid(x, y)
+        for f in self.functions:
+            check = self.makeImage(f, x, y)
+            ev = f.evaluate()
+            # a large enough truncation should be the same as no truncation at all
+            image = lsst.afw.image.ImageD(bbox)
+            ev.addToImage(image, truncation=100.0)
+            self.assertFloatsAlmostEqual(image.getArray(), check)
+            for truncation in (1.0, 3.0):
+                array = np.zeros((bbox.getHeight(), bbox.getWidth()), dtype=float)
+                ev.addToImage(array, bbox.getMin(), truncation)
+                box = ellipses.Ellipse(self.ellipse)
+                box.scale(truncation)
+                box = box.computeBBox()
+                inside = np.logical_and.reduce([xg >= box.getMinX(), xg <= box.getMaxX(),
+                                                yg >= box.getMinY(), yg <= box.getMaxY()])
+                self.assertTrue(inside.any())
+                self.assertFalse(inside.all())
+                self.assertFloatsAlmostEqual(array[inside], check[inside])
+                self.assertFloatsEqual(array[np.logical_not(inside)], 0.0)
+        # a function far outside the image shouldn't touch it at all
+        f = lsst.shapelet.ShapeletFunction(self.functions[0])
+        f.getEllipse().setCenter(geom.Point2D(500.0, 500.0))
+        array = np.zeros((bbox.getHeight(), bbox.getWidth()), dtype=float)
+        f.evaluate().addToImage(array, bbox.getMin(), 3.0)
+        self.assertFloatsEqual(array, 0.0)
+        with self.assertRaises(lsst.pex.exceptions.InvalidParameterError):
+            f.evaluate().addToImage(array, bbox.getMin(), -1.0)
+
+    def testThreadedEvaluation(self):
+        """Test that distinct evaluators used concurrently (with the GIL released) give the same results
+        as using them serially."""
+        bbox = geom.Box2I(geom.Point2I(-20, -15), geom.Extent2I(40, 32))
+        x = np.random.randn(5000) * 3.0
+        y = np.random.randn(5000) * 3.0
+        functions = self.functions + [self.makeRandomMultiShapeletFunction(nComponents=3)]
+
+        def run(f):
+            ev = f.evaluate()
+            image = lsst.afw.image.ImageD(bbox)
+            array = np.zeros((bbox.getHeight(), bbox.getWidth()), dtype=float)
+            for repeat in range(5):
+                ev.addToImage(image)
+                ev.addToImage(array, bbox.getMin(), 3.0)
+            return ev(x, y), ev(x.astype(np.float32), y.astype(np.float32)), image.getArray(), array
+
+        self.assertThreadSafe(run, functions*4)
+        ev = functions[-1].evaluate()
+        self.assertReleasesGil(ev, x, y)
+        self.assertReleasesGil(ev.addToImage, lsst.afw.image.ImageD(bbox))
+
     def testConvolution(self):
         if scipy is None:
             print("Skipping convolution test; scipy could not be imported.")